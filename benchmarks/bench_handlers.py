@@ -0,0 +1,215 @@
+# bench_handlers.py
+#
+# Бенчмарк горячих путей бота без сети: лист gspread заменён таблицей в памяти
+# (benchmarks/fake_gspread.py), Bot API — ответами-заглушками. Сценарий каждого
+# пользователя: /start → «Мои баллы» → «Узнать о конкурсе» → «Подать заявку» →
+# ссылка → дата → место → название; админ параллельно смотрит рейтинг. Затем заявки
+# из журнала записываются в лист, а админ выставляет баллы в режиме проверки.
+#
+#   python -m benchmarks.bench_handlers --rows 1000,10000,100000 --users 50 --latency 0.05
+
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+# Локальная база и ключи — до импорта модулей бота. База всегда временная: бенчмарк
+# очищает её перед каждым прогоном и не должен трогать рабочую bot_data.db
+os.environ["LOCAL_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("STATE_MIRROR_INTERVAL", "0")
+# Квоту Sheets API фейковая таблица не ограничивает; чтобы замерить работу governor, задайте её явно
+os.environ.setdefault("SHEETS_QUOTA_PER_MINUTE", "1000000")
+os.environ.setdefault("SHEETS_QUOTA_BURST", "1000")
+
+from aiogram import Bot, Dispatcher, types
+
+from benchmarks.fake_gspread import FakeClient, FakeSpreadsheet, FakeWorksheet, make_dataset
+from config import ACTIVITY_SHEET_NAME, ADMIN_IDS
+from handlers import admin_handlers, application_handlers, user_handlers
+from services import sheets, sheets_async
+from services.fsm_storage import SQLiteStorage
+from services.local_db import transaction
+from services.update_dispatcher import PartitionedDispatcher
+
+BENCH_TOKEN = "123456:ABCdefGhIJKlmnoPQRstuVWXyz"
+_message_ids = itertools.count(1000)
+_update_ids = itertools.count(1)
+
+class FakeBot(Bot):
+    """Bot без сети: на каждый метод Bot API отвечает так, как ответил бы Telegram"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        data = data or {}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench"}
+        if method == "copyMessage":
+            return {"message_id": next(_message_ids)}
+        if method.startswith("send") or method.startswith("edit"):
+            return _message(int(data.get("chat_id", 0)), data.get("text", ""))
+        return True
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+def _message(user_id, text):
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text
+    }
+
+def message_update(user_id, text):
+    message = _message(user_id, text)
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return types.Update(update_id=next(_update_ids), message=message)
+
+def callback_update(user_id, data):
+    return types.Update(update_id=next(_update_ids), callback_query={
+        "id": str(next(_update_ids)),
+        "from": _user(user_id),
+        "chat_instance": str(user_id),
+        "data": data,
+        "message": _message(user_id, "👇 Главное меню:")
+    })
+
+def user_script(user_id, run):
+    return [
+        ("start", message_update(user_id, "/start")),
+        ("menu:scores", callback_update(user_id, "scores")),
+        ("menu:info", callback_update(user_id, "info")),
+        ("menu:apply", callback_update(user_id, "apply")),
+        ("app:link", message_update(user_id, f"https://vk.com/wall-{run}_{user_id}")),
+        ("app:date", message_update(user_id, "15.04.2025")),
+        ("app:location", message_update(user_id, "Снежинск")),
+        ("app:name", message_update(user_id, "памятник героям ВОВ")),
+    ]
+
+def make_dispatcher():
+    bot = FakeBot(token=BENCH_TOKEN)
+    dp = PartitionedDispatcher(bot, storage=SQLiteStorage())
+    user_handlers.register_handlers(dp)
+    application_handlers.register_application_handlers(dp)
+    admin_handlers.register_admin_handlers(dp)
+    return dp
+
+def reset_local_db():
+    """Очищает все таблицы временной базы: журнал заявок, сохранённые индексы строк, состояния"""
+    with transaction() as conn:
+        tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        for (table,) in tables:
+            conn.execute(f'DELETE FROM "{table}"')
+
+def install_fake_spreadsheet(rows, latency, jitter):
+    """Подменяет клиент gspread таблицей в памяти и сбрасывает все кэши листов и локальную базу"""
+    applications, activity = make_dataset(rows)
+    spreadsheet = FakeSpreadsheet([
+        FakeWorksheet("Заявки", applications, latency, jitter),
+        FakeWorksheet(ACTIVITY_SHEET_NAME, activity, latency, jitter),
+        FakeWorksheet("Рейтинг", [], latency, jitter),
+    ], latency, jitter)
+    sheets.get_gspread_client = lambda: FakeClient(spreadsheet)
+    sheets.worksheets.reauthorize()
+    sheets.invalidate_applications_cache()
+    reset_local_db()
+    for index in (sheets.activity_index, sheets.state_index, sheets.submission_index):
+        index.invalidate()
+    with sheets._activity_dirty_lock:
+        sheets._activity_dirty.clear()
+    sheets._activity_usernames_loaded = False
+    admin_handlers.review_buffer.clear()
+    return spreadsheet
+
+async def timed(dp, step, update, latencies):
+    started = time.perf_counter()
+    await dp.process_updates([update])
+    latencies[step].append(time.perf_counter() - started)
+
+async def run_user(dp, user_id, run, latencies):
+    for step, update in user_script(user_id, run):
+        await timed(dp, step, update, latencies)
+
+async def run_admin(dp, repeats, latencies):
+    admin_id = ADMIN_IDS[0]
+    for _ in range(repeats):
+        await timed(dp, "admin:rating", callback_update(admin_id, "admin_view_rating"), latencies)
+
+async def timed_call(step, func, latencies):
+    started = time.perf_counter()
+    result = await func()
+    latencies[step].append(time.perf_counter() - started)
+    return result
+
+async def flush_journal(latencies):
+    """Записывает в лист все заявки из журнала (как фоновая задача flush_submissions_periodically)"""
+    while await timed_call("journal:flush", sheets_async.flush_submissions, latencies) > 0:
+        pass
+
+async def review_scores(dp, scores, latencies):
+    """Админ выставляет баллы scores непроверенным заявкам в режиме проверки и записывает их"""
+    admin_id = ADMIN_IDS[0]
+    await timed(dp, "review:page", callback_update(admin_id, "admin_set_scores"), latencies)
+    pending = await sheets_async.get_pending_submissions(limit=scores)
+    for record in pending:
+        await timed(dp, "review:score", callback_update(admin_id, f"review_score_8_{record.submission_id}"), latencies)
+    await timed(dp, "review:flush", callback_update(admin_id, "review_flush"), latencies)
+    await timed_call("totals:flush", sheets_async.flush_activity_totals, latencies)
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+async def bench(rows, users, scores, latency, jitter):
+    spreadsheet = install_fake_spreadsheet(rows, latency, jitter)
+    dp = make_dispatcher()
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    latencies = defaultdict(list)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        run_admin(dp, max(1, users // 10), latencies),
+        *(run_user(dp, 500000 + index, rows, latencies) for index in range(users))
+    )
+    elapsed = time.perf_counter() - started
+    total = sum(len(values) for values in latencies.values())
+
+    await flush_journal(latencies)
+    await review_scores(dp, scores, latencies)
+    await dp.wait_idle()
+    for task in dp._worker_tasks:
+        task.cancel()
+    await dp.storage.close()
+    session = await dp.bot.get_session()
+    await session.close()
+
+    print(f"\n=== {rows} строк, {users} пользователей, задержка API {latency * 1000:.0f} мс ===")
+    print(f"{'шаг':<14}{'n':>6}{'p50, мс':>10}{'p99, мс':>10}")
+    for step, values in latencies.items():
+        print(f"{step:<14}{len(values):>6}{percentile(values, 50) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}")
+    print(f"Пропускная способность: {total / elapsed:.1f} обновлений/с ({total} за {elapsed:.2f} с)")
+    calls = spreadsheet.calls()
+    print("Вызовы Sheets API: " + ", ".join(f"{name}={count}" for name, count in calls.most_common()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков бота на фейковой таблице")
+    parser.add_argument("--rows", default="1000,10000,100000", help="размеры листа Заявки через запятую")
+    parser.add_argument("--users", type=int, default=50, help="одновременных пользователей")
+    parser.add_argument("--scores", type=int, default=50, help="сколько заявок оценивает админ")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка одного вызова API, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    args = parser.parse_args()
+
+    for rows in (int(value) for value in args.rows.split(",")):
+        asyncio.run(bench(rows, args.users, args.scores, args.latency, args.jitter))
+
+if __name__ == "__main__":
+    main()
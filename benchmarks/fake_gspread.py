@@ -0,0 +1,223 @@
+# fake_gspread.py
+#
+# Заменитель gspread для бенчмарков: таблица живёт в памяти процесса,
+# каждый вызов API спит latency секунд (как сетевой запрос) и попадает в счётчик calls.
+
+import random
+import threading
+import time
+from collections import Counter
+
+from gspread.utils import a1_to_rowcol
+
+def _parse_range(range_name):
+    """'Лист'!A2:D3 / A2:D3 / A2 → (строка1, колонка1, строка2, колонка2); колонки могут быть None"""
+    if "!" in range_name:
+        range_name = range_name.split("!", 1)[1]
+    start, _, end = range_name.partition(":")
+    end = end or start
+
+    def cell(a1):
+        if a1.isalpha():  # целая колонка: "A"
+            return None, a1_to_rowcol(a1 + "1")[1]
+        return a1_to_rowcol(a1)
+    start_row, start_col = cell(start)
+    end_row, end_col = cell(end)
+    return start_row or 1, start_col, end_row, end_col
+
+class FakeCell:
+    def __init__(self, value):
+        self.value = value
+
+class FakeWorksheet:
+    """Лист в памяти с тем подмножеством API gspread.Worksheet, которое использует бот"""
+
+    def __init__(self, title, rows, latency=0.0, jitter=0.0):
+        self.title = title
+        self.rows = [list(row) for row in rows]
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self.row_count = max(1000, len(self.rows))
+        self._lock = threading.Lock()
+
+    def _call(self, method):
+        self.calls[method] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        line = self.rows[row - 1]
+        while len(line) < col:
+            line.append("")
+        line[col - 1] = "" if value is None else str(value)
+
+    def _write(self, range_name, values):
+        start_row, start_col, _, _ = _parse_range(range_name)
+        for row_offset, line in enumerate(values):
+            for col_offset, value in enumerate(line):
+                self._set(start_row + row_offset, (start_col or 1) + col_offset, value)
+
+    def _read(self, range_name):
+        start_row, start_col, end_row, end_col = _parse_range(range_name)
+        end_row = end_row or len(self.rows)
+        start_col = start_col or 1
+        result = []
+        for line in self.rows[start_row - 1:end_row]:
+            values = line[start_col - 1:end_col] if end_col else line[start_col - 1:]
+            result.append(list(values))
+        while result and not any(result[-1]):
+            result.pop()
+        return result
+
+    # Чтение
+    def get_all_values(self, *args, **kwargs):
+        self._call("get_all_values")
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def row_values(self, row, *args, **kwargs):
+        self._call("row_values")
+        with self._lock:
+            line = self.rows[row - 1] if row <= len(self.rows) else []
+            return list(line)
+
+    def col_values(self, col, *args, **kwargs):
+        self._call("col_values")
+        with self._lock:
+            values = [row[col - 1] if len(row) >= col else "" for row in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def acell(self, label, *args, **kwargs):
+        self._call("acell")
+        row, col = a1_to_rowcol(label)
+        with self._lock:
+            line = self.rows[row - 1] if row <= len(self.rows) else []
+            return FakeCell(line[col - 1] if len(line) >= col else "")
+
+    def get(self, range_name=None, *args, **kwargs):
+        self._call("get")
+        with self._lock:
+            return self._read(range_name) if range_name else [list(row) for row in self.rows]
+
+    def batch_get(self, ranges, *args, **kwargs):
+        self._call("batch_get")
+        with self._lock:
+            return [self._read(range_name) for range_name in ranges]
+
+    # Запись
+    def update_cell(self, row, col, value):
+        self._call("update_cell")
+        with self._lock:
+            self._set(row, col, value)
+
+    def update(self, range_name=None, values=None, **kwargs):
+        self._call("update")
+        with self._lock:
+            self._write(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        self._call("batch_update")
+        with self._lock:
+            for item in data:
+                self._write(item["range"], item["values"])
+
+    def append_row(self, values, **kwargs):
+        self._call("append_row")
+        with self._lock:
+            self.rows.append([str(value) for value in values])
+            row = len(self.rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{row}:J{row}"}}
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows")
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend([str(value) for value in line] for line in values)
+            last = len(self.rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:J{last}"}}
+
+    def clear(self):
+        self._call("clear")
+        with self._lock:
+            self.rows = []
+
+    def batch_clear(self, ranges):
+        self._call("batch_clear")
+        with self._lock:
+            for range_name in ranges:
+                start_row, start_col, end_row, end_col = _parse_range(range_name)
+                end_row = min(end_row or len(self.rows), len(self.rows))
+                for line in self.rows[start_row - 1:end_row]:
+                    for col in range((start_col or 1) - 1, min(end_col or len(line), len(line))):
+                        line[col] = ""
+
+    def resize(self, rows=None, cols=None):
+        self._call("resize")
+        if rows:
+            self.row_count = rows
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self._worksheets = {ws.title: ws for ws in worksheets}
+
+    def worksheet(self, title):
+        if title not in self._worksheets:
+            import gspread
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def add_worksheet(self, title, rows=1000, cols=10):
+        worksheet = FakeWorksheet(title, [], self.latency, self.jitter)
+        self._worksheets[title] = worksheet
+        return worksheet
+
+    def values_batch_get(self, ranges, params=None):
+        """Как Spreadsheet.values_batch_get: {'valueRanges': [{'range': ..., 'values': [...]}, ...]}"""
+        value_ranges = []
+        for range_name in ranges:
+            title = range_name.split("!", 1)[0].strip("'")
+            worksheet = self.worksheet(title)
+            worksheet._call("values_batch_get")
+            with worksheet._lock:
+                value_ranges.append({"range": range_name, "values": worksheet._read(range_name)})
+        return {"valueRanges": value_ranges}
+
+    def calls(self):
+        total = Counter()
+        for worksheet in self._worksheets.values():
+            total.update({f"{worksheet.title}.{method}": count for method, count in worksheet.calls.items()})
+        return total
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self._spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        return self._spreadsheet
+
+def make_dataset(rows, seed=1):
+    """Синтетические листы Заявки и Активность: rows заявок примерно от rows/5 участников"""
+    rng = random.Random(seed)
+    users = max(1, rows // 5)
+    applications = [["user_id", "username", "имя", "заявка_id", "ссылка", "ответ_1", "ответ_2",
+                     "дата_подачи", "баллы", "комментарий_админа"]]
+    for index in range(rows):
+        user_id = str(100000 + rng.randrange(users))
+        applications.append([
+            user_id, f"user{user_id}", f"Участник {user_id}", f"{user_id}_{1700000000 + index}",
+            f"https://vk.com/wall-1_{index}", "15.04.2025", "Снежинск", "15.04.2025 12:00",
+            rng.choice(["4", "8", "8", ""]), "памятник"
+        ])
+    activity = [["user_id", "username", "имя", "дата", "действие", "", "баллы"]]
+    for offset in range(users):
+        user_id = str(100000 + offset)
+        activity.append([user_id, f"user{user_id}", f"Участник {user_id}", "15.04.2025", "вход", "", "0"])
+    return applications, activity
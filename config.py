@@ -8,6 +8,91 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SPREADSHEET_ID = '1_G8dY5NMro0cari71Be9eT9htiVgRWJ3rcQXfZUI_F8'
 ACTIVITY_SHEET_NAME = 'Активность'
 
+# Время жизни кэша листа Заявки (в секундах)
+APPLICATIONS_CACHE_TTL = int(os.getenv("APPLICATIONS_CACHE_TTL", "300"))
+# Как часто сверять кэш Заявок с таблицей, чтобы увидеть баллы, проставленные вручную (секунды, 0 — не сверять)
+APPLICATIONS_SYNC_INTERVAL = int(os.getenv("APPLICATIONS_SYNC_INTERVAL", "60"))
+# Как часто записывать изменившиеся суммы баллов в лист Активность (секунды)
+ACTIVITY_TOTALS_FLUSH_INTERVAL = int(os.getenv("ACTIVITY_TOTALS_FLUSH_INTERVAL", "10"))
+# Как часто пересчитывать все суммы баллов и исправлять расхождения в листе Активность (секунды, 0 — не пересчитывать)
+ACTIVITY_RECONCILE_INTERVAL = int(os.getenv("ACTIVITY_RECONCILE_INTERVAL", "3600"))
+# Как часто переносить заявки из локального журнала в лист Заявки (секунды) и сколько за один запрос
+SUBMISSION_FLUSH_INTERVAL = float(os.getenv("SUBMISSION_FLUSH_INTERVAL", "2"))
+SUBMISSION_FLUSH_BATCH = int(os.getenv("SUBMISSION_FLUSH_BATCH", "50"))
+
+# Максимум одновременных запросов к Google Таблицам
+SHEETS_MAX_CONCURRENCY = int(os.getenv("SHEETS_MAX_CONCURRENCY", "4"))
+
+# Квота Google Sheets API: запросов в минуту на весь бот (лимит проекта — 60 на пользователя)
+SHEETS_QUOTA_PER_MINUTE = int(os.getenv("SHEETS_QUOTA_PER_MINUTE", "60"))
+# Сколько запросов можно сделать подряд без ожидания после простоя
+SHEETS_QUOTA_BURST = int(os.getenv("SHEETS_QUOTA_BURST", "10"))
+# Повторы запроса к таблице после 429 / 5xx и границы экспоненциальной паузы между ними (секунды)
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE = float(os.getenv("SHEETS_BACKOFF_BASE", "1"))
+SHEETS_BACKOFF_MAX = float(os.getenv("SHEETS_BACKOFF_MAX", "64"))
+
+# Локальная база бота (состояния пользователей и т.п.)
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "bot_data.db")
+
+# Где хранить состояния пользователей: "sqlite" (по умолчанию) или "sheets"
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+
+# Задержка (в секундах), с которой изменения FSM-состояний пишутся в локальную базу одной транзакцией
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))
+
+# Как часто (в секундах) зеркалировать состояния в лист UserState, 0 — не зеркалировать
+STATE_MIRROR_INTERVAL = int(os.getenv("STATE_MIRROR_INTERVAL", "300"))
+
+# Не чаще какого интервала (в секундах) перечитывать ключевую колонку, если ключа нет в индексе строк
+ROW_INDEX_MISS_REBUILD_INTERVAL = float(os.getenv("ROW_INDEX_MISS_REBUILD_INTERVAL", "60"))
+
+# Рассылка новостей: число параллельных отправителей, общий лимит сообщений в секунду
+# и минимальный интервал между сообщениями в один чат (лимиты Telegram: ~30/с и ~1/с на чат)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+
+# Ответы GPT: таймаут запроса (в секундах) и максимум одновременных запросов к модели
+GPT_TIMEOUT = float(os.getenv("GPT_TIMEOUT", "20"))
+GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", "5"))
+
+# Кэш ответов GPT: число ответов, срок жизни (в секундах) и порог похожести вопросов (0..1)
+GPT_CACHE_SIZE = int(os.getenv("GPT_CACHE_SIZE", "500"))
+GPT_CACHE_TTL = int(os.getenv("GPT_CACHE_TTL", "86400"))
+GPT_CACHE_SIMILARITY = float(os.getenv("GPT_CACHE_SIMILARITY", "0.85"))
+
+# Параллельная обработка обновлений: число партиций (воркеров) по user_id, предел очереди
+# одной партиции и общий предел ожидающих обновлений, после которых webhook отвечает 503
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_PARTITION_QUEUE_SIZE = int(os.getenv("UPDATE_PARTITION_QUEUE_SIZE", "50"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "500"))
+
+# Режим получения обновлений: "polling" (для разработки) или "webhook" (за обратным прокси)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес бота (https://bot.example.com) и путь, на который Telegram шлёт обновления
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Адрес, на котором слушает aiohttp-сервер, и сколько секунд ждать обработчики при остановке
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_DRAIN_TIMEOUT = int(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+# Другой адрес Bot API (например, локальный фейковый сервер для проверки webhook), пусто — api.telegram.org
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "")
+
+# Порт для /metrics в режиме polling (0 — не запускать); в режиме webhook /metrics отдаёт сервер бота
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Логи: файл, уровень, размер файла до ротации (в байтах) и число старых файлов
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Сколько входящих обновлений в секунду записывать в лог (остальные только считаются)
+LOG_UPDATES_RATE = float(os.getenv("LOG_UPDATES_RATE", "20"))
+
 RULES_LINK = 'https://disk.yandex.ru/i/RFyutWLZU5VCeg'
 
 ADMIN_IDS = [824793207, 1568719982]
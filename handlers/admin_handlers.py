@@ -7,18 +7,23 @@ from aiogram.utils.exceptions import MessageNotModified
 import asyncio
 import logging
 
-from services.sheets import (
+from services.sheets_async import (
     get_submission_stats,
     set_score_and_notify_user,
+    set_scores_batch,
+    get_pending_submissions,
     get_all_user_ids,
     get_top_users,
     update_user_score_in_activity,
     export_rating_to_sheet,
     save_user_state,
-    get_user_state,
     clear_user_state
 )
 from services.common import main_menu_markup, is_admin, admin_menu_markup
+from services.broadcast import create_campaign, start_campaign
+from services.gpt_cache import answer_cache
+from services.sheets_governor import ADMIN, set_sheets_priority, sheets_priority
+from services import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -30,18 +35,29 @@ class NewsState(StatesGroup):
 
 pending_scores = {}
 
+# Фоновая выгрузка рейтинга (одновременно выполняется только одна)
+rating_export = {"task": None}
+EXPORT_PROGRESS_INTERVAL = 2  # секунды между обновлениями статуса выгрузки
+
+# 📝 Пакетная проверка заявок: оценки копятся в буфере и уходят в таблицу одним запросом
+REVIEW_SCORES = (4, 8, 0)   # баллы на кнопках под заявкой
+REVIEW_PAGE_SIZE = 10       # заявок на одной странице проверки
+REVIEW_FLUSH_SIZE = 20      # при стольких оценках в буфере они записываются автоматически
+review_buffer = {}          # admin_id → {submission_id: баллы}
+REVIEW_MARK = "\n\n📝 Оценка:"
+
 async def send_admin_panel(message: types.Message):
     """Отправляет админ-панель"""
     if is_admin(message.from_user.id):
         msg = await message.answer("🛡 Админ-панель:", reply_markup=admin_menu_markup())
-        save_user_state(message.from_user.id, "admin_panel", None, msg.message_id)
+        await save_user_state(message.from_user.id, "admin_panel", None, msg.message_id)
 
 async def admin_start(message: types.Message, state: FSMContext):
     """Обработчик для команды /admin"""
     if is_admin(message.from_user.id):
         await state.finish()
         msg = await message.answer("🛡 Админ-панель:", reply_markup=admin_menu_markup())
-        save_user_state(message.from_user.id, "admin_panel", None, msg.message_id)
+        await save_user_state(message.from_user.id, "admin_panel", None, msg.message_id)
     else:
         await message.answer("❌ У вас нет доступа к админ-панели.")
 
@@ -54,7 +70,7 @@ async def handle_admin_panel(callback: types.CallbackQuery, state: FSMContext):
         return
 
     if callback.data == "admin_view_apps":
-        count, unique_users = get_submission_stats()
+        count, unique_users = await get_submission_stats()
         text = f"📬 Подано {count} заявок от {unique_users} участников."
         try:
             await callback.message.edit_text(
@@ -63,18 +79,10 @@ async def handle_admin_panel(callback: types.CallbackQuery, state: FSMContext):
             )
         except MessageNotModified:
             pass  # Игнорируем ошибку, если текст не изменился
-        save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+        await save_user_state(user_id, "admin_panel", None, callback.message.message_id)
 
     elif callback.data == "admin_set_scores":
-        text = "⚙️ Оценка заявок происходит автоматически при поступлении."
-        try:
-            await callback.message.edit_text(
-                text,
-                reply_markup=admin_menu_markup()
-            )
-        except MessageNotModified:
-            pass
-        save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+        await show_review_page(callback.message, user_id)
 
     elif callback.data == "admin_send_news":
         markup = types.InlineKeyboardMarkup()
@@ -88,11 +96,11 @@ async def handle_admin_panel(callback: types.CallbackQuery, state: FSMContext):
             reply_markup=markup,
             parse_mode="Markdown"
         )
-        save_user_state(user_id, "admin_news", None, callback.message.message_id)
+        await save_user_state(user_id, "admin_news", None, callback.message.message_id)
         await NewsState.waiting_for_news.set()
 
     elif callback.data == "admin_view_rating":
-        top_users = get_top_users()
+        top_users = await get_top_users()
 
         if not top_users:
             text = "⚠️ Пока нет данных для рейтинга."
@@ -117,9 +125,13 @@ async def handle_admin_panel(callback: types.CallbackQuery, state: FSMContext):
             )
         except MessageNotModified:
             pass
-        save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+        await save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+
+    elif callback.data in ("admin_export_rating", "admin_export_rating_all"):
+        if rating_export["task"] is not None and not rating_export["task"].done():
+            await callback.answer("⏳ Рейтинг уже выгружается, дождитесь окончания.", show_alert=True)
+            return
 
-    elif callback.data == "admin_export_rating":
         # Показываем статус выполнения
         try:
             await callback.message.edit_text(
@@ -128,27 +140,25 @@ async def handle_admin_panel(callback: types.CallbackQuery, state: FSMContext):
             )
         except MessageNotModified:
             pass
-            
-        # Выгружаем рейтинг
-        result = export_rating_to_sheet()
-        
-        if result:
-            text = "✅ Рейтинг успешно выгружен в таблицу!"
-        else:
-            text = "⚠️ Произошла ошибка при выгрузке рейтинга."
-            
+
+        # Выгрузка идёт в фоне, прогресс обновляется в этом же сообщении
+        limit = None if callback.data == "admin_export_rating_all" else 100
+        rating_export["task"] = asyncio.create_task(run_rating_export(callback.message, user_id, limit))
+
+    elif callback.data == "admin_metrics":
         try:
             await callback.message.edit_text(
-                text,
-                reply_markup=admin_menu_markup()
+                metrics.summary(),
+                reply_markup=admin_menu_markup(),
+                parse_mode="HTML"
             )
         except MessageNotModified:
             pass
-        save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+        await save_user_state(user_id, "admin_panel", None, callback.message.message_id)
 
     elif callback.data == "cancel_admin_news":
         await state.finish()
-        clear_user_state(user_id)
+        await clear_user_state(user_id)
         try:
             await callback.message.edit_text(
                 "❌ Рассылка отменена.",
@@ -156,7 +166,191 @@ async def handle_admin_panel(callback: types.CallbackQuery, state: FSMContext):
             )
         except MessageNotModified:
             pass
-        save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+        await save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+
+async def run_rating_export(status_message: types.Message, user_id, limit):
+    """Выгружает рейтинг в таблицу и показывает прогресс в сообщении админа"""
+    # Выгрузка уступает квоту таблицы запросам участников
+    set_sheets_priority(ADMIN)
+    progress = {"done": 0, "total": 0}
+
+    def report(done, total):
+        progress["done"] = done
+        progress["total"] = total
+
+    export = asyncio.ensure_future(export_rating_to_sheet(limit=limit, progress=report))
+    while not export.done():
+        await asyncio.wait({export}, timeout=EXPORT_PROGRESS_INTERVAL)
+        if not export.done() and progress["total"]:
+            try:
+                await status_message.edit_text(
+                    f"⏳ Выгружаем рейтинг: записано {progress['done']} из {progress['total']} строк..."
+                )
+            except MessageNotModified:
+                pass
+            except Exception as e:
+                logger.error(f"[ERROR] Не удалось обновить статус выгрузки: {e}")
+
+    if export.result():
+        text = "✅ Рейтинг успешно выгружен в таблицу!"
+    else:
+        text = "⚠️ Произошла ошибка при выгрузке рейтинга."
+
+    try:
+        await status_message.edit_text(
+            text,
+            reply_markup=admin_menu_markup()
+        )
+    except MessageNotModified:
+        pass
+    await save_user_state(user_id, "admin_panel", None, status_message.message_id)
+
+def review_markup(submission_id):
+    markup = types.InlineKeyboardMarkup(row_width=len(REVIEW_SCORES))
+    markup.add(*(
+        types.InlineKeyboardButton(f"{score} б.", callback_data=f"review_score_{score}_{submission_id}")
+        for score in REVIEW_SCORES
+    ))
+    return markup
+
+def review_controls_markup(count):
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(
+        types.InlineKeyboardButton(f"💾 Записать оценки ({count})", callback_data="review_flush"),
+        types.InlineKeyboardButton("➡️ Следующие заявки", callback_data="admin_set_scores"),
+        types.InlineKeyboardButton("🔙 В админ-панель", callback_data="review_done")
+    )
+    return markup
+
+def format_submission(record):
+    username = f" (@{record.username.lstrip('@')})" if record.username else ""
+    return (
+        f"📍 {record.monument} ({record.location}, {record.date})\n"
+        f"👤 {record.name}{username}\n"
+        f"🔗 {record.link}"
+    )
+
+async def show_review_page(status_message: types.Message, user_id):
+    """Показывает очередную страницу непроверенных заявок с кнопками баллов"""
+    buffered = review_buffer.get(user_id, {})
+    pending = await get_pending_submissions(limit=REVIEW_PAGE_SIZE, exclude=set(buffered))
+    if not pending:
+        text = "✅ Непроверенных заявок нет."
+        if buffered:
+            text += f"\nОценок ждут записи: {len(buffered)}."
+        try:
+            await status_message.edit_text(text, reply_markup=review_controls_markup(len(buffered)))
+        except MessageNotModified:
+            pass
+        await save_user_state(user_id, "admin_review", None, status_message.message_id)
+        return
+
+    try:
+        await status_message.edit_text(
+            f"📝 Проверка заявок: {len(pending)} шт. Выберите баллы под каждой заявкой — "
+            f"оценки запишутся в таблицу одним запросом."
+        )
+    except MessageNotModified:
+        pass
+    for record in pending:
+        await status_message.answer(format_submission(record), reply_markup=review_markup(record.submission_id),
+                                    disable_web_page_preview=True)
+    controls = await status_message.answer(
+        "Когда закончите, нажмите «Записать оценки».",
+        reply_markup=review_controls_markup(len(buffered))
+    )
+    await save_user_state(user_id, "admin_review", None, controls.message_id)
+
+async def notify_score(bot, user_id, score):
+    """Сообщает участнику о начисленных баллах"""
+    try:
+        await bot.send_message(
+            int(user_id),
+            f"🎉 Ваша заявка подтверждена!\n"
+            f"Вам начислено {score} балл(ов).\n"
+            f"Поздравляем и желаем удачи — вы на пути к победе! 💪",
+            reply_markup=main_menu_markup(int(user_id)),
+            parse_mode="Markdown"
+        )
+        logger.info(f"[INFO] Уведомление отправлено пользователю {user_id}")
+        return True
+    except Exception as e:
+        logger.error(f"[ERROR] Не удалось отправить сообщение участнику {user_id}: {e}")
+        return False
+
+async def flush_review(bot, admin_id):
+    """Записывает накопленные оценки админа одним запросом и уведомляет участников.
+
+    Оценка 0 — отклонение: как и кнопка «Отклонить», участника она не уведомляет.
+    Возвращает (записано, уведомлено); если таблица недоступна, оценки остаются в буфере.
+    """
+    scores = review_buffer.pop(admin_id, {})
+    if not scores:
+        return 0, 0
+    written = await set_scores_batch(scores)
+    if written is None:
+        # Не записали ничего — вернём оценки, чтобы админ мог повторить; оценки, выставленные
+        # во время записи, новее возвращаемых и остаются поверх них
+        review_buffer[admin_id] = {**scores, **review_buffer.get(admin_id, {})}
+        return 0, 0
+    notified = 0
+    for submission_id, user_id in written.items():
+        if scores[submission_id] > 0 and await notify_score(bot, user_id, scores[submission_id]):
+            notified += 1
+    return len(written), notified
+
+async def handle_review_score(callback: types.CallbackQuery, state: FSMContext):
+    """Запоминает оценку заявки в буфере проверки"""
+    user_id = callback.from_user.id
+    if not is_admin(user_id):
+        return
+    _, _, score, submission_id = callback.data.split("_", 3)
+    buffer = review_buffer.setdefault(user_id, {})
+    buffer[submission_id] = int(score)
+
+    text = (callback.message.text or "").split(REVIEW_MARK)[0]
+    try:
+        await callback.message.edit_text(
+            f"{text}{REVIEW_MARK} {score} б. (ещё не записана)",
+            reply_markup=review_markup(submission_id),
+            disable_web_page_preview=True
+        )
+    except MessageNotModified:
+        pass
+
+    if len(buffer) >= REVIEW_FLUSH_SIZE:
+        written, notified = await flush_review(callback.bot, user_id)
+        await callback.answer(f"💾 Записано оценок: {written}, уведомлено участников: {notified}")
+    else:
+        await callback.answer(f"Оценка {score} б. сохранена, в буфере {len(buffer)}")
+
+async def handle_review_flush(callback: types.CallbackQuery, state: FSMContext):
+    """Записывает оценки из буфера; «В админ-панель» тоже сначала записывает их"""
+    user_id = callback.from_user.id
+    if not is_admin(user_id):
+        return
+    had_scores = bool(review_buffer.get(user_id))
+    written, notified = await flush_review(callback.bot, user_id)
+    left = len(review_buffer.get(user_id, {}))
+    if left:
+        text = f"⚠️ Не удалось записать оценки в таблицу ({left} шт.), попробуйте ещё раз."
+    elif had_scores:
+        text = f"✅ Записано оценок: {written}, уведомлено участников: {notified}."
+    else:
+        text = "Оценок для записи нет."
+
+    if callback.data == "review_done" and not left:
+        try:
+            await callback.message.edit_text(f"{text}\n\n🛡 Админ-панель:", reply_markup=admin_menu_markup())
+        except MessageNotModified:
+            pass
+        await save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+        return
+    try:
+        await callback.message.edit_text(text, reply_markup=review_controls_markup(left))
+    except MessageNotModified:
+        pass
+    await save_user_state(user_id, "admin_review", None, callback.message.message_id)
 
 async def handle_approve(callback: types.CallbackQuery, state: FSMContext):
     """Обрабатывает подтверждение заявки админом"""
@@ -169,7 +363,7 @@ async def handle_approve(callback: types.CallbackQuery, state: FSMContext):
 
     await callback.message.edit_reply_markup()
     msg = await callback.message.answer("Введите количество баллов, которые вы хотите назначить:")
-    save_user_state(user_id, "waiting_for_score", {"submission_id": submission_id}, msg.message_id)
+    await save_user_state(user_id, "waiting_for_score", {"submission_id": submission_id}, msg.message_id)
     await ScoreState.waiting_for_score.set()
 
 async def handle_reject(callback: types.CallbackQuery, state: FSMContext):
@@ -178,7 +372,7 @@ async def handle_reject(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
     await callback.message.answer("Заявка отклонена. Пользователь не будет уведомлён.")
     msg = await callback.message.answer("🛡 Админ-панель:", reply_markup=admin_menu_markup())
-    save_user_state(user_id, "admin_panel", None, msg.message_id)
+    await save_user_state(user_id, "admin_panel", None, msg.message_id)
 
 async def receive_score(message: types.Message, state: FSMContext):
     """Обрабатывает ввод баллов для заявки"""
@@ -210,27 +404,14 @@ async def receive_score(message: types.Message, state: FSMContext):
         await send_admin_panel(message)
         return
 
-    result = set_score_and_notify_user(submission_id, score)
+    result = await set_score_and_notify_user(submission_id, score)
 
     if result:
         user_id_str = submission_id.split("_")[0]
-        update_user_score_in_activity(user_id_str)
+        await update_user_score_in_activity(user_id_str)
         
         # Отправляем уведомление пользователю
-        try:
-            from main import bot
-            await bot.send_message(
-                int(user_id_str),
-                f"🎉 Ваша заявка подтверждена!\n"
-                f"Вам начислено {score} балл(ов).\n"
-                f"Поздравляем и желаем удачи — вы на пути к победе! 💪",
-                reply_markup=main_menu_markup(int(user_id_str)),
-                parse_mode="Markdown"
-            )
-            logger.info(f"[INFO] Уведомление отправлено пользователю {user_id_str}")
-        except Exception as e:
-            logger.error(f"[ERROR] Не удалось отправить сообщение участнику {user_id_str}: {e}")
-            
+        await notify_score(message.bot, user_id_str, score)
         await message.answer("✅ Баллы записаны, участник уведомлён.")
     else:
         await message.answer("⚠️ Не удалось обновить баллы. Возможно, заявка не найдена.")
@@ -240,86 +421,32 @@ async def receive_score(message: types.Message, state: FSMContext):
     pending_scores.pop(user_id, None)
 
 async def send_news_to_users(message: types.Message, state: FSMContext):
-    """Отправляет рассылку всем пользователям"""
+    """Запускает рассылку сообщения всем пользователям"""
     user_id = message.from_user.id
     await state.finish()
-    clear_user_state(user_id)
-    users = get_all_user_ids()
+    await clear_user_state(user_id)
+    with sheets_priority(ADMIN):
+        users = await get_all_user_ids()
     
-    # Показываем статус отправки
+    # Показываем статус отправки — его обновляет фоновая рассылка
     status_msg = await message.answer(f"⏳ Начинаем рассылку для {len(users)} пользователей...")
     
-    # Определяем тип контента и его форматирование
-    parse_mode = "HTML"  # Используем HTML по умолчанию, т.к. он обрабатывает больше типов форматирования
-    
-    sent = 0
-    errors = 0
-    
-    for recipient_id in users:
-        try:
-            if message.photo:
-                await message.bot.send_photo(
-                    recipient_id, 
-                    message.photo[-1].file_id, 
-                    caption=message.caption or "", 
-                    reply_markup=main_menu_markup(user_id=recipient_id),
-                    parse_mode=parse_mode,
-                    caption_entities=message.caption_entities  # Добавляем сущности форматирования
-                )
-            elif message.video:
-                await message.bot.send_video(
-                    recipient_id, 
-                    message.video.file_id, 
-                    caption=message.caption or "", 
-                    reply_markup=main_menu_markup(user_id=recipient_id),
-                    parse_mode=parse_mode,
-                    caption_entities=message.caption_entities  # Добавляем сущности форматирования
-                )
-            elif message.document:
-                await message.bot.send_document(
-                    recipient_id, 
-                    message.document.file_id, 
-                    caption=message.caption or "", 
-                    reply_markup=main_menu_markup(user_id=recipient_id),
-                    parse_mode=parse_mode,
-                    caption_entities=message.caption_entities  # Добавляем сущности форматирования
-                )
-            elif message.text:
-                await message.bot.send_message(
-                    recipient_id, 
-                    message.text, 
-                    reply_markup=main_menu_markup(user_id=recipient_id),
-                    parse_mode=parse_mode,
-                    entities=message.entities  # Добавляем сущности форматирования
-                )
-            sent += 1
-            
-            # Обновляем статус каждые 10 отправок
-            if sent % 10 == 0:
-                try:
-                    await status_msg.edit_text(f"⏳ Отправлено {sent} из {len(users)} сообщений...")
-                except Exception as e:
-                    logger.error(f"[ERROR] Не удалось обновить статус: {e}")
-                    
-            # Небольшая задержка, чтобы не превышать лимиты
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            errors += 1
-            logger.error(f"[ERROR] Не удалось отправить рассылку пользователю {recipient_id}: {e}")
-
-    await message.answer(
-        f"✅ Рассылка завершена.\n"
-        f"✓ Успешно отправлено: {sent} пользователям\n"
-        f"✗ Ошибок при отправке: {errors}"
+    # Рассылка копирует исходное сообщение (текст, фото, видео или документ вместе с форматированием),
+    # поэтому в журнал достаточно записать его chat_id и message_id
+    campaign_id = create_campaign(
+        user_id,
+        message.chat.id,
+        message.message_id,
+        users,
+        status_message_id=status_msg.message_id
     )
-    msg = await message.answer("🛡 Админ-панель:", reply_markup=admin_menu_markup())
-    save_user_state(user_id, "admin_panel", None, msg.message_id)
+    start_campaign(message.bot, campaign_id)
 
 async def cancel_news(callback: types.CallbackQuery, state: FSMContext):
     """Отменяет рассылку"""
     user_id = callback.from_user.id
     await state.finish()
-    clear_user_state(user_id)
+    await clear_user_state(user_id)
     try:
         await callback.message.edit_text(
             "❌ Рассылка отменена.",
@@ -327,7 +454,15 @@ async def cancel_news(callback: types.CallbackQuery, state: FSMContext):
         )
     except MessageNotModified:
         pass
-    save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+    await save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+
+async def flush_gpt_cache(message: types.Message):
+    """Очищает кэш ответов GPT (команда /flush_gpt_cache, например после правки правил)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к админ-панели.")
+        return
+    count = answer_cache.clear()
+    await message.answer(f"🧹 Кэш ответов GPT очищен, удалено ответов: {count}.")
 
 async def handle_invalid_score_input(message: types.Message, state: FSMContext):
     """Обрабатывает неправильный ввод при выставлении баллов"""
@@ -336,11 +471,15 @@ async def handle_invalid_score_input(message: types.Message, state: FSMContext):
 def register_admin_handlers(dp: Dispatcher):
     """Регистрирует обработчики для админ-панели"""
     dp.register_message_handler(admin_start, commands=["admin"], state="*")
+    dp.register_message_handler(flush_gpt_cache, commands=["flush_gpt_cache"], state="*")
     dp.register_callback_query_handler(handle_admin_panel, text=[
-        "admin_view_apps", "admin_set_scores", "admin_send_news", "admin_view_rating", "admin_export_rating", "cancel_admin_news"
+        "admin_view_apps", "admin_set_scores", "admin_send_news", "admin_view_rating", "admin_export_rating",
+        "admin_export_rating_all", "admin_metrics", "cancel_admin_news"
     ], state="*")
     dp.register_callback_query_handler(handle_approve, text_startswith="approve_", state="*")
     dp.register_callback_query_handler(handle_reject, text_startswith="reject_", state="*")
+    dp.register_callback_query_handler(handle_review_score, text_startswith="review_score_", state="*")
+    dp.register_callback_query_handler(handle_review_flush, text=["review_flush", "review_done"], state="*")
     
     # Обработчик для текстового ввода баллов
     dp.register_message_handler(receive_score, state=ScoreState.waiting_for_score, content_types=types.ContentTypes.TEXT)
@@ -11,7 +11,7 @@ import logging
 import re
 
 
-from services.sheets import submit_application, save_user_state, get_user_state, clear_user_state
+from services.sheets_async import submit_application, save_user_state, clear_user_state, find_submitted_link
 from config import ADMIN_IDS
 from services.common import main_menu_markup
 
@@ -40,7 +40,7 @@ async def start_application(message: types.Message):
     user_id = message.from_user.id
     # Сохраняем состояние в Google Таблицах
     current_time = datetime.datetime.now().isoformat()
-    save_user_state(user_id, "application_step_1", {"start_time": current_time})
+    await save_user_state(user_id, "application_step_1", {"start_time": current_time})
     msg = await message.answer(
         "📎 Пожалуйста, пришлите ссылку на публикацию с фотографией у памятника.\n"
         "Убедитесь, что страница с публикацией *открыта для всех пользователей*.\n\n"
@@ -53,7 +53,7 @@ async def start_application(message: types.Message):
         parse_mode="Markdown"
     )
 
-    save_user_state(user_id, "application_step_1", {"start_time": current_time}, msg.message_id)
+    await save_user_state(user_id, "application_step_1", {"start_time": current_time}, msg.message_id)
     await ApplicationState.waiting_for_link.set()
 
 # Обработка неправильного типа контента (медиафайлы) во время подачи заявки
@@ -133,16 +133,25 @@ async def process_link(message: types.Message, state: FSMContext):
         )
         return
 
+    # Проверка, что эта ссылка ещё не участвовала в конкурсе
+    if await find_submitted_link(text):
+        await message.answer(
+            "⚠️ Эта публикация уже участвовала в конкурсе — повторно её подать нельзя.\n"
+            "Пришлите ссылку на другой пост или вернитесь в меню.",
+            reply_markup=cancel_markup()
+        )
+        return
+
     await state.update_data(link=text)
     # Сохраняем состояние
-    save_user_state(user_id, "application_step_2", {"link": text})
+    await save_user_state(user_id, "application_step_2", {"link": text})
     msg = await message.answer(
         "🗓 Спасибо! Теперь введите дату съёмки в формате *ДД.ММ.ГГГГ*, например: `15.04.2025`.\n\n"
         "📌 Убедитесь, что съёмка была не раньше 1 апреля 2025 года и не в будущем 😊",
         reply_markup=cancel_markup(),
         parse_mode="Markdown"
     )
-    save_user_state(user_id, "application_step_2", {"link": text}, msg.message_id)
+    await save_user_state(user_id, "application_step_2", {"link": text}, msg.message_id)
     await ApplicationState.waiting_for_date.set()
 
 # Функция для проверки корректности даты
@@ -207,15 +216,15 @@ async def process_date(message: types.Message, state: FSMContext):
     }
     
     # Логируем для отладки
-    logging.info(f"[DEBUG] Сохранение данных в process_date: {full_data}")
+    logging.debug(f"Сохранение данных в process_date: {full_data}")
     
     # Сохраняем состояние в Google Sheets, обеспечивая синхронизацию данных
-    save_user_state(user_id, "application_step_3", full_data)
+    await save_user_state(user_id, "application_step_3", full_data)
     msg = await message.answer(
         "📍 Отлично! Теперь напишите, где была сделана съёмка — достаточно указать *город или населённый пункт*, например: `Снежинск`.", 
         reply_markup=cancel_markup()
     )
-    save_user_state(user_id, "application_step_3", full_data, msg.message_id)
+    await save_user_state(user_id, "application_step_3", full_data, msg.message_id)
     await ApplicationState.waiting_for_location.set()
 
 # Обработка места
@@ -250,10 +259,10 @@ async def process_location(message: types.Message, state: FSMContext):
     }
     
     # Логируем для отладки
-    logging.info(f"[DEBUG] Сохранение данных в process_location: {full_data}")
+    logging.debug(f"Сохранение данных в process_location: {full_data}")
     
     # Сохраняем состояние в Google Sheets, обеспечивая синхронизацию данных
-    save_user_state(user_id, "application_step_4", full_data)
+    await save_user_state(user_id, "application_step_4", full_data)
     msg = await message.answer(
         "🏛 И последний шаг — пожалуйста, напишите краткое название объекта:\n\n"
         "Например: *мемориал Славы*, *памятник героям ВОВ*, *доска на здании школы №125*.\n\n"
@@ -261,7 +270,7 @@ async def process_location(message: types.Message, state: FSMContext):
         reply_markup=cancel_markup(),
         parse_mode="Markdown"
     )
-    save_user_state(user_id, "application_step_4", full_data, msg.message_id)
+    await save_user_state(user_id, "application_step_4", full_data, msg.message_id)
     await ApplicationState.waiting_for_name.set()
 
 # Обработка названия и завершение
@@ -278,35 +287,12 @@ async def process_name(message: types.Message, state: FSMContext):
     
     monument_name = message.text.strip()
     
-    # Получаем состояние напрямую из Google Sheets
-    current_state, state_data, _ = get_user_state(user_id)
-    
-    # Получаем данные из стейта aiogram
-    aiogram_data = await state.get_data()
-    
-    # Логируем для отладки оба источника данных
-    logging.info(f"[DEBUG] Данные из Google Sheets: {state_data}")
-    logging.info(f"[DEBUG] Данные из aiogram state: {aiogram_data}")
-    
-    # Берем данные из наиболее надежного источника с проверкой
-    link = ""
-    date_text = ""
-    location = ""
-    
-    # Проверяем данные в aiogram state
-    if aiogram_data and isinstance(aiogram_data, dict):
-        link = aiogram_data.get("link", "")
-        date_text = aiogram_data.get("date", "")
-        location = aiogram_data.get("location", "")
-        logging.info(f"[DEBUG] Данные из aiogram state успешно извлечены")
-    
-    # Если данных нет в aiogram state, пробуем взять из Google Sheets
-    if (not link or not date_text or not location) and state_data and isinstance(state_data, dict):
-        link = state_data.get("link", "")
-        date_text = state_data.get("date", "")
-        location = state_data.get("location", "")
-        logging.info(f"[DEBUG] Данные из Google Sheets успешно извлечены")
-    
+    # Все ответы анкеты хранятся в FSM (локальная база), таблицу читать не нужно
+    data = await state.get_data()
+    link = data.get("link", "")
+    date_text = data.get("date", "")
+    location = data.get("location", "")
+
     # Проверяем, что у нас есть все необходимые данные
     if not link or not date_text or not location:
         await message.answer(
@@ -314,24 +300,24 @@ async def process_name(message: types.Message, state: FSMContext):
             "Пожалуйста, начните заполнение заявки заново.",
             reply_markup=main_menu_markup(user_id)
         )
-        clear_user_state(user_id)
+        await clear_user_state(user_id)
         await state.finish()
         return
     
     # Логируем окончательные данные перед отправкой
-    logging.info(f"[DEBUG] Итоговые данные для заявки: date_text={date_text}, location={location}, monument_name={monument_name}, link={link}")
+    logging.debug(f"Итоговые данные для заявки: date_text={date_text}, location={location}, monument_name={monument_name}, link={link}")
 
     try:
         # Отправляем заявку с извлеченными данными
-        submission_id = submit_application(message.from_user, date_text, location, monument_name, link)
+        submission_id = await submit_application(message.from_user, date_text, location, monument_name, link)
         
         if submission_id:
             await message.answer("✅ Ваша заявка принята! Спасибо за участие.")
             msg = await message.answer("👇 Главное меню:", reply_markup=main_menu_markup(message.from_user.id))
             
             # Очищаем состояние
-            clear_user_state(user_id)
-            save_user_state(user_id, "main_menu", None, msg.message_id)
+            await clear_user_state(user_id)
+            await save_user_state(user_id, "main_menu", None, msg.message_id)
             await state.finish()
 
             # Отправляем уведомление администраторам
@@ -372,7 +358,7 @@ async def process_name(message: types.Message, state: FSMContext):
 async def cancel_application(message_or_callback, state: FSMContext):
     user_id = message_or_callback.from_user.id if isinstance(message_or_callback, types.Message) else message_or_callback.from_user.id
     await state.finish()
-    clear_user_state(user_id)
+    await clear_user_state(user_id)
     
     if isinstance(message_or_callback, types.Message):
         await message_or_callback.answer("Подача заявки отменена.")
@@ -381,16 +367,16 @@ async def cancel_application(message_or_callback, state: FSMContext):
         await message_or_callback.message.edit_text("Подача заявки отменена.")
         msg = await message_or_callback.message.answer("👇 Главное меню:", reply_markup=main_menu_markup(user_id))
     
-    save_user_state(user_id, "main_menu", None, msg.message_id)
+    await save_user_state(user_id, "main_menu", None, msg.message_id)
 
 # Кнопка GPT
 async def handle_callback_query(callback_query: types.CallbackQuery, state: FSMContext):
     user_id = callback_query.from_user.id
     await state.finish()
-    clear_user_state(user_id)
+    await clear_user_state(user_id)
     await callback_query.message.answer("Вы можете задать вопрос — я постараюсь помочь 🤖")
     msg = await callback_query.message.answer("👇 Главное меню:", reply_markup=main_menu_markup(user_id))
-    save_user_state(user_id, "main_menu", None, msg.message_id)
+    await save_user_state(user_id, "main_menu", None, msg.message_id)
 
 # Регистрация
 def register_application_handlers(dp: Dispatcher):
@@ -1,12 +1,19 @@
 # handlers/gpt_handler.py
 
-from openai import OpenAI
-from config import OPENAI_API_KEY, ADMIN_IDS
+from openai import AsyncOpenAI
+from config import OPENAI_API_KEY, ADMIN_IDS, GPT_TIMEOUT, GPT_MAX_CONCURRENCY
 from handlers.admin_handlers import send_admin_panel
+from services.gpt_cache import answer_cache
+from services.metrics import gpt_latency, gpt_requests, gpt_tokens
+import asyncio
 import logging
 from aiogram import Dispatcher, types
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Асинхронный клиент: ожидание ответа модели не блокирует остальных пользователей
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=GPT_TIMEOUT, max_retries=1)
+
+# Ограничение на число одновременных запросов к модели
+gpt_semaphore = asyncio.Semaphore(GPT_MAX_CONCURRENCY)
 
 rules_summary = """
 Ты — дружелюбный помощник конкурса *«Эстафета Победы. От памятника к памяти»*, приуроченного к 80-летию Победы в Великой Отечественной войне и Году Защитника Отечества. Конкурс проходит с *1 апреля по 30 ноября 2025 года*.
@@ -71,6 +78,23 @@ rules_summary = """
 Ты создан(а), чтобы помогать участникам — подсказывай, поддерживай и не отвлекайся от сути конкурса 💙
 """
 
+async def _complete(text):
+    """Запрашивает ответ модели, не превышая лимит одновременных запросов"""
+    async with gpt_semaphore:
+        with gpt_latency.time():
+            response = await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": rules_summary},
+                    {"role": "user", "content": text}
+                ],
+                max_tokens=600
+            )
+    if response.usage:
+        gpt_tokens.inc(response.usage.prompt_tokens, kind="prompt")
+        gpt_tokens.inc(response.usage.completion_tokens, kind="completion")
+    return response.choices[0].message.content
+
 async def ask_gpt(message_or_text):
     try:
         if isinstance(message_or_text, str):
@@ -80,15 +104,16 @@ async def ask_gpt(message_or_text):
             text = message_or_text.text
             user_id = message_or_text.from_user.id
 
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": rules_summary},
-                {"role": "user", "content": text}
-            ],
-            max_tokens=600
-        )
-        answer = response.choices[0].message.content
+        # Частые вопросы (сроки, баллы, подача заявки) отдаём из кэша без запроса к модели.
+        # Кэш привязан к rules_summary и сбрасывается при его изменении
+        answer = answer_cache.get(text, context=rules_summary)
+        if answer is None:
+            # Общий дедлайн включает и ожидание своей очереди к модели
+            answer = await asyncio.wait_for(_complete(text), timeout=GPT_TIMEOUT)
+            answer_cache.put(text, answer, context=rules_summary)
+            gpt_requests.inc(result="ok")
+        else:
+            gpt_requests.inc(result="cache")
 
         if not isinstance(message_or_text, str):
             await message_or_text.answer(answer, parse_mode='Markdown')
@@ -97,7 +122,12 @@ async def ask_gpt(message_or_text):
 
         return answer
     except Exception as e:
-        logging.error(f"GPT ERROR: {e}")
+        if isinstance(e, asyncio.TimeoutError):
+            gpt_requests.inc(result="timeout")
+            logging.error(f"GPT ERROR: нет ответа за {GPT_TIMEOUT} с")
+        else:
+            gpt_requests.inc(result="error")
+            logging.error(f"GPT ERROR: {e}")
         if not isinstance(message_or_text, str):
             await message_or_text.answer(
                 "Извините, я пока не могу ответить. Попробуйте позже или обратитесь к организатору: @isilgan",
@@ -3,7 +3,7 @@
 from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 import logging
-from services.sheets import add_or_update_user, get_user_scores, save_user_state, get_user_state, clear_user_state
+from services.sheets_async import add_or_update_user, get_user_scores, save_user_state, get_user_state, clear_user_state
 from handlers.application_handlers import start_application, ApplicationState, cancel_markup
 from services.common import main_menu_markup, is_admin, admin_menu_markup
 
@@ -15,7 +15,7 @@ async def start(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
 
     try:
-        add_or_update_user(message.from_user)
+        await add_or_update_user(message.from_user)
 
         msg = await message.answer(
             "👋 *Добро пожаловать в конкурс «Эстафета Победы. От памятника к памяти»!* 🇷🇺\n\n"
@@ -25,7 +25,7 @@ async def start(message: types.Message, state: FSMContext):
             reply_markup=main_menu_markup(user_id),
             parse_mode="Markdown"
         )
-        save_user_state(user_id, "main_menu", None, msg.message_id)
+        await save_user_state(user_id, "main_menu", None, msg.message_id)
         logger.info(f"User {user_id} started the bot")
     except Exception as e:
         logger.error(f"Error in start handler: {e}")
@@ -37,9 +37,10 @@ async def start(message: types.Message, state: FSMContext):
 async def handle_main_menu(callback: types.CallbackQuery, state: FSMContext):
     await state.finish()
     user_id = callback.from_user.id
-    current_state, state_data, last_message_id = get_user_state(user_id)
+    current_state, state_data, last_message_id = await get_user_state(user_id)
 
-    if current_state.startswith("application_step"):
+    # «Продолжить заявку» — ответ на этот же вопрос, его обрабатывает ветка continue_app ниже
+    if current_state.startswith("application_step") and callback.data != "continue_app":
         markup = types.InlineKeyboardMarkup()
         markup.add(types.InlineKeyboardButton("📝 Продолжить заявку", callback_data="continue_app"))
         markup.add(types.InlineKeyboardButton("🔄 Начать новую заявку", callback_data="apply"))
@@ -81,7 +82,7 @@ async def handle_main_menu(callback: types.CallbackQuery, state: FSMContext):
                 reply_markup=main_menu_markup(user_id),
                 parse_mode='Markdown'
             )
-            save_user_state(user_id, "main_menu", None, callback.message.message_id)
+            await save_user_state(user_id, "main_menu", None, callback.message.message_id)
         except Exception as e:
             logger.error(f"Error updating message: {e}")
             await callback.message.answer(
@@ -112,6 +113,8 @@ async def handle_main_menu(callback: types.CallbackQuery, state: FSMContext):
         await start_application(callback.message)
 
     elif callback.data == "continue_app":
+        # Возвращаем в FSM уже введённые ответы, чтобы последний шаг взял их оттуда
+        await state.set_data(state_data or {})
         if current_state == "application_step_1":
             text = (
                 "📎 Пожалуйста, пришлите ссылку на публикацию с фотографией у памятника. "
@@ -193,27 +196,32 @@ async def handle_main_menu(callback: types.CallbackQuery, state: FSMContext):
                 
             await ApplicationState.waiting_for_name.set()
 
+        else:
+            # Незавершённой заявки уже нет (например, её очистили) — начинаем новую
+            await callback.message.delete()
+            await start_application(callback.message)
+
     elif callback.data == "back_to_menu":
-        clear_user_state(user_id)
+        await clear_user_state(user_id)
         try:
             await callback.message.edit_text(
                 "👇 Главное меню:",
                 reply_markup=main_menu_markup(user_id)
             )
-            save_user_state(user_id, "main_menu", None, callback.message.message_id)
+            await save_user_state(user_id, "main_menu", None, callback.message.message_id)
         except Exception as e:
             logger.error(f"Error editing message: {e}")
             msg = await callback.message.answer(
                 "👇 Главное меню:",
                 reply_markup=main_menu_markup(user_id)
             )
-            save_user_state(user_id, "main_menu", None, msg.message_id)
+            await save_user_state(user_id, "main_menu", None, msg.message_id)
             await callback.message.delete()
 
     elif callback.data == "scores":
         try:
             user_id_str = str(user_id)
-            results, total = get_user_scores(user_id_str)
+            results, total = await get_user_scores(user_id_str)
 
             if not results:
                 text = (
@@ -237,7 +245,7 @@ async def handle_main_menu(callback: types.CallbackQuery, state: FSMContext):
                     reply_markup=main_menu_markup(user_id),
                     parse_mode="Markdown"
                 )
-                save_user_state(user_id, "main_menu", None, callback.message.message_id)
+                await save_user_state(user_id, "main_menu", None, callback.message.message_id)
             except Exception as e:
                 logger.error(f"Error editing message: {e}")
                 msg = await callback.message.answer(
@@ -245,7 +253,7 @@ async def handle_main_menu(callback: types.CallbackQuery, state: FSMContext):
                     reply_markup=main_menu_markup(user_id),
                     parse_mode="Markdown"
                 )
-                save_user_state(user_id, "main_menu", None, msg.message_id)
+                await save_user_state(user_id, "main_menu", None, msg.message_id)
                 await callback.message.delete()
         except Exception as e:
             logger.error(f"Error getting user scores: {e}")
@@ -257,11 +265,11 @@ async def handle_main_menu(callback: types.CallbackQuery, state: FSMContext):
         if is_admin(user_id):
             try:
                 await callback.message.edit_text("🛡 Админ-панель:", reply_markup=admin_menu_markup())
-                save_user_state(user_id, "admin_panel", None, callback.message.message_id)
+                await save_user_state(user_id, "admin_panel", None, callback.message.message_id)
             except Exception as e:
                 logger.error(f"Error editing message: {e}")
                 msg = await callback.message.answer("🛡 Админ-панель:", reply_markup=admin_menu_markup())
-                save_user_state(user_id, "admin_panel", None, msg.message_id)
+                await save_user_state(user_id, "admin_panel", None, msg.message_id)
                 await callback.message.delete()
         else:
             await callback.message.answer("❌ У вас нет прав доступа.")
@@ -4,67 +4,86 @@ import logging
 import os
 import asyncio
 import datetime
-import json
-from aiogram import Bot, Dispatcher
 from aiogram.utils import executor
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.types import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import Update
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from services.sheets import check_sheet_structure, send_reminders_to_inactive
-from config import BOT_TOKEN
+from services.sheets import send_reminders_to_inactive
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from config import (
+    BOT_TOKEN,
+    STATE_MIRROR_INTERVAL,
+    APPLICATIONS_SYNC_INTERVAL,
+    ACTIVITY_TOTALS_FLUSH_INTERVAL,
+    ACTIVITY_RECONCILE_INTERVAL,
+    SUBMISSION_FLUSH_INTERVAL,
+    BOT_MODE,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_DRAIN_TIMEOUT,
+    TELEGRAM_API_SERVER,
+    LOG_UPDATES_RATE,
+    METRICS_PORT
+)
+from services.logging_setup import setup_logging, rate_limited_logger
 from handlers import (
     user_handlers,
     application_handlers,
     fallback_handler,
     admin_handlers
 )
-from services.sheets import (
-    send_reminders_to_inactive, 
-    state_sheet, 
-    clear_user_state, 
-    get_all_user_ids, 
-    save_user_state
-)  # Добавлен import clear_user_state
-from services.common import main_menu_markup
-
-from services.sheets import (
-    send_reminders_to_inactive, 
-    state_sheet, 
-    clear_user_state, 
-    get_all_user_ids, 
+from services.sheets_async import (
+    clear_user_state,
+    get_all_user_ids,
     save_user_state,
-    check_sheet_structure  # Добавьте эту строку
+    mirror_user_states,
+    import_user_states,
+    sync_applications,
+    flush_submissions,
+    flush_activity_totals,
+    reconcile_activity_totals,
+    check_sheet_structure
 )
+from services import sheets_async
+from services.common import main_menu_markup
+from services.broadcast import resume_unfinished_campaigns
+from services.reminders import reminder_scheduler
+from services.webhook import run_webhook
+from services.sheets_governor import ADMIN, BACKGROUND, set_sheets_priority
+from services.fsm_storage import SQLiteStorage
+from services.update_dispatcher import PartitionedDispatcher
+from services.metrics import MeteredBot, MetricsMiddleware, start_metrics_server
 
-# Настройка логов с большей детализацией
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Вывод в консоль
-        logging.FileHandler('bot.log')  # Сохранение в файл
-    ]
-)
+# Настройка логов: запись в консоль и bot.log (с ротацией) идёт в фоновом потоке
+setup_logging()
 logger = logging.getLogger(__name__)
+# Каждое входящее обновление — самый частый лог, его ограничиваем по частоте
+updates_logger = rate_limited_logger("bot.updates", rate=LOG_UPDATES_RATE)
 
 # Версия бота для отслеживания обновлений
 BOT_VERSION = "1.0.1"
 VERSION_FILE = "bot_version.txt"
 
 # Инициализация бота и хранилища
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
+api_server = TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else TELEGRAM_PRODUCTION
+bot = MeteredBot(token=BOT_TOKEN, server=api_server)
+storage = SQLiteStorage()
+dp = PartitionedDispatcher(bot, storage=storage)
 
 # Middleware для логирования всех обновлений
+LOGGED_TEXT_LIMIT = 200  # длинные сообщения пишем в лог только началом
 class LoggingMiddleware(BaseMiddleware):
     async def on_process_update(self, update: Update, data: dict):
         if update.message:
-            logger.info(f"Получено сообщение от user_id {update.message.from_user.id}: {update.message.text}")
+            text = (update.message.text or "")[:LOGGED_TEXT_LIMIT]
+            updates_logger.info(f"Получено сообщение от user_id {update.message.from_user.id}: {text}")
         elif update.callback_query:
-            logger.info(f"Получен callback от user_id {update.callback_query.from_user.id}: {update.callback_query.data}")
+            updates_logger.info(f"Получен callback от user_id {update.callback_query.from_user.id}: {update.callback_query.data}")
 
 dp.middleware.setup(LoggingMiddleware())
+dp.middleware.setup(MetricsMiddleware())
 
 # Проверка обновления версии
 def check_version_update():
@@ -89,7 +108,7 @@ def check_version_update():
 # Уведомление о новой версии бота
 async def notify_users_about_update():
     """Отправляет сообщение всем пользователям об обновлении бота"""
-    users = get_all_user_ids()
+    users = await get_all_user_ids()
     
     update_message = (
         "🔄 Бот был обновлен и готов к работе!\n"
@@ -117,81 +136,18 @@ async def command_menu(message, state):
     """Обработчик команды /menu - всегда возвращает в главное меню"""
     await state.finish()
     user_id = message.from_user.id
-    clear_user_state(user_id)
+    await clear_user_state(user_id)
     
     msg = await message.answer(
         "👇 Главное меню:",
         reply_markup=main_menu_markup(user_id=user_id)
     )
-    save_user_state(user_id, "main_menu", None, msg.message_id)
+    await save_user_state(user_id, "main_menu", None, msg.message_id)
     logger.info(f"Пользователь {user_id} вернулся в главное меню через команду /menu")
 
-# 🔔 Фоновая задача: напоминания о незавершённых заявках
-async def check_incomplete_users():
-    while True:
-        try:
-            now = datetime.datetime.now()
-            current_time = now.time()
-            night_start = datetime.time(22, 30)  # 22:30
-            morning_end = datetime.time(8, 0)    # 08:00
-            is_night = (current_time >= night_start or current_time < morning_end)
-
-            # Проверяем пользователей в состоянии подачи заявки
-            if state_sheet is None:
-                logger.error("[ERROR] Лист 'UserState' не найден.")
-                await asyncio.sleep(3600)
-                continue
-
-            all_rows = state_sheet.get_all_values()
-            for row in all_rows[1:]:
-                if len(row) < 3:
-                    continue  # Пропускаем неполные строки
-                    
-                user_id = row[0]
-                state = row[1]
-                data_str = row[2]
-                
-                if not user_id or not user_id.isdigit():
-                    continue  # Пропускаем строки с некорректным user_id
-                
-                user_id = int(user_id)
-                data = json.loads(data_str) if data_str else None
-
-                if state.startswith("application_step") and data and "start_time" in data:
-                    try:
-                        start_time = datetime.datetime.fromisoformat(data["start_time"])
-                        delta = now - start_time
-                        
-                        if delta > datetime.timedelta(hours=1) and delta < datetime.timedelta(hours=2):
-                            if not is_night:
-                                try:
-                                    markup = InlineKeyboardMarkup()
-                                    markup.add(InlineKeyboardButton("📝 Продолжить заявку", callback_data="continue_app"))
-                                    markup.add(InlineKeyboardButton("🔙 В главное меню", callback_data="cancel_app"))
-                                    
-                                    await bot.send_message(
-                                        user_id, 
-                                        "👋 Вы начали подавать заявку, но не закончили. Продолжим?",
-                                        reply_markup=markup
-                                    )
-                                    logger.info(f"Напоминание отправлено пользователю {user_id} в {now}")
-                                except Exception as e:
-                                    logger.error(f"Ошибка отправки напоминания пользователю {user_id}: {e}")
-                            else:
-                                logger.info(f"Напоминание для пользователя {user_id} отложено, так как сейчас ночь (время: {current_time})")
-                                
-                        if delta > datetime.timedelta(days=1):
-                            clear_user_state(user_id)
-                            logger.info(f"Заявка пользователя {user_id} удалена, так как прошло больше 1 дня")
-                    except Exception as e:
-                        logger.error(f"Ошибка при обработке пользователя {user_id}: {e}")
-        except Exception as e:
-            logger.error(f"[ERROR] Ошибка в check_incomplete_users: {e}")
-
-        await asyncio.sleep(3600)  # Каждые 60 минут
-
 # 🔔 Фоновая задача: напоминания неактивным участникам
 async def check_inactive_users():
+    set_sheets_priority(BACKGROUND)
     while True:
         try:
             now = datetime.datetime.now()
@@ -217,12 +173,64 @@ async def check_inactive_users():
             logger.error(f"Ошибка в check_inactive_users: {e}")
             await asyncio.sleep(3600)  # При ошибке повторяем через час
 
+# 🪞 Фоновая задача: зеркалирование состояний пользователей в лист UserState
+async def mirror_states_periodically():
+    set_sheets_priority(BACKGROUND)
+    while True:
+        await asyncio.sleep(STATE_MIRROR_INTERVAL)
+        try:
+            await mirror_user_states()
+        except Exception as e:
+            logger.error(f"Ошибка в mirror_states_periodically: {e}")
+
+# 🔄 Фоновая задача: подтягивание в кэш Заявок правок, сделанных прямо в таблице
+async def sync_applications_periodically():
+    set_sheets_priority(BACKGROUND)
+    while True:
+        await asyncio.sleep(APPLICATIONS_SYNC_INTERVAL)
+        try:
+            await sync_applications()
+        except Exception as e:
+            logger.error(f"Ошибка в sync_applications_periodically: {e}")
+
+# 📒 Фоновая задача: перенос заявок из локального журнала в лист Заявки
+async def flush_submissions_periodically():
+    set_sheets_priority(ADMIN)
+    while True:
+        await asyncio.sleep(SUBMISSION_FLUSH_INTERVAL)
+        try:
+            # Пока журнал не пуст, пишем пачками без паузы
+            while await flush_submissions() > 0:
+                pass
+        except Exception as e:
+            logger.error(f"Ошибка в flush_submissions_periodically: {e}")
+
+# 🧮 Фоновые задачи: запись сумм баллов в лист Активность и их периодическая сверка
+async def flush_activity_totals_periodically():
+    # Суммы меняются после оценок админа — у записи приоритет админских запросов
+    set_sheets_priority(ADMIN)
+    while True:
+        await asyncio.sleep(ACTIVITY_TOTALS_FLUSH_INTERVAL)
+        try:
+            await flush_activity_totals()
+        except Exception as e:
+            logger.error(f"Ошибка в flush_activity_totals_periodically: {e}")
+
+async def reconcile_activity_periodically():
+    set_sheets_priority(BACKGROUND)
+    while True:
+        await asyncio.sleep(ACTIVITY_RECONCILE_INTERVAL)
+        try:
+            await reconcile_activity_totals()
+        except Exception as e:
+            logger.error(f"Ошибка в reconcile_activity_periodically: {e}")
+
 # Запуск бота
 async def on_startup(_):
-    logger.info("Бот запускается с polling...")
+    logger.info(f"Бот запускается в режиме {BOT_MODE}...")
     
     # Добавьте эту строку для проверки структуры таблицы
-    check_sheet_structure()
+    await check_sheet_structure()
     
     # Проверка обновления и отправка уведомлений
     is_updated = check_version_update()
@@ -230,22 +238,42 @@ async def on_startup(_):
         await notify_users_about_update()
         logger.info(f"Бот обновлен до версии {BOT_VERSION}")
     
+    # Переносим состояния из листа UserState при первом запуске с локальным хранилищем
+    imported = await import_user_states()
+    if imported:
+        logger.info(f"Импортировано состояний из листа UserState: {imported}")
+
     # Запуск фоновых задач
-    asyncio.create_task(check_incomplete_users())
+    reminder_scheduler.start(bot)
     asyncio.create_task(check_inactive_users())
+    resumed = resume_unfinished_campaigns(bot)
+    if resumed:
+        logger.info(f"Возобновлено незавершённых рассылок: {resumed}")
+    if STATE_MIRROR_INTERVAL > 0:
+        asyncio.create_task(mirror_states_periodically())
+    if APPLICATIONS_SYNC_INTERVAL > 0:
+        asyncio.create_task(sync_applications_periodically())
+    asyncio.create_task(flush_submissions_periodically())
+    asyncio.create_task(flush_activity_totals_periodically())
+    if ACTIVITY_RECONCILE_INTERVAL > 0:
+        asyncio.create_task(reconcile_activity_periodically())
+    if BOT_MODE != "webhook" and METRICS_PORT > 0:
+        await start_metrics_server(WEBAPP_HOST, METRICS_PORT)
     logger.info("Фоновые задачи запущены")
 
-# Обработчик для кнопки "продолжить заявку"
-@dp.callback_query_handler(text="continue_app", state="*")
-async def continue_application(callback_query, state):
-    """Обработчик для продолжения незавершенной заявки"""
-    user_id = callback_query.from_user.id
-    await state.finish()
-    
-    # В будущем здесь можно добавить восстановление шага заявки
-    # Пока просто перезапускаем процесс
-    await callback_query.message.delete()
-    await application_handlers.start_application(callback_query.message)
+async def on_shutdown(_):
+    # Дожидаемся обработки уже принятых обновлений
+    await dp.wait_idle(timeout=WEBHOOK_DRAIN_TIMEOUT)
+    # Переносим последние изменения состояний в таблицу
+    if STATE_MIRROR_INTERVAL > 0:
+        await mirror_user_states()
+    # Записываем заявки и суммы баллов, которые не успели уйти в таблицу
+    # (незаписанные заявки останутся в журнале до следующего запуска)
+    await flush_submissions()
+    await flush_activity_totals()
+    # Дожидаемся незавершённых запросов к Google Таблицам
+    sheets_async.shutdown()
+    logger.info("Бот остановлен")
 
 # Регистрируем обработчики
 user_handlers.register_handlers(dp)
@@ -254,4 +282,21 @@ admin_handlers.register_admin_handlers(dp)
 fallback_handler.register_fallback(dp)
 
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_HOST:
+            raise SystemExit("Для режима webhook нужно задать WEBHOOK_HOST")
+        if not WEBHOOK_SECRET:
+            raise SystemExit("Для режима webhook нужно задать WEBHOOK_SECRET")
+        run_webhook(
+            dp,
+            webhook_url=WEBHOOK_HOST.rstrip("/") + WEBHOOK_PATH,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT,
+            drain_timeout=WEBHOOK_DRAIN_TIMEOUT,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown
+        )
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
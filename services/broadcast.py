@@ -0,0 +1,235 @@
+# broadcast.py
+
+import asyncio
+import logging
+import time
+
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    BotKicked,
+    CantInitiateConversation,
+    CantTalkWithBots,
+    ChatNotFound,
+    MessageNotModified,
+    RetryAfter,
+    TelegramAPIError,
+    UserDeactivated
+)
+
+from config import BROADCAST_CONCURRENCY, BROADCAST_RATE, BROADCAST_PER_CHAT_INTERVAL
+from services.common import main_menu_markup, admin_menu_markup
+from services.local_db import db_lock, get_connection, transaction
+from services.rate_limit import TokenBucket, PerChatLimiter
+from services.sheets_async import save_user_state
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых повторять отправку этому получателю бессмысленно
+PERMANENT_ERRORS = (BotBlocked, BotKicked, CantInitiateConversation, CantTalkWithBots, ChatNotFound, UserDeactivated)
+MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 3  # секунды между обновлениями статуса у админа
+
+# Общие для всех рассылок лимиты Telegram: глобальный поток сообщений и частота в один чат
+_global_bucket = TokenBucket(BROADCAST_RATE)
+_chat_limiter = PerChatLimiter(BROADCAST_PER_CHAT_INTERVAL)
+_running = {}
+
+def _init_tables():
+    with db_lock:
+        conn = get_connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS broadcast_campaign ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "admin_id INTEGER NOT NULL, "
+            "from_chat_id INTEGER NOT NULL, "
+            "message_id INTEGER NOT NULL, "
+            "status_message_id INTEGER, "
+            "created_at REAL NOT NULL, "
+            "finished_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS broadcast_delivery ("
+            "campaign_id INTEGER NOT NULL, "
+            "recipient_id INTEGER NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT NOT NULL DEFAULT '', "
+            "updated_at REAL, "
+            "PRIMARY KEY (campaign_id, recipient_id))"
+        )
+
+_init_tables()
+
+def create_campaign(admin_id, from_chat_id, message_id, recipients, status_message_id=None):
+    """Сохраняет рассылку и список получателей, возвращает id кампании"""
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO broadcast_campaign (admin_id, from_chat_id, message_id, status_message_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (admin_id, from_chat_id, message_id, status_message_id, time.time())
+        )
+        campaign_id = cursor.lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO broadcast_delivery (campaign_id, recipient_id) VALUES (?, ?)",
+            [(campaign_id, int(recipient_id)) for recipient_id in recipients]
+        )
+    logger.info(f"Broadcast campaign {campaign_id} created for {len(recipients)} recipients")
+    return campaign_id
+
+def _load_campaign(campaign_id):
+    with db_lock:
+        return get_connection().execute(
+            "SELECT admin_id, from_chat_id, message_id, status_message_id FROM broadcast_campaign WHERE id = ?",
+            (campaign_id,)
+        ).fetchone()
+
+def _pending_recipients(campaign_id):
+    with db_lock:
+        rows = get_connection().execute(
+            "SELECT recipient_id FROM broadcast_delivery WHERE campaign_id = ? AND status = 'pending'",
+            (campaign_id,)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+def campaign_progress(campaign_id):
+    """Возвращает (отправлено, ошибок, всего) по кампании"""
+    with db_lock:
+        rows = get_connection().execute(
+            "SELECT status, COUNT(*) FROM broadcast_delivery WHERE campaign_id = ? GROUP BY status",
+            (campaign_id,)
+        ).fetchall()
+    counts = dict(rows)
+    return counts.get("sent", 0), counts.get("failed", 0), sum(counts.values())
+
+def _record_delivery(campaign_id, recipient_id, status, attempts, error=""):
+    with db_lock:
+        get_connection().execute(
+            "UPDATE broadcast_delivery SET status = ?, attempts = ?, error = ?, updated_at = ? "
+            "WHERE campaign_id = ? AND recipient_id = ?",
+            (status, attempts, error, time.time(), campaign_id, recipient_id)
+        )
+
+def _finish_campaign(campaign_id):
+    with db_lock:
+        get_connection().execute(
+            "UPDATE broadcast_campaign SET finished_at = ? WHERE id = ?",
+            (time.time(), campaign_id)
+        )
+
+async def _deliver(bot, campaign_id, from_chat_id, message_id, recipient_id):
+    """Отправляет копию сообщения одному получателю с повторами и учётом RetryAfter"""
+    attempts = 0
+    while True:
+        attempts += 1
+        await _global_bucket.acquire()
+        await _chat_limiter.wait(recipient_id)
+        try:
+            await bot.copy_message(
+                recipient_id,
+                from_chat_id,
+                message_id,
+                reply_markup=main_menu_markup(user_id=recipient_id)
+            )
+            _record_delivery(campaign_id, recipient_id, "sent", attempts)
+            return
+        except RetryAfter as e:
+            # Telegram просит притормозить — останавливаем всех отправителей
+            logger.warning(f"[WARNING] RetryAfter {e.timeout}s во время рассылки {campaign_id}")
+            _global_bucket.pause(e.timeout)
+            attempts -= 1
+        except PERMANENT_ERRORS as e:
+            _record_delivery(campaign_id, recipient_id, "failed", attempts, str(e))
+            return
+        except (TelegramAPIError, asyncio.TimeoutError) as e:
+            if attempts >= MAX_ATTEMPTS:
+                logger.error(f"[ERROR] Не удалось отправить рассылку пользователю {recipient_id}: {e}")
+                _record_delivery(campaign_id, recipient_id, "failed", attempts, str(e))
+                return
+            await asyncio.sleep(2 ** attempts)
+
+async def _update_status(bot, admin_id, status_message_id, campaign_id):
+    if not status_message_id:
+        return
+    sent, errors, total = campaign_progress(campaign_id)
+    try:
+        await _chat_limiter.wait(admin_id)
+        await bot.edit_message_text(
+            f"⏳ Отправлено {sent} из {total} сообщений (ошибок: {errors})...",
+            admin_id,
+            status_message_id
+        )
+    except MessageNotModified:
+        pass
+    except Exception as e:
+        logger.error(f"[ERROR] Не удалось обновить статус: {e}")
+
+async def run_campaign(bot, campaign_id):
+    """Рассылает сообщение всем ещё не обработанным получателям кампании"""
+    campaign = _load_campaign(campaign_id)
+    if campaign is None:
+        logger.error(f"[ERROR] Рассылка {campaign_id} не найдена")
+        return
+    admin_id, from_chat_id, message_id, status_message_id = campaign
+
+    queue = asyncio.Queue()
+    for recipient_id in _pending_recipients(campaign_id):
+        queue.put_nowait(recipient_id)
+
+    async def sender():
+        while True:
+            try:
+                recipient_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await _deliver(bot, campaign_id, from_chat_id, message_id, recipient_id)
+            except Exception as e:
+                logger.error(f"[ERROR] Не удалось отправить рассылку пользователю {recipient_id}: {e}")
+                _record_delivery(campaign_id, recipient_id, "failed", MAX_ATTEMPTS, str(e))
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await _update_status(bot, admin_id, status_message_id, campaign_id)
+
+    logger.info(f"Broadcast campaign {campaign_id}: {queue.qsize()} recipients pending")
+    progress_task = asyncio.create_task(reporter())
+    try:
+        await asyncio.gather(*(sender() for _ in range(BROADCAST_CONCURRENCY)))
+    finally:
+        progress_task.cancel()
+
+    _finish_campaign(campaign_id)
+    sent, errors, total = campaign_progress(campaign_id)
+    logger.info(f"Broadcast campaign {campaign_id} finished: {sent} sent, {errors} failed")
+
+    await _update_status(bot, admin_id, status_message_id, campaign_id)
+    await bot.send_message(
+        admin_id,
+        f"✅ Рассылка завершена.\n"
+        f"✓ Успешно отправлено: {sent} пользователям\n"
+        f"✗ Ошибок при отправке: {errors}"
+    )
+    msg = await bot.send_message(admin_id, "🛡 Админ-панель:", reply_markup=admin_menu_markup())
+    await save_user_state(admin_id, "admin_panel", None, msg.message_id)
+
+def start_campaign(bot, campaign_id):
+    """Запускает рассылку в фоне (повторный запуск той же кампании игнорируется)"""
+    task = _running.get(campaign_id)
+    if task is not None and not task.done():
+        return task
+    task = asyncio.create_task(run_campaign(bot, campaign_id))
+    _running[campaign_id] = task
+    task.add_done_callback(lambda _: _running.pop(campaign_id, None))
+    return task
+
+def resume_unfinished_campaigns(bot):
+    """Продолжает рассылки, прерванные перезапуском бота"""
+    with db_lock:
+        rows = get_connection().execute(
+            "SELECT id FROM broadcast_campaign WHERE finished_at IS NULL"
+        ).fetchall()
+    for (campaign_id,) in rows:
+        logger.info(f"Resuming broadcast campaign {campaign_id}")
+        start_campaign(bot, campaign_id)
+    return len(rows)
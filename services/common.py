@@ -24,6 +24,8 @@ def admin_menu_markup():
         InlineKeyboardButton("🎯 Проставить баллы", callback_data="admin_set_scores"),
         InlineKeyboardButton("📤 Отправить новость", callback_data="admin_send_news"),
         InlineKeyboardButton("📊 Посмотреть рейтинг", callback_data="admin_view_rating"),
-        InlineKeyboardButton("📈 Выгрузить рейтинг", callback_data="admin_export_rating")
+        InlineKeyboardButton("📈 Выгрузить рейтинг", callback_data="admin_export_rating"),
+        InlineKeyboardButton("📚 Выгрузить весь рейтинг", callback_data="admin_export_rating_all"),
+        InlineKeyboardButton("📉 Метрики", callback_data="admin_metrics")
     )
     return markup
@@ -0,0 +1,175 @@
+# fsm_storage.py
+
+import asyncio
+import copy
+import json
+import logging
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from config import FSM_FLUSH_INTERVAL
+from services.local_db import db_lock, get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+def _empty_record():
+    return {"state": None, "data": {}, "bucket": {}}
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM aiogram в локальной SQLite: состояние анкеты переживает перезапуск.
+
+    Чтение идёт из памяти (запись подгружается из базы при первом обращении), а изменения
+    копятся и записываются одной транзакцией раз в flush_interval секунд — несколько
+    вызовов set_state/update_data в одном обработчике дают одну запись в базу.
+    """
+
+    def __init__(self, flush_interval=FSM_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._records = {}
+        self._dirty = set()
+        self._flush_handle = None
+        with db_lock:
+            get_connection().execute(
+                "CREATE TABLE IF NOT EXISTS fsm_storage ("
+                "chat TEXT NOT NULL, "
+                "user TEXT NOT NULL, "
+                "state TEXT, "
+                "data TEXT NOT NULL DEFAULT '{}', "
+                "bucket TEXT NOT NULL DEFAULT '{}', "
+                "PRIMARY KEY (chat, user))"
+            )
+
+    def _record(self, chat, user):
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+        record = self._records.get(key)
+        if record is None:
+            with db_lock:
+                row = get_connection().execute(
+                    "SELECT state, data, bucket FROM fsm_storage WHERE chat = ? AND user = ?",
+                    (chat, user)
+                ).fetchone()
+            record = _empty_record()
+            if row is not None:
+                record = {"state": row[0], "data": json.loads(row[1]), "bucket": json.loads(row[2])}
+            self._records[key] = record
+        return key, record
+
+    def _changed(self, key):
+        self._dirty.add(key)
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Записывает накопленные изменения в базу одной транзакцией"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts = []
+        deletes = []
+        for key in dirty:
+            record = self._records.get(key)
+            if record is None or record == _empty_record():
+                # Пустые записи не храним ни в базе, ни в памяти
+                self._records.pop(key, None)
+                deletes.append(key)
+            else:
+                upserts.append((
+                    key[0], key[1], record["state"],
+                    json.dumps(record["data"], ensure_ascii=False),
+                    json.dumps(record["bucket"], ensure_ascii=False)
+                ))
+        try:
+            with transaction() as conn:
+                if upserts:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO fsm_storage (chat, user, state, data, bucket) VALUES (?, ?, ?, ?, ?)",
+                        upserts
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM fsm_storage WHERE chat = ? AND user = ?", deletes)
+        except Exception as e:
+            logger.error(f"[ERROR] Не удалось сохранить FSM-состояния: {e}")
+            self._dirty |= dirty
+
+    async def close(self):
+        self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        _, record = self._record(chat, user)
+        return record["state"] if record["state"] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        _, record = self._record(chat, user)
+        return copy.deepcopy(record["data"])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        key, record = self._record(chat, user)
+        record["state"] = self.resolve_state(state)
+        self._changed(key)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key, record = self._record(chat, user)
+        record["data"] = copy.deepcopy(data or {})
+        self._changed(key)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        key, record = self._record(chat, user)
+        record["data"].update(data or {}, **kwargs)
+        self._changed(key)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        _, record = self._record(chat, user)
+        return copy.deepcopy(record["bucket"])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        key, record = self._record(chat, user)
+        record["bucket"] = copy.deepcopy(bucket or {})
+        self._changed(key)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        key, record = self._record(chat, user)
+        record["bucket"].update(bucket or {}, **kwargs)
+        self._changed(key)
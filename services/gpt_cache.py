@@ -0,0 +1,178 @@
+# gpt_cache.py
+
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from config import GPT_CACHE_SIZE, GPT_CACHE_TTL, GPT_CACHE_SIMILARITY
+
+logger = logging.getLogger(__name__)
+
+# Служебные слова, которые не помогают отличать вопросы друг от друга
+STOP_WORDS = {
+    "а", "и", "в", "во", "на", "по", "к", "ко", "с", "со", "у", "о", "об", "от", "до", "за", "из",
+    "ли", "же", "бы", "то", "ну", "да", "я", "мне", "меня", "мы", "вы", "вам", "вас", "он", "она", "они",
+    "это", "этот", "эта", "есть", "быть", "будет", "ещё", "еще", "подскажите", "скажите", "пожалуйста",
+    "здравствуйте", "привет", "добрый", "день", "вечер", "спасибо"
+}
+# Отрицания и вопросительные слова меняют смысл вопроса («почему не начислили» ≠ «почему
+# начислили», «когда» ≠ «где»): похожий вопрос засчитывается, только если они совпадают
+MARKER_WORDS = {
+    "не", "нет", "ни", "нельзя", "без",
+    "что", "как", "где", "когда", "куда", "откуда", "почему", "зачем", "сколько", "кто", "чей",
+    "какой", "какие", "какая", "какое", "какую", "каким", "можно", "нужно"
+}
+_NON_WORD_RE = re.compile(r"[^\w#]+")
+STEM_LENGTH = 5  # грубая «основа» слова: падежные окончания не мешают совпадению
+
+def normalize_question(text):
+    """Приводит вопрос к каноническому виду: нижний регистр, ё→е, без пунктуации и лишних пробелов"""
+    text = text.lower().replace("ё", "е")
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+def question_terms(normalized):
+    """Значимые «основы» слов вопроса с частотами"""
+    return Counter(
+        word[:STEM_LENGTH]
+        for word in normalized.split()
+        if word not in STOP_WORDS and (len(word) > 1 or word.isdigit())
+    )
+
+def question_markers(normalized):
+    """Отрицания и вопросительные слова вопроса"""
+    return frozenset(word for word in normalized.split() if word in MARKER_WORDS)
+
+class AnswerCache:
+    """LRU-кэш ответов GPT с поиском почти одинаковых вопросов по TF-IDF.
+
+    Точное совпадение нормализованного текста отдаётся сразу, иначе ищется
+    сохранённый вопрос с теми же отрицаниями и вопросительными словами (MARKER_WORDS)
+    и косинусной близостью не ниже similarity.
+    """
+
+    def __init__(self, max_size=GPT_CACHE_SIZE, ttl=GPT_CACHE_TTL, similarity=GPT_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._postings = defaultdict(set)
+        self._doc_freq = Counter()
+        self._context_hash = None
+        self._lock = threading.Lock()
+
+    def _idf(self, term):
+        return math.log((len(self._entries) + 1) / (self._doc_freq[term] + 1)) + 1
+
+    def _vector(self, terms):
+        vector = {term: count * self._idf(term) for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return vector, norm
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for term in entry["terms"]:
+            self._doc_freq[term] -= 1
+            if self._doc_freq[term] <= 0:
+                del self._doc_freq[term]
+            self._postings[term].discard(key)
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def _expired(self, entry):
+        return time.monotonic() - entry["created_at"] > self.ttl
+
+    def _check_context(self, context):
+        """Сбрасывает кэш, если изменился системный промпт (например, rules_summary)"""
+        context_hash = hashlib.sha1(context.encode("utf-8")).hexdigest() if context else None
+        if context_hash != self._context_hash:
+            if self._entries:
+                logger.info("GPT answer cache flushed: prompt changed")
+            self._clear()
+            self._context_hash = context_hash
+
+    def _clear(self):
+        self._entries.clear()
+        self._postings.clear()
+        self._doc_freq.clear()
+
+    def get(self, question, context=None):
+        """Возвращает сохранённый ответ на такой же или очень похожий вопрос, либо None"""
+        key = normalize_question(question)
+        with self._lock:
+            self._check_context(context)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                entry = self._find_similar(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry["key"])
+            self.hits += 1
+            return entry["answer"]
+
+    def _find_similar(self, key):
+        terms = question_terms(key)
+        if not terms:
+            return None
+        candidates = set()
+        for term in terms:
+            candidates |= self._postings.get(term, set())
+
+        markers = question_markers(key)
+        query, query_norm = self._vector(terms)
+        best_entry = None
+        best_score = self.similarity
+        for candidate in candidates:
+            entry = self._entries[candidate]
+            if self._expired(entry) or entry["markers"] != markers:
+                continue
+            vector, norm = self._vector(entry["terms"])
+            dot = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            score = dot / (query_norm * norm)
+            if score >= best_score:
+                best_entry, best_score = entry, score
+        if best_entry is not None:
+            logger.info(f"GPT answer cache: '{key}' matched '{best_entry['key']}' ({best_score:.2f})")
+        return best_entry
+
+    def put(self, question, answer, context=None):
+        """Запоминает ответ, вытесняя самые давно использованные записи"""
+        key = normalize_question(question)
+        if not key:
+            return
+        with self._lock:
+            self._check_context(context)
+            if key in self._entries:
+                self._remove(key)
+            terms = question_terms(key)
+            self._entries[key] = {
+                "key": key, "terms": terms, "markers": question_markers(key),
+                "answer": answer, "created_at": time.monotonic()
+            }
+            for term in terms:
+                self._doc_freq[term] += 1
+                self._postings[term].add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Очищает кэш и возвращает число удалённых ответов"""
+        with self._lock:
+            count = len(self._entries)
+            self._clear()
+        logger.info(f"GPT answer cache flushed: {count} answers removed")
+        return count
+
+    def __len__(self):
+        return len(self._entries)
+
+answer_cache = AnswerCache()
@@ -0,0 +1,120 @@
+# leaderboard.py
+
+import bisect
+import itertools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+def parse_score(value):
+    """Баллы из ячейки листа Заявки (пусто или не число — 0)"""
+    value = str(value).strip()
+    return int(value) if value.isdigit() else 0
+
+class Leaderboard:
+    """Суммы баллов по участникам и упорядоченный список для быстрых запросов top-K.
+
+    Порядок хранится отсортированным списком ключей (-total, порядок появления, user_id),
+    поэтому top(K) — это срез из K элементов, а изменение баллов — два бинарных поиска.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._keys = {}
+        self._order = []
+        self._fallback_usernames = {}
+        self._sequence = itertools.count()
+        self._lock = threading.RLock()
+
+    def _reposition(self, user_id):
+        stats = self._users[user_id]
+        old_key = self._keys.get(user_id)
+        if old_key is not None:
+            del self._order[bisect.bisect_left(self._order, old_key)]
+        seq = old_key[1] if old_key is not None else next(self._sequence)
+        new_key = (-stats["total"], seq, user_id)
+        bisect.insort(self._order, new_key)
+        self._keys[user_id] = new_key
+
+    def rebuild(self, rows):
+        """Пересчитывает всё по строкам листа Заявки (без заголовка)"""
+        with self._lock:
+            self._users = {}
+            self._keys = {}
+            self._order = []
+            self._sequence = itertools.count()
+            for row in rows:
+                if len(row) < 9:
+                    continue
+                user_id = row[0]
+                stats = self._users.get(user_id)
+                if stats is None:
+                    stats = {"user_id": user_id, "username": row[1].strip(), "name": row[2], "count": 0, "total": 0}
+                    self._users[user_id] = stats
+                    self._keys[user_id] = next(self._sequence)
+                stats["count"] += 1
+                stats["total"] += parse_score(row[8])
+            # Сортируем один раз, а не вставляем каждую строку по отдельности
+            self._keys = {
+                user_id: (-self._users[user_id]["total"], seq, user_id)
+                for user_id, seq in self._keys.items()
+            }
+            self._order = sorted(self._keys.values())
+            logger.info(f"Leaderboard rebuilt: {len(self._users)} users")
+
+    def _add(self, user_id, username, name, score):
+        stats = self._users.get(user_id)
+        if stats is None:
+            stats = {"user_id": user_id, "username": username, "name": name, "count": 0, "total": 0}
+            self._users[user_id] = stats
+        stats["count"] += 1
+        stats["total"] += score
+        self._reposition(user_id)
+
+    def add_submission(self, user_id, username, name, score=0):
+        """Учитывает новую заявку участника"""
+        with self._lock:
+            self._add(str(user_id), (username or "").strip(), name, score)
+
+    def apply_score_delta(self, user_id, delta):
+        """Меняет сумму участника на delta (новые баллы минус прежние)"""
+        if not delta:
+            return
+        with self._lock:
+            stats = self._users.get(str(user_id))
+            if stats is None:
+                return
+            stats["total"] += delta
+            self._reposition(str(user_id))
+
+    def set_fallback_usernames(self, usernames):
+        """Username из листа Активность — на случай, если в Заявках он пустой"""
+        with self._lock:
+            self._fallback_usernames = dict(usernames)
+
+    def set_fallback_username(self, user_id, username):
+        with self._lock:
+            self._fallback_usernames[str(user_id)] = (username or "").strip()
+
+    def total(self, user_id):
+        with self._lock:
+            stats = self._users.get(str(user_id))
+            return stats["total"] if stats else 0
+
+    def top(self, limit=10):
+        """Первые limit участников по сумме баллов (limit=None — все)"""
+        with self._lock:
+            keys = self._order if limit is None else self._order[:limit]
+            result = []
+            for _, _, user_id in keys:
+                stats = dict(self._users[user_id])
+                if not stats["username"]:
+                    stats["username"] = self._fallback_usernames.get(user_id, "")
+                result.append(stats)
+            return result
+
+    def __len__(self):
+        return len(self._users)
+
+leaderboard = Leaderboard()
@@ -0,0 +1,35 @@
+# local_db.py
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import LOCAL_DB_PATH
+
+# 💾 Общее локальное хранилище бота (SQLite).
+# Соединение одно на процесс; запросы из пула потоков сериализуются блокировкой.
+db_lock = threading.RLock()
+_connection = None
+
+def get_connection():
+    """Возвращает соединение с локальной базой, открывая его при первом обращении"""
+    global _connection
+    with db_lock:
+        if _connection is None:
+            _connection = sqlite3.connect(LOCAL_DB_PATH, check_same_thread=False, isolation_level=None)
+            _connection.execute("PRAGMA journal_mode=WAL")
+            _connection.execute("PRAGMA synchronous=NORMAL")
+        return _connection
+
+@contextmanager
+def transaction():
+    """Выполняет несколько запросов в одной транзакции"""
+    with db_lock:
+        conn = get_connection()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,296 @@
+# metrics.py
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (в секундах): от быстрых ответов до медленных запросов к таблице
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+class Counter:
+    """Счётчик с метками (по образцу prometheus_client)"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self.values().items())]
+
+class Gauge(Counter):
+    """Текущее значение с метками (можно задавать, а не только увеличивать)"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """Гистограмма длительностей с метками: корзины, сумма и количество наблюдений"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._series[key] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def series(self):
+        with self._lock:
+            return {
+                key: {"buckets": list(series["buckets"]), "sum": series["sum"], "count": series["count"]}
+                for key, series in self._series.items()
+            }
+
+    def quantile(self, series, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины, в которую он попал)"""
+        rank = q * series["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, series["buckets"]):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = []
+        for key, series in sorted(self.series().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation):
+        metric = Counter(name, documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation):
+        metric = Gauge(name, documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# 📈 Метрики бота
+handler_latency = registry.histogram("bot_handler_seconds", "Время работы обработчиков aiogram")
+sheets_latency = registry.histogram("sheets_call_seconds", "Длительность вызовов gspread")
+sheets_calls = registry.counter("sheets_calls_total", "Вызовы gspread по методам и результату")
+applications_sync_seconds = registry.histogram("applications_sync_seconds", "Длительность цикла синхронизации листа Заявки")
+applications_sync_bytes = registry.counter("applications_sync_bytes_total", "Объём данных, прочитанных синхронизацией Заявок (оценка)")
+applications_synced_at = registry.gauge(
+    "applications_sync_last_success_timestamp_seconds", "Время последней сверки кэша Заявок с таблицей (unix)"
+)
+submission_journal_pending = registry.gauge("submission_journal_pending", "Заявки в журнале, ещё не записанные в таблицу")
+gpt_latency = registry.histogram("gpt_request_seconds", "Длительность запросов к модели")
+gpt_requests = registry.counter("gpt_requests_total", "Вопросы к GPT по результату (cache/ok/timeout/error)")
+gpt_tokens = registry.counter("gpt_tokens_total", "Израсходованные токены модели")
+sheets_quota_wait = registry.histogram("sheets_quota_wait_seconds", "Ожидание квоты Sheets API по приоритетам")
+sheets_retries = registry.counter("sheets_retries_total", "Повторы вызовов gspread после 429 и 5xx")
+telegram_requests = registry.counter("telegram_requests_total", "Запросы к Bot API по методам и результату")
+
+@contextmanager
+def track_sheets_call(method, sheet=""):
+    """Считает вызов gspread: длительность, успех или ошибку"""
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        sheets_latency.observe(time.perf_counter() - started, method=method, sheet=sheet)
+        sheets_calls.inc(method=method, sheet=sheet, status=status)
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика сообщений и callback-кнопок"""
+
+    def _start(self, data):
+        handler = current_handler.get()
+        data["metrics_handler"] = getattr(handler, "__name__", "unknown")
+        data["metrics_started"] = time.perf_counter()
+
+    def _finish(self, data):
+        started = data.get("metrics_started")
+        if started is not None:
+            handler_latency.observe(time.perf_counter() - started, handler=data["metrics_handler"])
+
+    async def on_process_message(self, message, data):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        self._finish(data)
+
+    async def on_process_callback_query(self, callback_query, data):
+        self._start(data)
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        self._finish(data)
+
+class MeteredBot(Bot):
+    """Bot, который считает успешные и неудачные запросы к Bot API"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method == "getUpdates":
+            return await super().request(method, data, files, **kwargs)
+        try:
+            result = await super().request(method, data, files, **kwargs)
+        except Exception as e:
+            telegram_requests.inc(method=method, status=type(e).__name__)
+            raise
+        telegram_requests.inc(method=method, status="ok")
+        return result
+
+async def metrics_handler(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host, port):
+    """Отдельный aiohttp-сервер с /metrics (для режима polling)"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
+
+def _format_histogram(histogram, label, limit=8):
+    rows = sorted(histogram.series().items(), key=lambda item: -item[1]["sum"])[:limit]
+    lines = []
+    for key, series in rows:
+        name = dict(key).get(label, "?")
+        if "sheet" in dict(key) and dict(key)["sheet"]:
+            name = f"{dict(key)['sheet']}.{name}"
+        avg = series["sum"] / series["count"] * 1000 if series["count"] else 0
+        p95 = histogram.quantile(series, 0.95)
+        lines.append(f"• {name}: {series['count']} шт., среднее {avg:.0f} мс, p95 ≤ {p95 * 1000:.0f} мс")
+    return lines
+
+def summary():
+    """Краткая сводка метрик для админ-панели"""
+    lines = ["📉 <b>Метрики с момента запуска</b>", "", "<b>Обработчики</b> (по суммарному времени):"]
+    lines += _format_histogram(handler_latency, "handler") or ["• нет данных"]
+
+    lines += ["", "<b>Google Таблицы:</b>"]
+    lines += _format_histogram(sheets_latency, "method") or ["• нет данных"]
+    sheet_errors = sum(value for key, value in sheets_calls.values().items() if dict(key)["status"] == "error")
+    lines.append(f"Ошибок: {sheet_errors}")
+    unsent = submission_journal_pending.values().get((), 0)
+    if unsent:
+        lines.append(f"Заявок ждут записи в таблицу: {unsent}")
+    synced_at = applications_synced_at.values().get(())
+    sync_series = applications_sync_seconds.series().get(())
+    if synced_at and sync_series:
+        sync_bytes = applications_sync_bytes.values().get((), 0)
+        lines.append(
+            f"Синхронизация Заявок: {time.time() - synced_at:.0f} с назад, "
+            f"циклов {sync_series['count']}, в среднем {sync_bytes / sync_series['count'] / 1024:.1f} КБ за цикл"
+        )
+
+    gpt = {dict(key)["result"]: value for key, value in gpt_requests.values().items()}
+    tokens = {dict(key)["kind"]: value for key, value in gpt_tokens.values().items()}
+    gpt_series = gpt_latency.series().get((), {"sum": 0.0, "count": 0})
+    gpt_avg = gpt_series["sum"] / gpt_series["count"] if gpt_series["count"] else 0
+    lines += [
+        "", "<b>GPT:</b>",
+        f"• из кэша: {gpt.get('cache', 0)}, от модели: {gpt.get('ok', 0)}, "
+        f"таймаутов: {gpt.get('timeout', 0)}, ошибок: {gpt.get('error', 0)}",
+        f"• среднее время ответа модели: {gpt_avg:.1f} с",
+        f"• токены: {tokens.get('prompt', 0)} на вопросы, {tokens.get('completion', 0)} на ответы"
+    ]
+
+    sent_ok = 0
+    sent_errors = {}
+    for key, value in telegram_requests.values().items():
+        status = dict(key)["status"]
+        if status == "ok":
+            sent_ok += value
+        else:
+            sent_errors[status] = sent_errors.get(status, 0) + value
+    lines += ["", "<b>Telegram:</b>", f"• успешных запросов: {sent_ok}"]
+    for status, value in sorted(sent_errors.items(), key=lambda item: -item[1]):
+        lines.append(f"• {status}: {value}")
+    return "\n".join(lines)
@@ -0,0 +1,143 @@
+# rate_limit.py
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+class TokenBucket:
+    """Токен-бакет: в среднем не больше rate событий в секунду, всплеск до capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens=1):
+        """Забирает токены (можно в долг) и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def _pause_left(self):
+        with self._lock:
+            return self._paused_until - time.monotonic()
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов на seconds секунд (например, после 429 / RetryAfter)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens=1):
+        """Ждёт, пока можно выполнить следующее действие"""
+        await asyncio.sleep(self._reserve(tokens))
+        delay = self._pause_left()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._pause_left()
+
+class PerChatLimiter:
+    """Ограничивает частоту сообщений в один чат: не чаще одного раза в interval секунд"""
+
+    MAX_TRACKED_CHATS = 10000
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_allowed = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        if len(self._next_allowed) > self.MAX_TRACKED_CHATS:
+            self._next_allowed = {chat: at for chat, at in self._next_allowed.items() if at > now}
+        allowed_at = max(now, self._next_allowed.get(chat_id, 0.0))
+        self._next_allowed[chat_id] = allowed_at + self.interval
+        if allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+
+class PriorityTokenBucket:
+    """Потокобезопасный токен-бакет с приоритетами для синхронного кода (пул потоков).
+
+    Токен получает ожидающий с наименьшим priority, при равенстве — пришедший раньше.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов на seconds секунд (например, после 429)"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def acquire(self, priority=0):
+        """Блокирует поток, пока не подойдёт его очередь и не появится токен"""
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    first = self._waiters[0] == ticket
+                    if now < self._paused_until:
+                        timeout = self._paused_until - now
+                    elif first and self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    elif first:
+                        timeout = (1 - self._tokens) / self.rate
+                    else:
+                        timeout = None  # ждём, пока более приоритетные получат токены
+                    self._cond.wait(timeout)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+class PrioritySemaphore:
+    """asyncio-семафор, который отдаёт освободившееся место самому приоритетному ожидающему"""
+
+    def __init__(self, value):
+        self._free = value
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    async def acquire(self, priority=0):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже отдали этой задаче — возвращаем его следующему
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
@@ -0,0 +1,183 @@
+# reminders.py
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from services.sheets import add_state_listener
+from services.sheets_async import get_all_user_states, get_user_state, clear_user_state
+from services.sheets_governor import BACKGROUND, set_sheets_priority
+
+logger = logging.getLogger(__name__)
+
+REMINDER_DELAY = datetime.timedelta(hours=1)
+# Напоминание, которое не успели отправить вовремя (например, бот был выключен), ещё актуально в течение часа
+REMINDER_GRACE = datetime.timedelta(hours=1)
+CLEANUP_DELAY = datetime.timedelta(days=1)
+
+# Тихие часы: напоминания не отправляются с 22:30 до 08:00, а переносятся на утро
+NIGHT_START = datetime.time(22, 30)
+MORNING_END = datetime.time(8, 0)
+
+REMINDER = "reminder"
+CLEANUP = "cleanup"
+
+def is_quiet_time(moment):
+    current_time = moment.time()
+    return current_time >= NIGHT_START or current_time < MORNING_END
+
+def next_morning(moment):
+    """Ближайшие 08:00 после moment"""
+    morning = datetime.datetime.combine(moment.date(), MORNING_END)
+    if moment.time() >= NIGHT_START:
+        morning += datetime.timedelta(days=1)
+    return morning
+
+class ReminderScheduler:
+    """Очередь с приоритетом по сроку: напоминания о незавершённых заявках и их очистка через сутки.
+
+    Задачи добавляются при сохранении состояния application_step_* (из любого потока)
+    и срабатывают точно в срок; устаревшие задачи отбрасываются при срабатывании.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        # user_id → start_time текущей заявки; задачи для других start_time устарели
+        self._active = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._bot = None
+
+    def _push(self, due, kind, user_id, start_time):
+        with self._lock:
+            heapq.heappush(self._heap, (due, next(self._counter), kind, user_id, start_time))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def notify_state(self, user_id, state, data):
+        """Получает каждое сохранение/очистку состояния пользователя"""
+        user_id = int(user_id)
+        if not state or not state.startswith("application_step"):
+            with self._lock:
+                self._active.pop(user_id, None)
+            return
+        start_time = (data or {}).get("start_time")
+        if not start_time:
+            return  # Шаг без start_time продолжает уже запланированную заявку
+        with self._lock:
+            if self._active.get(user_id) == start_time:
+                return
+            self._active[user_id] = start_time
+        self._schedule(user_id, start_time, datetime.datetime.now())
+
+    def _schedule(self, user_id, start_time, now):
+        try:
+            started = datetime.datetime.fromisoformat(start_time)
+        except ValueError:
+            logger.error(f"Некорректное start_time у пользователя {user_id}: {start_time}")
+            return
+        reminder_at = started + REMINDER_DELAY
+        cleanup_at = started + CLEANUP_DELAY
+        if is_quiet_time(reminder_at):
+            reminder_at = next_morning(reminder_at)
+            if reminder_at < now:
+                # Утро уже наступило, пока бот не работал — напоминаем сразу
+                reminder_at = now
+        elif reminder_at + REMINDER_GRACE < now:
+            reminder_at = None
+        if reminder_at is not None and reminder_at < cleanup_at:
+            self._push(reminder_at, REMINDER, user_id, start_time)
+        self._push(max(cleanup_at, now), CLEANUP, user_id, start_time)
+
+    def _is_current(self, user_id, start_time):
+        with self._lock:
+            return self._active.get(user_id) == start_time
+
+    async def load_pending(self):
+        """Восстанавливает расписание по сохранённым состояниям (после перезапуска)"""
+        now = datetime.datetime.now()
+        count = 0
+        for user_id, state, data, _ in await get_all_user_states():
+            if not user_id or not str(user_id).isdigit():
+                continue
+            if state.startswith("application_step") and data and data.get("start_time"):
+                with self._lock:
+                    self._active[int(user_id)] = data["start_time"]
+                self._schedule(int(user_id), data["start_time"], now)
+                count += 1
+        logger.info(f"Запланированы напоминания для {count} незавершённых заявок")
+
+    def start(self, bot):
+        """Запускает обработку очереди в текущем event loop"""
+        self._bot = bot
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        return asyncio.create_task(self._run())
+
+    async def _run(self):
+        set_sheets_priority(BACKGROUND)
+        await self.load_pending()
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                next_due = self._heap[0][0] if self._heap else None
+            if next_due is not None:
+                delay = (next_due - datetime.datetime.now()).total_seconds()
+                if delay <= 0:
+                    with self._lock:
+                        _, _, kind, user_id, start_time = heapq.heappop(self._heap)
+                    try:
+                        await self._fire(kind, user_id, start_time)
+                    except Exception as e:
+                        logger.error(f"Ошибка при обработке пользователя {user_id}: {e}")
+                    continue
+            else:
+                delay = None
+            # Спим до ближайшего срока или до появления новой, более ранней задачи
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, kind, user_id, start_time):
+        if not self._is_current(user_id, start_time):
+            return
+        state, _, _ = await get_user_state(user_id)
+        if not state.startswith("application_step"):
+            with self._lock:
+                self._active.pop(user_id, None)
+            return
+
+        if kind == CLEANUP:
+            await clear_user_state(user_id)
+            logger.info(f"Заявка пользователя {user_id} удалена, так как прошло больше 1 дня")
+            return
+
+        now = datetime.datetime.now()
+        if is_quiet_time(now):
+            logger.info(f"Напоминание для пользователя {user_id} отложено до утра (время: {now.time()})")
+            self._push(next_morning(now), REMINDER, user_id, start_time)
+            return
+        try:
+            markup = InlineKeyboardMarkup()
+            markup.add(InlineKeyboardButton("📝 Продолжить заявку", callback_data="continue_app"))
+            markup.add(InlineKeyboardButton("🔙 В главное меню", callback_data="cancel_app"))
+
+            await self._bot.send_message(
+                user_id,
+                "👋 Вы начали подавать заявку, но не закончили. Продолжим?",
+                reply_markup=markup
+            )
+            logger.info(f"Напоминание отправлено пользователю {user_id} в {now}")
+        except Exception as e:
+            logger.error(f"Ошибка отправки напоминания пользователю {user_id}: {e}")
+
+reminder_scheduler = ReminderScheduler()
+add_state_listener(reminder_scheduler.notify_state)
@@ -0,0 +1,213 @@
+# row_index.py
+
+import logging
+import re
+import threading
+import time
+
+from gspread.utils import rowcol_to_a1
+
+from config import ROW_INDEX_MISS_REBUILD_INTERVAL
+from services.local_db import db_lock, get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_UPDATED_ROW_RE = re.compile(r"![A-Z]+(\d+)")
+
+def appended_row_number(response):
+    """Достаёт номер добавленной строки из ответа append_row ('Лист'!A12:D12 → 12)"""
+    try:
+        match = _UPDATED_ROW_RE.search(response["updates"]["updatedRange"])
+    except (KeyError, TypeError):
+        return None
+    return int(match.group(1)) if match else None
+
+class RowIndex:
+    """Индекс «значение колонки (по умолчанию A) → номер строки» для листа таблицы.
+
+    Заполняется лениво одним чтением колонки, пополняется при добавлении строк
+    и перестраивается, если найденная по индексу строка оказалась чужой.
+    """
+
+    def __init__(self, name, verify=False, column=1):
+        self.name = name
+        # verify=True — перед записью сверять ключевую колонку найденной строки (лист правят вручную)
+        self.verify = verify
+        self.column = column
+        self._letter = rowcol_to_a1(1, column)[:-1]
+        self._rows = None
+        self._rebuilt_at = None
+        self._lock = threading.RLock()
+        # Одно построение на всех: остальные потоки ждут его, а не читают колонку сами
+        self._build_lock = threading.Lock()
+
+    def set_keys(self, keys, first_row=2):
+        """Строит индекс по уже известным значениям колонки, начиная со строки first_row"""
+        rows = {}
+        for row_idx, key in enumerate(keys, start=first_row):
+            if key and key not in rows:
+                rows[key] = row_idx
+        with self._lock:
+            previous = self._rows
+            self._rows = rows
+            self._persist(rows, previous)
+        return rows
+
+    def rebuild(self, worksheet):
+        """Перечитывает ключевую колонку и строит индекс заново"""
+        rows = self.set_keys(worksheet.col_values(self.column)[1:])
+        with self._lock:
+            self._rebuilt_at = time.monotonic()
+        logger.info(f"Row index for '{self.name}' rebuilt: {len(rows)} keys")
+
+    def invalidate(self):
+        """Сбрасывает индекс, он будет перестроен при следующем обращении"""
+        with self._lock:
+            self._rows = None
+            self._persist(None)
+
+    def _ensure_restored(self):
+        """Подгружает сохранённый индекс, если он ещё не в памяти; возвращает, есть ли индекс"""
+        with self._lock:
+            if self._rows is None:
+                self._rows = self._restore()
+            return self._rows is not None
+
+    def add(self, key, row_idx):
+        """Запоминает строку, добавленную ботом"""
+        with self._lock:
+            # Индекс мог быть ещё не подгружен из базы (например, запись журнала при запуске):
+            # без подгрузки ключ потерялся бы, а сохранённый индекс остался бы без него
+            self._ensure_restored()
+            if self._rows is not None and row_idx:
+                self._rows[key] = row_idx
+                self._persist_one(key, row_idx)
+            elif self._rows is not None:
+                # Номер строки неизвестен — надёжнее перечитать колонку при следующем поиске
+                self._rows = None
+                self._persist(None)
+
+    def lookup(self, worksheet, key):
+        """Возвращает номер строки по индексу (без проверки) или None"""
+        self._ensure_restored()
+        with self._lock:
+            rows = self._rows
+        if rows is None:
+            with self._build_lock:
+                with self._lock:
+                    rows = self._rows
+                if rows is None:
+                    self.rebuild(worksheet)
+                    with self._lock:
+                        rows = self._rows
+        return rows.get(key)
+
+    def locate(self, worksheet, key):
+        """Находит строку с ключом key; при verify сверяет ключевую колонку и перестраивает индекс при расхождении"""
+        # Индекс, восстановленный из базы, мог устареть так же, как построенный раньше в этом процессе
+        was_loaded = self._ensure_restored()
+        row_idx = self.lookup(worksheet, key)
+        if not self.verify:
+            return row_idx
+        if row_idx is None:
+            # Строку могли добавить вручную после построения индекса
+            if was_loaded and self._miss_rebuild_due():
+                self.rebuild(worksheet)
+                return self.lookup(worksheet, key)
+            return None
+        if worksheet.acell(f"{self._letter}{row_idx}").value == key:
+            return row_idx
+        logger.warning(f"Row index for '{self.name}' is stale at row {row_idx}, rebuilding")
+        self.rebuild(worksheet)
+        return self.lookup(worksheet, key)
+
+    def locate_many(self, worksheet, keys):
+        """Как locate, но для нескольких ключей: все строки сверяются одним batch_get.
+
+        Возвращает {ключ: номер строки или None}.
+        """
+        was_loaded = self._ensure_restored()
+        found = {key: self.lookup(worksheet, key) for key in keys}
+        if not self.verify:
+            return found
+        present = [(key, row_idx) for key, row_idx in found.items() if row_idx is not None]
+        stale = False
+        if present:
+            cells = worksheet.batch_get([f"{self._letter}{row_idx}" for _, row_idx in present])
+            stale = any(
+                (values[0][0] if values and values[0] else "") != key
+                for (key, _), values in zip(present, cells)
+            )
+        if stale or (was_loaded and len(present) < len(found) and self._miss_rebuild_due()):
+            logger.warning(f"Row index for '{self.name}' is stale, rebuilding")
+            self.rebuild(worksheet)
+            found = {key: self.lookup(worksheet, key) for key in keys}
+        return found
+
+    def _miss_rebuild_due(self):
+        """Можно ли перечитать колонку из-за промаха.
+
+        Промах — обычное дело (новый пользователь, которого сейчас добавят),
+        поэтому колонка перечитывается не чаще раза в ROW_INDEX_MISS_REBUILD_INTERVAL секунд.
+        """
+        with self._lock:
+            return self._rebuilt_at is None or time.monotonic() - self._rebuilt_at >= ROW_INDEX_MISS_REBUILD_INTERVAL
+
+    # Хуки хранения индекса между перезапусками (см. PersistentRowIndex)
+    def _restore(self):
+        return None
+
+    def _persist(self, rows, previous=None):
+        pass
+
+    def _persist_one(self, key, row_idx):
+        pass
+
+class PersistentRowIndex(RowIndex):
+    """RowIndex, который хранит индекс в локальной базе: после перезапуска
+    ключевую колонку не нужно перечитывать из таблицы"""
+
+    def __init__(self, name, verify=False, column=1):
+        super().__init__(name, verify=verify, column=column)
+        with db_lock:
+            get_connection().execute(
+                "CREATE TABLE IF NOT EXISTS row_index ("
+                "name TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "row INTEGER NOT NULL, "
+                "PRIMARY KEY (name, key))"
+            )
+
+    def _load(self):
+        with db_lock:
+            rows = get_connection().execute("SELECT key, row FROM row_index WHERE name = ?", (self.name,)).fetchall()
+        return dict(rows)
+
+    def _restore(self):
+        rows = self._load()
+        if not rows:
+            return None
+        logger.info(f"Row index for '{self.name}' restored: {len(rows)} keys")
+        return rows
+
+    def _persist(self, rows, previous=None):
+        if rows is None:
+            with db_lock:
+                get_connection().execute("DELETE FROM row_index WHERE name = ?", (self.name,))
+            return
+        # Пишем только разницу с сохранённым: после полной перезагрузки листа она обычно пустая
+        if previous is None:
+            previous = self._load()
+        changed = [(self.name, key, row_idx) for key, row_idx in rows.items() if previous.get(key) != row_idx]
+        removed = [(self.name, key) for key in previous.keys() - rows.keys()]
+        if not changed and not removed:
+            return
+        with transaction() as conn:
+            conn.executemany("DELETE FROM row_index WHERE name = ? AND key = ?", removed)
+            conn.executemany("INSERT OR REPLACE INTO row_index (name, key, row) VALUES (?, ?, ?)", changed)
+
+    def _persist_one(self, key, row_idx):
+        with db_lock:
+            get_connection().execute(
+                "INSERT OR REPLACE INTO row_index (name, key, row) VALUES (?, ?, ?)", (self.name, key, row_idx)
+            )
@@ -0,0 +1,82 @@
+# sheet_records.py
+
+import dataclasses
+from dataclasses import dataclass
+from typing import ClassVar, Dict
+
+from config import ACTIVITY_SHEET_NAME
+from services.leaderboard import parse_score
+
+def _convert(field, value):
+    if field.type is int:
+        return parse_score(value)
+    return value
+
+@dataclass
+class SheetRecord:
+    """Строка листа таблицы в виде записи с именованными и типизированными полями.
+
+    COLUMNS задаёт букву колонки для каждого поля; поля, которые не читались
+    (проекция), остаются со значениями по умолчанию. row — номер строки в листе.
+    """
+
+    SHEET: ClassVar[str] = ""
+    COLUMNS: ClassVar[Dict[str, str]] = {}
+
+    row: int = 0
+
+    @classmethod
+    def field_names(cls):
+        return list(cls.COLUMNS)
+
+    @classmethod
+    def from_cells(cls, cells, row=0):
+        """Запись из словаря {поле: строка из ячейки}"""
+        fields = {field.name: field for field in dataclasses.fields(cls)}
+        return cls(row=row, **{name: _convert(fields[name], value) for name, value in cells.items()})
+
+    @classmethod
+    def from_row(cls, values, row=0):
+        """Запись из полной строки листа (список значений от колонки A)"""
+        cells = {}
+        for name, letter in cls.COLUMNS.items():
+            index = ord(letter) - ord("A")
+            cells[name] = values[index] if index < len(values) else ""
+        return cls.from_cells(cells, row)
+
+@dataclass
+class ApplicationRecord(SheetRecord):
+    """Заявка из листа Заявки"""
+
+    SHEET: ClassVar[str] = "Заявки"
+    COLUMNS: ClassVar[Dict[str, str]] = {
+        "user_id": "A", "username": "B", "name": "C", "submission_id": "D", "link": "E",
+        "date": "F", "location": "G", "submitted_at": "H", "score": "I", "monument": "J"
+    }
+
+    user_id: str = ""
+    username: str = ""
+    name: str = ""
+    submission_id: str = ""
+    link: str = ""
+    date: str = ""
+    location: str = ""
+    submitted_at: str = ""
+    score: int = 0
+    monument: str = ""
+
+@dataclass
+class ActivityRecord(SheetRecord):
+    """Участник из листа Активность"""
+
+    SHEET: ClassVar[str] = ACTIVITY_SHEET_NAME
+    COLUMNS: ClassVar[Dict[str, str]] = {
+        "user_id": "A", "username": "B", "name": "C", "date": "D", "action": "E", "total": "G"
+    }
+
+    user_id: str = ""
+    username: str = ""
+    name: str = ""
+    date: str = ""
+    action: str = ""
+    total: int = 0
@@ -3,16 +3,30 @@
 import os
 import json
 import gspread
+from gspread.utils import rowcol_to_a1, absolute_range_name, fill_gaps
 import time
 import datetime
 import logging
+import threading
 from oauth2client.service_account import ServiceAccountCredentials
-from config import SPREADSHEET_ID, ACTIVITY_SHEET_NAME
+from config import SPREADSHEET_ID, ACTIVITY_SHEET_NAME, APPLICATIONS_CACHE_TTL, STATE_BACKEND, SUBMISSION_FLUSH_BATCH
 from services.common import main_menu_markup
+from services.state_store import DEFAULT_STATE, StateStore, SQLiteStateStore
+from services.row_index import RowIndex, PersistentRowIndex, appended_row_number
+from services.leaderboard import leaderboard, parse_score
+from services.url_index import url_index
+from services import submission_journal
+from services.logging_setup import rate_limited_logger
+from services.metrics import (
+    track_sheets_call, applications_sync_seconds, applications_sync_bytes, applications_synced_at,
+    submission_journal_pending
+)
+from services.sheets_governor import governor, NON_IDEMPOTENT_METHODS
+from services.sheet_records import ApplicationRecord, ActivityRecord
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Записи «по одной на пользователя» в массовых операциях — с ограничением частоты
+bulk_logger = rate_limited_logger(f"{__name__}.bulk", rate=5)
 
 # 🔐 Авторизация Google Sheets с повторными попытками
 def get_gspread_client(max_retries=3):
@@ -38,121 +52,662 @@ def get_gspread_client(max_retries=3):
                 logger.error(f"Failed to connect to Google Sheets after {max_retries} attempts")
                 raise
 
-client = get_gspread_client()
+# 📚 Реестр листов: каждый лист открывается один раз, клиент переавторизуется по истечении токена
+TOKEN_REFRESH_INTERVAL = 45 * 60  # токен сервисного аккаунта живёт час
+STATE_SHEET_NAME = "UserState"
+STATE_SHEET_HEADER = ["user_id", "state", "data", "last_message_id"]
 
-# 📄 Получение листа Активность
-try:
-    sheet = client.open_by_key(SPREADSHEET_ID).worksheet(ACTIVITY_SHEET_NAME)
-except Exception as e:
-    logger.error(f"Error accessing Activity sheet: {e}")
-    sheet = None
+class WorksheetProxy:
+    """Обёртка над листом gspread: каждый вызов метода проходит через governor (квота,
+    приоритеты, повторы при 429) и попадает в метрики (время, ошибки)"""
 
-# 📄 Лист для хранения состояния пользователей
-try:
-    state_sheet = client.open_by_key(SPREADSHEET_ID).worksheet("UserState")
-except Exception:
-    # Если лист не существует, создаём его
-    try:
-        spreadsheet = client.open_by_key(SPREADSHEET_ID)
-        state_sheet = spreadsheet.add_worksheet(title="UserState", rows="1000", cols="4")
-        state_sheet.append_row(["user_id", "state", "data", "last_message_id"])
-        logger.info("Created new UserState worksheet")
-    except Exception as e:
-        logger.error(f"Failed to create UserState worksheet: {e}")
-        state_sheet = None
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+        title = self._worksheet.title
+
+        def attempt(*args, **kwargs):
+            with track_sheets_call(name, title):
+                return attr(*args, **kwargs)
+
+        if name in NON_IDEMPOTENT_METHODS:
+            def call(*args, **kwargs):
+                return governor.call_non_idempotent(attempt, *args, **kwargs)
+        else:
+            def call(*args, **kwargs):
+                return governor.call(attempt, *args, **kwargs)
+        return call
+
+class WorksheetRegistry:
+    """Лениво открывает таблицу и листы и кэширует их дескрипторы"""
+
+    def __init__(self, spreadsheet_id):
+        self.spreadsheet_id = spreadsheet_id
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._authorized_at = 0.0
+        self._lock = threading.RLock()
+
+    def _token_expired(self):
+        if self._client is None:
+            return True
+        if time.monotonic() - self._authorized_at > TOKEN_REFRESH_INTERVAL:
+            return True
+        # gspread < 6 хранит учётные данные в client.auth, gspread 6 — в client.http_client.auth
+        creds = getattr(self._client, "auth", None) or getattr(getattr(self._client, "http_client", None), "auth", None)
+        return bool(getattr(creds, "access_token_expired", False))
+
+    def reauthorize(self):
+        """Получает новый клиент через get_gspread_client и сбрасывает открытые листы"""
+        with self._lock:
+            self._client = get_gspread_client()
+            self._authorized_at = time.monotonic()
+            self._spreadsheet = None
+            self._worksheets.clear()
+            logger.info("Google Sheets client authorized")
+
+    def client(self):
+        with self._lock:
+            if self._token_expired():
+                self.reauthorize()
+            return self._client
+
+    def spreadsheet(self):
+        with self._lock:
+            client = self.client()
+            if self._spreadsheet is None:
+                self._spreadsheet = governor.call(client.open_by_key, self.spreadsheet_id)
+            return self._spreadsheet
+
+    def worksheet(self, title, header=None):
+        """Возвращает лист title; если передан header, отсутствующий лист создаётся с этим заголовком"""
+        with self._lock:
+            spreadsheet = self.spreadsheet()
+            worksheet = self._worksheets.get(title)
+            if worksheet is None:
+                try:
+                    worksheet = governor.call(spreadsheet.worksheet, title)
+                except gspread.exceptions.WorksheetNotFound:
+                    if header is None:
+                        raise
+                    worksheet = governor.call(spreadsheet.add_worksheet, title=title, rows="1000", cols=str(len(header)))
+                    governor.call_non_idempotent(worksheet.append_row, header)
+                    logger.info(f"Created new {title} worksheet")
+                self._worksheets[title] = WorksheetProxy(worksheet)
+            return self._worksheets[title]
+
+worksheets = WorksheetRegistry(SPREADSHEET_ID)
+
+def get_worksheet(title):
+    """Возвращает лист таблицы из реестра"""
+    return worksheets.worksheet(title)
+
+def get_activity_sheet():
+    """📄 Лист Активность"""
+    return worksheets.worksheet(ACTIVITY_SHEET_NAME)
+
+def get_state_sheet():
+    """📄 Лист для хранения состояния пользователей (создаётся при отсутствии)"""
+    return worksheets.worksheet(STATE_SHEET_NAME, header=STATE_SHEET_HEADER)
+
+# 📐 Чтение только нужных колонок, в том числе с нескольких листов одним запросом values:batchGet
+APPLICATION_WIDTH = len(ApplicationRecord.COLUMNS)  # колонки A..J листа Заявки
+
+def values_batch_get(ranges):
+    """Читает несколько диапазонов (в нотации 'Лист'!A2:C) одним запросом, возвращает списки строк"""
+    spreadsheet = worksheets.spreadsheet()
+
+    def attempt():
+        with track_sheets_call("values_batch_get"):
+            return spreadsheet.values_batch_get(ranges)
+    response = governor.call(attempt)
+    return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+
+def column_ranges(record_type, fields=None):
+    """Диапазоны для чтения полей fields записи record_type: соседние колонки идут одним диапазоном.
+
+    Возвращает [(диапазон, [поля]), ...], например A2:C и I2:I для user_id, username, name, score.
+    """
+    fields = fields or record_type.field_names()
+    columns = sorted((record_type.COLUMNS[name], name) for name in fields)
+    groups = []
+    for letter, name in columns:
+        if groups and ord(letter) == ord(groups[-1][1]) + 1:
+            groups[-1][1] = letter
+            groups[-1][2].append(name)
+        else:
+            groups.append([letter, letter, [name]])
+    return [
+        (absolute_range_name(record_type.SHEET, f"{first}2:{last}"), names)
+        for first, last, names in groups
+    ]
+
+def _assemble_records(record_type, groups, value_lists):
+    """Склеивает ответы по диапазонам одной проекции в записи (по номеру строки)"""
+    length = max((len(values) for values in value_lists), default=0)
+    cells = [{} for _ in range(length)]
+    for (_, names), values in zip(groups, value_lists):
+        for index, line in enumerate(values):
+            for offset, name in enumerate(names):
+                cells[index][name] = line[offset] if offset < len(line) else ""
+    return [record_type.from_cells(item, row=index + 2) for index, item in enumerate(cells)]
+
+def batch_read(*queries):
+    """Читает проекции нескольких листов одним запросом.
+
+    queries — пары (тип записи, [поля] или None для всех полей); возвращает список
+    списков записей в том же порядке: batch_read((ApplicationRecord, ["user_id"]), (ActivityRecord, None)).
+    """
+    plans = [column_ranges(record_type, fields) for record_type, fields in queries]
+    value_lists = values_batch_get([range_name for groups in plans for range_name, _ in groups])
+    results = []
+    offset = 0
+    for (record_type, _), groups in zip(queries, plans):
+        results.append(_assemble_records(record_type, groups, value_lists[offset:offset + len(groups)]))
+        offset += len(groups)
+    return results
+
+def read_records(record_type, fields=None):
+    """Записи одного листа с прочитанными полями fields (остальные — по умолчанию)"""
+    return batch_read((record_type, fields))[0]
+
+# 🔎 Индексы «user_id → номер строки» (лист Активность правят вручную, поэтому строки сверяются)
+activity_index = RowIndex(ACTIVITY_SHEET_NAME, verify=True)
+state_index = RowIndex(STATE_SHEET_NAME)
+# 🔎 Индекс «заявка_id → номер строки» листа Заявки (колонка D), хранится в локальной базе
+submission_index = PersistentRowIndex("Заявки", verify=True, column=4)
+
+# 🗂 Кэш строк листа Заявки (без заголовка).
+# scored — пока sync_applications читает таблицу, сюда попадают заявка_id, которым бот
+# сам выставил баллы: при слиянии эти баллы важнее прочитанных
+_applications_cache = {"rows": None, "loaded_at": 0.0, "scored": None}
+_applications_lock = threading.RLock()
+# Полную загрузку листа выполняет один поток, остальные ждут её результата
+_applications_load_lock = threading.Lock()
+
+def _store_application_rows(rows):
+    """Кладёт свежепрочитанные строки листа Заявки в кэш"""
+    unsent = submission_journal.pending_rows()
+    if unsent:
+        # Заявки из журнала, которые ещё не дошли до листа, тоже должны быть видны
+        in_sheet = {row[3] for row in rows if len(row) > 3}
+        unsent = [row for row in unsent if row[3] not in in_sheet]
+    with _applications_lock:
+        _applications_cache["rows"] = rows
+        _applications_cache["loaded_at"] = time.monotonic()
+        submission_index.set_keys([row[3] if len(row) > 3 else "" for row in rows])
+        rows.extend(unsent)
+        leaderboard.rebuild(rows)
+        url_index.rebuild(rows)
+
+def _cached_application_rows():
+    """Строки из кэша, если он загружен и не старше APPLICATIONS_CACHE_TTL, иначе None"""
+    with _applications_lock:
+        rows = _applications_cache["rows"]
+        age = time.monotonic() - _applications_cache["loaded_at"]
+        if rows is not None and age < APPLICATIONS_CACHE_TTL:
+            return list(rows)
+    return None
+
+def get_application_rows():
+    """Возвращает строки листа Заявки из кэша, перечитывая лист по истечении TTL.
+
+    Пока работает sync_applications, кэш считается свежим и целиком не перечитывается.
+    """
+    rows = _cached_application_rows()
+    if rows is not None:
+        return rows
+
+    with _applications_load_lock:
+        # Пока ждали, лист мог загрузить другой поток
+        rows = _cached_application_rows()
+        if rows is not None:
+            return rows
+        sheet_app = get_worksheet("Заявки")
+        rows = sheet_app.get_all_values()[1:]
+        _store_application_rows(rows)
+        logger.info(f"Applications cache refreshed: {len(rows)} rows")
+        return list(rows)
+
+def invalidate_applications_cache():
+    """Сбрасывает кэш листа Заявки, следующее чтение пойдёт в таблицу"""
+    with _applications_lock:
+        _applications_cache["rows"] = None
+        _applications_cache["loaded_at"] = 0.0
+        _applications_cache["scored"] = None
+
+# 🔄 Синхронизация кэша Заявок с правками, сделанными прямо в таблице
+SYNC_FULL_RELOAD_SHARE = 0.2  # если изменилось больше этой доли строк, дешевле перечитать лист целиком
+
+def _payload_size(values):
+    """Примерный объём ответа API в байтах (по JSON-представлению значений)"""
+    return len(json.dumps(values, ensure_ascii=False).encode("utf-8"))
+
+def _row_key(row, position):
+    # Строки без заявка_id (добавленные вручную) сопоставляются по позиции
+    submission_id = row[3] if len(row) > 3 else ""
+    return submission_id or ("#", position)
+
+def _contiguous_ranges(positions):
+    """[3, 4, 5, 9] → [(3, 5), (9, 9)]"""
+    ranges = []
+    for position in positions:
+        if ranges and position == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], position)
+        else:
+            ranges.append((position, position))
+    return ranges
+
+def sync_applications():
+    """Сверяет кэш листа Заявки с таблицей и подтягивает только изменившееся.
+
+    За цикл читаются лишь колонки D (заявка_id) и I (баллы) одним batch_get. По ним видно
+    новые и удалённые строки и баллы, которые админ проставил в таблице вручную; целиком
+    скачиваются только новые строки. Правки в остальных колонках существующих строк
+    подхватит полная перезагрузка (по TTL, если синхронизация остановится).
+    Возвращает статистику цикла: строк, изменённых баллов, добавлено, удалено, байт.
+    """
+    started = time.perf_counter()
+    with _applications_lock:
+        cached = _applications_cache["rows"]
+        if cached is not None:
+            snapshot = list(cached)
+            _applications_cache["scored"] = set()
+    if cached is None:
+        # Первая загрузка — обычное полное чтение
+        rows = get_application_rows()
+        stats = {"rows": len(rows), "scores": 0, "added": len(rows), "removed": 0, "bytes": _payload_size(rows), "full": True}
+        _finish_sync(stats, started)
+        return stats
+
+    sheet_app = get_worksheet("Заявки")
+    # Журнал читаем до таблицы: заявка, записанная в лист во время чтения, останется в кэше
+    journaled = submission_journal.pending_ids()
+    ids, scores = sheet_app.batch_get(["D2:D", "I2:I"])
+    stats = {"rows": 0, "scores": 0, "added": 0, "removed": 0, "bytes": _payload_size(ids) + _payload_size(scores), "full": False}
+    ids = [line[0] if line else "" for line in ids]
+    scores = [line[0] if line else "" for line in scores]
+    # Пустые хвостовые ячейки API не возвращает
+    length = max(len(ids), len(scores))
+    ids += [""] * (length - len(ids))
+    scores += [""] * (length - len(scores))
+
+    # Сопоставляем строки таблицы со строками кэша по заявка_id
+    by_key = {}
+    for position, row in enumerate(snapshot):
+        by_key.setdefault(_row_key(row, position), []).append(row)
+    matched = []
+    missing = []
+    for position, submission_id in enumerate(ids):
+        candidates = by_key.get(submission_id or ("#", position))
+        if candidates:
+            matched.append(candidates.pop(0))
+        else:
+            matched.append(None)
+            missing.append(position)
+    # Заявки из журнала, ещё не записанные в лист, — не удаление
+    unsent = [row for rows in by_key.values() for row in rows if len(row) > 3 and row[3] in journaled]
+    removed = sum(len(rows) for rows in by_key.values()) - len(unsent)
+
+    if len(missing) + removed > max(1, len(snapshot)) * SYNC_FULL_RELOAD_SHARE and len(missing) + removed > 100:
+        logger.info(f"[INFO] Заявки: изменилось {len(missing)} + {removed} строк, перечитываем лист целиком")
+        invalidate_applications_cache()
+        rows = get_application_rows()
+        stats.update(rows=len(rows), added=len(missing), removed=removed, full=True)
+        stats["bytes"] += _payload_size(rows)
+        _finish_sync(stats, started)
+        return stats
+
+    # Новые строки (обычно хвост листа) дочитываем диапазонами A:J
+    if missing:
+        ranges = _contiguous_ranges(missing)
+        fetched = sheet_app.batch_get([f"A{first + 2}:J{last + 2}" for first, last in ranges])
+        for (first, last), values in zip(ranges, fetched):
+            stats["bytes"] += _payload_size(values)
+            values = fill_gaps(values, rows=last - first + 1, cols=APPLICATION_WIDTH)
+            for offset, position in enumerate(range(first, last + 1)):
+                matched[position] = values[offset]
+
+    with _applications_lock:
+        scored = _applications_cache["scored"] or set()
+        _applications_cache["scored"] = None
+        if _applications_cache["rows"] is not cached:
+            # Кэш перечитан целиком или сброшен, пока мы читали таблицу, — он свежее нашего чтения
+            logger.debug("Applications cache reloaded during sync, skipping cycle")
+            return None
+        # Сливаем прочитанное с тем, что бот сам добавил в кэш за время чтения
+        appended = {row[3]: row for row in cached[len(snapshot):] if len(row) > 3}
+        if appended:
+            for position in list(missing):
+                row = appended.pop(ids[position], None) if ids[position] else None
+                if row is not None:
+                    # Заявка успела дойти до листа — оставляем строку кэша, она уже в рейтинге
+                    matched[position] = row
+                    missing.remove(position)
+            unsent += appended.values()
+        new_rows = matched + unsent
+        missing_positions = set(missing)
+        score_changes = []
+        for position, row in enumerate(matched):
+            if position in missing_positions or (len(row) > 3 and row[3] in scored):
+                continue
+            if (row[8] if len(row) > 8 else "") != scores[position]:
+                score_changes.append((row, scores[position]))
+
+        if removed:
+            # Удалённые строки проще всего учесть полной пересборкой индексов в памяти
+            for row, score in score_changes:
+                _set_cell(row, 8, score)
+            _applications_cache["rows"] = new_rows
+            leaderboard.rebuild(new_rows)
+            url_index.rebuild(new_rows)
+            submission_index.set_keys([row[3] if len(row) > 3 else "" for row in matched])
+        else:
+            for row, score in score_changes:
+                if len(row) >= 9:
+                    leaderboard.apply_score_delta(row[0], parse_score(score) - parse_score(row[8]))
+                else:
+                    # Строка без колонки баллов в рейтинг не попадала (см. Leaderboard.rebuild)
+                    leaderboard.add_submission(row[0], row[1], row[2], parse_score(score))
+                _set_cell(row, 8, score)
+            # Те же условия, что в Leaderboard.rebuild и UrlIndex.rebuild
+            for position in missing:
+                row = new_rows[position]
+                if len(row) >= 9:
+                    leaderboard.add_submission(row[0], row[1], row[2], parse_score(row[8]))
+                if len(row) >= 5 and row[4].strip():
+                    url_index.add(row[4], row[3])
+                if row[3]:
+                    submission_index.add(row[3], position + 2)
+            _applications_cache["rows"] = new_rows
+        _applications_cache["loaded_at"] = time.monotonic()
+
+    stats.update(rows=len(new_rows), scores=len(score_changes), added=len(missing), removed=removed)
+    _finish_sync(stats, started)
+    if score_changes or missing or removed:
+        logger.info(
+            f"[INFO] Заявки синхронизированы: баллов изменено {len(score_changes)}, "
+            f"добавлено {len(missing)}, удалено {removed}, прочитано {stats['bytes']} байт"
+        )
+    return stats
+
+def _set_cell(row, index, value):
+    while len(row) <= index:
+        row.append("")
+    row[index] = value
+
+def _finish_sync(stats, started):
+    applications_sync_seconds.observe(time.perf_counter() - started)
+    applications_sync_bytes.inc(stats["bytes"])
+    applications_synced_at.set(time.time())
+
+def _cache_append_application(row):
+    """Добавляет новую заявку в кэш и рейтинг, если кэш уже загружен"""
+    with _applications_lock:
+        if _applications_cache["rows"] is not None:
+            _applications_cache["rows"].append(row)
+            leaderboard.add_submission(row[0], row[1], row[2], parse_score(row[8]))
+        # Индекс ссылок нужен и до первой загрузки кэша, чтобы повтор не проскочил
+        url_index.add(row[4], row[3])
+
+def _cache_set_score(submission_id, score):
+    """Записывает баллы заявки в кэш и сдвигает сумму участника в рейтинге на разницу"""
+    with _applications_lock:
+        if _applications_cache["scored"] is not None:
+            _applications_cache["scored"].add(submission_id)
+        for row in _applications_cache["rows"] or []:
+            if len(row) >= 4 and row[3] == submission_id:
+                while len(row) < 9:
+                    row.append("")
+                old_score = parse_score(row[8])
+                row[8] = str(score)
+                leaderboard.apply_score_delta(row[0], score - old_score)
+                return
+
+# ✍️ Запись нескольких ячеек строки одним запросом
+def update_row_cells(worksheet, row_idx, values):
+    """Записывает значения {номер_колонки: значение} в строку row_idx одним batch_update.
+
+    Соседние колонки объединяются в один диапазон, так что B..E уходят как B5:E5.
+    """
+    ranges = []
+    chunk_start = None
+    chunk = []
+    for col in sorted(values):
+        if chunk and col != chunk_start + len(chunk):
+            ranges.append((chunk_start, chunk))
+            chunk = []
+        if not chunk:
+            chunk_start = col
+        chunk.append(values[col])
+    if chunk:
+        ranges.append((chunk_start, chunk))
+
+    data = [
+        {
+            "range": f"{rowcol_to_a1(row_idx, start)}:{rowcol_to_a1(row_idx, start + len(cells) - 1)}",
+            "values": [cells]
+        }
+        for start, cells in ranges
+    ]
+    if data:
+        worksheet.batch_update(data, value_input_option="USER_ENTERED")
+
+def upsert_row(worksheet, index, key, values, new_row=None):
+    """Обновляет строку с ключом key в колонке A или добавляет new_row, если строки нет.
+
+    Строка ищется по индексу index (RowIndex), без чтения всего листа.
+    values — словарь {номер_колонки: значение} для существующей строки.
+    Если new_row не передан, отсутствующая строка не создаётся.
+    Возвращает номер строки или None, если строка не найдена и не добавлена.
+    """
+    row_idx = index.locate(worksheet, key)
+    if row_idx is not None:
+        update_row_cells(worksheet, row_idx, values)
+        return row_idx
+    if new_row is None:
+        return None
+    row_idx = appended_row_number(worksheet.append_row(new_row))
+    index.add(key, row_idx)
+    return row_idx
 
 def add_or_update_user(user):
     """Добавляет или обновляет информацию о пользователе в таблице Активность"""
-    if sheet is None:
-        logger.warning("[WARNING] Лист 'Активность' не найден.")
+    try:
+        sheet = get_activity_sheet()
+    except Exception as e:
+        logger.warning(f"[WARNING] Лист 'Активность' не найден: {e}")
         return
     try:
         user_id = str(user.id)
-        all_users = sheet.get_all_values()
-        user_ids = [row[0] for row in all_users[1:]]
-        
         current_date = datetime.datetime.now().strftime("%d.%m.%Y")
-        
-        if user_id in user_ids:
-            idx = user_ids.index(user_id) + 2
-            sheet.update_cell(idx, 2, user.username or '')
-            sheet.update_cell(idx, 3, user.full_name)
-            sheet.update_cell(idx, 4, current_date)
-            sheet.update_cell(idx, 5, 'вход')
-            logger.info(f"Updated user {user_id} in Activity sheet")
-        else:
-            new_row = [
-                str(user.id),
-                user.username or '',
-                user.full_name,
-                current_date,
-                'вход',
-                '',
-                '0'
-            ]
-            sheet.append_row(new_row)
-            logger.info(f"Added new user {user_id} to Activity sheet")
+
+        new_row = [
+            user_id,
+            user.username or '',
+            user.full_name,
+            current_date,
+            'вход',
+            '',
+            '0'
+        ]
+        upsert_row(sheet, activity_index, user_id, {
+            2: user.username or '',
+            3: user.full_name,
+            4: current_date,
+            5: 'вход'
+        }, new_row)
+        leaderboard.set_fallback_username(user_id, user.username)
+        logger.info(f"Saved user {user_id} in Activity sheet")
     except Exception as e:
         logger.error(f"[ERROR] Пользователь не добавлен: {e}")
 
+# 🧮 Суммы баллов участников в листе Активность (колонка G).
+# Сумма берётся из рейтинга в памяти, который сдвигается на разницу баллов при каждой оценке
+# (_cache_set_score), поэтому повторная оценка заявки исправляет сумму, а не добавляет к ней.
+# Изменённые суммы копятся и уходят в таблицу одним batch_update (flush_activity_totals),
+# а reconcile_activity_totals периодически пересчитывает все суммы с нуля.
+_activity_dirty = set()
+_activity_dirty_lock = threading.Lock()
+# Точечная запись и полная сверка не идут одновременно, иначе сверка могла бы затереть свежую сумму
+_activity_write_lock = threading.Lock()
+
 def update_user_score_in_activity(user_id):
-    """Обновляет количество баллов пользователя в таблице Активность"""
-    if sheet is None:
-        return
+    """Отмечает, что сумму участника в листе Активность нужно обновить"""
+    update_users_score_in_activity([user_id])
+
+def update_users_score_in_activity(user_ids):
+    """Отмечает суммы нескольких участников для записи ближайшим flush_activity_totals"""
+    with _activity_dirty_lock:
+        _activity_dirty.update(str(user_id) for user_id in user_ids)
+
+def flush_activity_totals():
+    """Записывает накопленные суммы в лист Активность одним batch_update.
+
+    Несколько оценок одного участника между записями дают одну запись с последней суммой.
+    Возвращает число обновлённых строк.
+    """
+    with _activity_write_lock:
+        return _flush_activity_totals()
+
+def _flush_activity_totals():
+    with _activity_dirty_lock:
+        user_ids = list(_activity_dirty)
+        _activity_dirty.clear()
+    if not user_ids:
+        return 0
     try:
-        user_id = str(user_id)
-        all_users = sheet.get_all_values()
-        user_ids = [row[0] for row in all_users[1:]]
-        if user_id in user_ids:
-            idx = user_ids.index(user_id) + 2
-            _, total = get_user_scores(user_id)
-            sheet.update_cell(idx, 7, str(total))
-            logger.info(f"Updated score for user {user_id}: {total}")
+        # Рейтинг живёт вместе с кэшем Заявок: если кэш не загружен, загружаем
+        get_application_rows()
+        sheet = get_activity_sheet()
+        rows = activity_index.locate_many(sheet, user_ids)
+        data = [
+            {"range": f"G{row_idx}", "values": [[str(leaderboard.total(user_id))]]}
+            for user_id, row_idx in rows.items()
+            if row_idx is not None
+        ]
+        if data:
+            sheet.batch_update(data, value_input_option="USER_ENTERED")
+            logger.info(f"Updated scores for {len(data)} users in Activity sheet")
+        return len(data)
     except Exception as e:
-        logger.error(f"[ERROR] update_user_score_in_activity: {e}")
+        logger.error(f"[ERROR] flush_activity_totals: {e}")
+        # Запишем в следующий раз
+        with _activity_dirty_lock:
+            _activity_dirty.update(user_ids)
+        return 0
+
+def reconcile_activity_totals():
+    """Пересчитывает суммы всех участников за один проход по Заявкам и исправляет расхождения.
 
-def export_rating_to_sheet():
-    """Экспортирует рейтинг в отдельный лист"""
+    Колонки A и G листа Активность читаются одним запросом; если хоть одна сумма
+    разошлась, вся колонка G записывается одним диапазоном.
+    Возвращает число исправленных строк.
+    """
+    with _activity_write_lock:
+        return _reconcile_activity_totals()
+
+def _reconcile_activity_totals():
+    # Полная запись колонки заменяет накопленные точечные; оценки, выставленные
+    # после этого момента, снова попадут в очередь и запишутся после сверки
+    with _activity_dirty_lock:
+        cleared = set(_activity_dirty)
+        _activity_dirty.clear()
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Рейтинг")
-        top_users = get_top_users(limit=100)
+        rows = get_application_rows()
+        totals = {}
+        for row in rows:
+            if row:
+                totals[row[0]] = totals.get(row[0], 0) + (parse_score(row[8]) if len(row) > 8 else 0)
+        if any(leaderboard.total(user_id) != total for user_id, total in totals.items()):
+            logger.warning("[WARNING] Суммы в рейтинге разошлись с листом Заявки, пересобираем рейтинг")
+            leaderboard.rebuild(rows)
 
-        sheet_app.clear()
-        sheet_app.append_row(["user_id", "имя", "username", "telegram_link", "сколько_баллов"])
+        records = read_records(ActivityRecord, ["user_id", "total"])
+        column = []
+        drift = 0
+        for record in records:
+            if not record.user_id:
+                column.append([str(record.total) if record.total else ""])
+                continue
+            total = totals.get(record.user_id, 0)
+            if record.total != total:
+                drift += 1
+            column.append([str(total)])
+        if drift:
+            get_activity_sheet().update(
+                range_name=f"G2:G{len(column) + 1}", values=column, value_input_option="USER_ENTERED"
+            )
+            logger.warning(f"[WARNING] Исправлены суммы баллов в листе Активность: {drift} строк")
+        else:
+            logger.info("[INFO] Суммы баллов в листе Активность сходятся")
+        return drift
+    except Exception as e:
+        logger.error(f"[ERROR] reconcile_activity_totals: {e}")
+        with _activity_dirty_lock:
+            _activity_dirty.update(cleared)
+        return 0
+
+EXPORT_CHUNK_ROWS = 5000  # строк в одном запросе при выгрузке рейтинга
+
+def export_rating_to_sheet(limit=100, progress=None):
+    """Экспортирует рейтинг в отдельный лист (limit=None — всех участников).
 
+    Таблица пишется диапазонами по EXPORT_CHUNK_ROWS строк, а не построчно;
+    progress(записано_строк, всего_строк) вызывается после каждого диапазона.
+    """
+    try:
+        sheet_app = get_worksheet("Рейтинг")
+        top_users = get_top_users(limit=limit)
+
+        table = [["user_id", "имя", "username", "telegram_link", "сколько_баллов"]]
         for user in top_users:
             user_id = user.get("user_id", "")
-            name = user.get("name", "")
             username = user.get("username", "").strip()
             if username:
                 link = f"https://t.me/{username.lstrip('@')}"
             else:
                 link = f"tg://user?id={user_id}"
-            total = user.get("total", 0)
-
-            sheet_app.append_row([
+            table.append([
                 user_id,
-                name,
+                user.get("name", ""),
                 username,
                 link,
-                total
+                user.get("total", 0)
             ])
-            logger.info(f"[INFO] Записан пользователь {user_id} с username {username} и ссылкой {link}")
-        
+
+        if sheet_app.row_count < len(table):
+            sheet_app.resize(rows=len(table))
+
+        # Старый рейтинг перезаписывается на месте: пока идёт выгрузка, лист не бывает пустым
+        for start in range(0, len(table), EXPORT_CHUNK_ROWS):
+            chunk = table[start:start + EXPORT_CHUNK_ROWS]
+            sheet_app.update(range_name=f"A{start + 1}", values=chunk, value_input_option="RAW")
+            if progress:
+                progress(start + len(chunk), len(table))
+
+        # Очищаем только хвост, оставшийся от прошлого, более длинного рейтинга
+        if sheet_app.row_count > len(table):
+            sheet_app.batch_clear([f"A{len(table) + 1}:E{sheet_app.row_count}"])
+
+        logger.info(f"[INFO] Рейтинг выгружен: {len(top_users)} участников")
         return True
     except Exception as e:
         logger.error(f"[ERROR] export_rating_to_sheet: {e}")
         return False
 
 def submit_application(user, date_text, location, monument_name, link):
-    """Сохраняет заявку пользователя в таблицу Заявки"""
-    logger.info(f"[DEBUG] submit_application вызвана с параметрами: date_text={date_text}, location={location}, monument_name={monument_name}, link={link}")
-    
-    try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
-    except Exception as e:
-        logger.error(f"[ERROR] Лист 'Заявки' не найден: {e}")
-        return None
+    """Сохраняет заявку пользователя в журнал; в лист Заявки её запишет flush_submissions.
+
+    Таблица здесь не нужна: заявка сразу видна в кэше (рейтинг, проверка повторов),
+    а если Google Таблицы недоступны, она дождётся записи в локальной базе.
+    """
+    logger.debug(f"submit_application вызвана с параметрами: date_text={date_text}, location={location}, monument_name={monument_name}, link={link}")
 
     submission_id = f"{user.id}_{int(time.time())}"
     submitted_at = datetime.datetime.now().strftime("%d.%m.%Y %H:%M")
@@ -174,22 +729,85 @@ def submit_application(user, date_text, location, monument_name, link):
     ]
 
     try:
-        sheet_app.append_row(new_row)
+        submission_journal.append(submission_id, new_row)
+        _cache_append_application(new_row)
         logger.info(f"Application submitted successfully: {submission_id}, date: {date_text}, location: {location}, monument: {monument_name}")
         return submission_id
     except Exception as e:
         logger.error(f"[ERROR] Не удалось добавить заявку: {e}")
         return None
 
+# Запись журнала идёт из фоновой задачи, перед выставлением баллов и при остановке бота:
+# две одновременные записи одной пачки добавили бы строки дважды
+_submissions_flush_lock = threading.Lock()
+
+def flush_submissions(limit=SUBMISSION_FLUSH_BATCH):
+    """Переносит заявки из журнала в лист Заявки одним append_rows.
+
+    Перед отправкой у заявок увеличивается счётчик попыток. Заявки с прошлыми попытками
+    (запись не удалась или бот упал, не успев отметить её) сначала ищутся в колонке D:
+    если прошлый append_rows на самом деле дошёл до таблицы, строка не добавляется второй раз.
+    Возвращает число записанных заявок.
+    """
+    with _submissions_flush_lock:
+        return _flush_submissions(limit)
+
+def _flush_submissions(limit):
+    batch = submission_journal.pending(limit)
+    if not batch:
+        return 0
+    submission_ids = [submission_id for submission_id, _, _ in batch]
+    try:
+        sheet_app = get_worksheet("Заявки")
+        already = set()
+        if any(attempts for _, _, attempts in batch):
+            submission_index.rebuild(sheet_app)
+            already = {
+                submission_id for submission_id in submission_ids
+                if submission_index.lookup(sheet_app, submission_id) is not None
+            }
+        new = [(submission_id, row) for submission_id, row, _ in batch if submission_id not in already]
+        if new:
+            submission_journal.mark_in_flight([submission_id for submission_id, _ in new])
+            response = sheet_app.append_rows([row for _, row in new])
+            first_row = appended_row_number(response)
+            for offset, (submission_id, _) in enumerate(new):
+                submission_index.add(submission_id, first_row + offset if first_row else None)
+        submission_journal.mark_flushed(submission_ids)
+        if already:
+            logger.info(f"[INFO] Заявки уже были в таблице, повторно не добавлены: {len(already)}")
+        logger.info(f"[INFO] Заявки из журнала записаны в таблицу: {len(new)}")
+        return len(new)
+    except Exception as e:
+        logger.error(f"[ERROR] Не удалось записать заявки из журнала: {e}")
+        submission_journal.mark_failed(submission_ids, e)
+        return 0
+    finally:
+        submission_journal_pending.set(submission_journal.pending_count())
+
+def _flush_if_journaled(submission_ids):
+    """Перед записью баллов дописывает в лист заявки, которые ещё лежат в журнале"""
+    if any(submission_journal.is_pending(submission_id) for submission_id in submission_ids):
+        flush_submissions()
+
+def find_submitted_link(link):
+    """Возвращает заявка_id, если такая ссылка (с точностью до нормализации) уже подавалась"""
+    if not url_index.loaded:
+        try:
+            get_application_rows()
+        except Exception as e:
+            logger.error(f"[ERROR] find_submitted_link: {e}")
+            return None
+    return url_index.lookup(link)
+
 def get_user_scores(user_id: str):
     """Получает список заявок пользователя и общий счет"""
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
+        all_rows = get_application_rows()
     except Exception as e:
         logger.error(f"[ERROR] Cannot access Applications sheet: {e}")
         return [], 0
 
-    all_rows = sheet_app.get_all_values()[1:]
     user_rows = [row for row in all_rows if row[0] == user_id]
 
     results = []
@@ -212,12 +830,11 @@ def get_user_scores(user_id: str):
 def get_inactive_users(days=21):
     """Получает список неактивных пользователей"""
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
+        all_rows = get_application_rows()
     except Exception as e:
         logger.error(f"[ERROR] Лист 'Заявки' не найден: {e}")
         return []
 
-    all_rows = sheet_app.get_all_values()[1:]
     user_data = {}
 
     for row in all_rows:
@@ -266,8 +883,9 @@ async def send_reminders_to_inactive(bot):
         logger.info("[INFO] Конкурс завершен (после 24.11.2025), напоминания больше не отправляются")
         return
 
-    # Получаем неактивных пользователей
-    inactive_users = get_inactive_users(days=21)
+    # Получаем неактивных пользователей (чтение таблицы — в пуле потоков, чтобы не блокировать бота)
+    from services.sheets_async import run_in_sheets_pool
+    inactive_users = await run_in_sheets_pool(get_inactive_users, days=21)
 
     # Отправляем напоминания только тем, у кого количество дней с момента последней заявки
     # кратно 21 (21, 42, 63, 84, ...)
@@ -285,46 +903,94 @@ async def send_reminders_to_inactive(bot):
                     "Вернись в конкурс 'Эстафета Победы' и заработай баллы! Подай заявку через /start.",
                     reply_markup=main_menu_markup(user_id=user_id)
                 )
-                logger.info(f"[INFO] Напоминание отправлено {user_id} (неактивен {days_since} дней)")
+                bulk_logger.info(f"[INFO] Напоминание отправлено {user_id} (неактивен {days_since} дней)")
             except Exception as e:
                 logger.error(f"[ERROR] Не удалось отправить напоминание {user_id}: {e}")
 
+def _application_user_ids():
+    """user_id всех заявок: из кэша, а если он не загружен — чтением одной колонки A"""
+    rows = _cached_application_rows()
+    if rows is not None:
+        return [row[0] for row in rows if row]
+    return [record.user_id for record in read_records(ApplicationRecord, ["user_id"])]
+
 def get_submission_stats():
     """Получает статистику по заявкам"""
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
-        rows = sheet_app.get_all_values()[1:]
+        user_ids = _application_user_ids()
     except Exception as e:
         logger.error(f"[ERROR] Cannot get submission stats: {e}")
         return 0, 0
-
-    user_ids = set()
-    for row in rows:
-        if len(row) >= 1:
-            user_ids.add(row[0])
-    return len(rows), len(user_ids)
+    return len(user_ids), len(set(user_ids))
 
 def set_score_and_notify_user(submission_id: str, score: int):
     """Устанавливает баллы для заявки и готовит данные для уведомления"""
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
-        rows = sheet_app.get_all_values()
-        headers = rows[0]
-        data = rows[1:]
-
-        for idx, row in enumerate(data, start=2):
-            if len(row) >= 4 and row[3] == submission_id:
-                user_id = row[0]
-                sheet_app.update_cell(idx, 9, str(score))
-                logger.info(f"[INFO] Баллы {score} записаны для submission_id {submission_id}")
-                return True
-        
-        logger.warning(f"[WARNING] Заявка с submission_id {submission_id} не найдена")
-        return False
+        _flush_if_journaled([submission_id])
+        sheet_app = get_worksheet("Заявки")
+        # Строка находится по индексу заявка_id и сверяется одной ячейкой, без чтения всего листа
+        idx = submission_index.locate(sheet_app, submission_id)
+        if idx is None:
+            logger.warning(f"[WARNING] Заявка с submission_id {submission_id} не найдена")
+            return False
+        sheet_app.update_cell(idx, 9, str(score))
+        _cache_set_score(submission_id, score)
+        logger.info(f"[INFO] Баллы {score} записаны для submission_id {submission_id}")
+        return True
     except Exception as e:
         logger.error(f"[ERROR] Ошибка при выставлении баллов: {e}")
         return False
 
+def set_scores_batch(scores):
+    """Записывает баллы нескольких заявок {заявка_id: баллы} одним batch_update.
+
+    Строки находятся по индексу заявка_id и сверяются одним batch_get, суммы участников
+    ставятся в очередь записи в лист Активность (flush_activity_totals).
+    Возвращает {заявка_id: user_id} для записанных заявок или None, если таблица недоступна.
+    """
+    if not scores:
+        return {}
+    try:
+        _flush_if_journaled(scores)
+        sheet_app = get_worksheet("Заявки")
+        rows = submission_index.locate_many(sheet_app, list(scores))
+        found = {submission_id: row_idx for submission_id, row_idx in rows.items() if row_idx is not None}
+        for submission_id in scores.keys() - found.keys():
+            logger.warning(f"[WARNING] Заявка с submission_id {submission_id} не найдена")
+        if not found:
+            return {}
+
+        sheet_app.batch_update([
+            {"range": f"I{row_idx}", "values": [[str(scores[submission_id])]]}
+            for submission_id, row_idx in found.items()
+        ], value_input_option="USER_ENTERED")
+        written = {}
+        for submission_id in found:
+            _cache_set_score(submission_id, scores[submission_id])
+            written[submission_id] = submission_id.split("_")[0]
+        logger.info(f"[INFO] Баллы записаны одним запросом для {len(written)} заявок")
+    except Exception as e:
+        logger.error(f"[ERROR] Ошибка при пакетном выставлении баллов: {e}")
+        return None
+
+    update_users_score_in_activity(set(written.values()))
+    return written
+
+def get_pending_submissions(limit=10, exclude=()):
+    """Заявки без баллов (сначала старые) в виде ApplicationRecord"""
+    try:
+        rows = get_application_rows()
+    except Exception as e:
+        logger.error(f"[ERROR] get_pending_submissions: {e}")
+        return []
+    pending = []
+    for position, row in enumerate(rows):
+        if len(row) > 4 and row[3] and not (row[8] if len(row) > 8 else "").strip() and row[3] not in exclude:
+            pending.append(ApplicationRecord.from_row(row, row=position + 2))
+            if len(pending) >= limit:
+                break
+    return pending
+
 async def send_score_notification(user_id: int, score: int, bot):
     """Отправляет уведомление пользователю о начислении баллов"""
     try:
@@ -342,154 +1008,229 @@ async def send_score_notification(user_id: int, score: int, bot):
 def get_all_user_ids():
     """Получает список всех user_id пользователей"""
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
-        rows = sheet_app.get_all_values()[1:]
-        user_ids = set()
-        for row in rows:
-            if len(row) >= 1 and row[0].isdigit():
-                user_ids.add(int(row[0]))
-        return list(user_ids)
+        return list({int(user_id) for user_id in _application_user_ids() if user_id.isdigit()})
     except Exception as e:
         logger.error(f"[ERROR] get_all_user_ids: {e}")
         return []
 
+_activity_usernames_loaded = False
+USERNAME_FIELDS = ["user_id", "username"]
+
+def _set_activity_usernames(records):
+    global _activity_usernames_loaded
+    leaderboard.set_fallback_usernames({record.user_id: record.username.strip() for record in records})
+    _activity_usernames_loaded = True
+
+def _load_activity_usernames():
+    """Один раз подгружает username из листа Активность для участников без username в Заявках"""
+    if _activity_usernames_loaded:
+        return
+    try:
+        _set_activity_usernames(read_records(ActivityRecord, USERNAME_FIELDS))
+    except Exception as e:
+        logger.error(f"[ERROR] get_top_users: лист 'Активность' недоступен: {e}")
+
+def _load_applications_and_usernames():
+    """Заявки целиком и колонки A:B Активности одним запросом (холодный старт рейтинга)"""
+    with _applications_load_lock:
+        if _cached_application_rows() is not None:
+            return
+        groups = column_ranges(ActivityRecord, USERNAME_FIELDS)
+        values = values_batch_get([absolute_range_name(ApplicationRecord.SHEET, "A2:J")] + [name for name, _ in groups])
+        rows = fill_gaps(values[0], cols=APPLICATION_WIDTH) if values[0] else []
+        _store_application_rows(rows)
+        _set_activity_usernames(_assemble_records(ActivityRecord, groups, values[1:]))
+        logger.info(f"Applications cache refreshed: {len(rows)} rows")
+
 def get_top_users(limit=10):
-    """Получает список топ пользователей по баллам"""
+    """Получает список топ пользователей по баллам (limit=None — все участники)"""
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
-        rows = sheet_app.get_all_values()[1:]
+        if _cached_application_rows() is None and not _activity_usernames_loaded:
+            _load_applications_and_usernames()
+        # Обновляет кэш Заявки (и вместе с ним рейтинг), если истёк TTL
+        get_application_rows()
     except Exception as e:
         logger.error(f"[ERROR] get_top_users: {e}")
         return []
 
-    activity_usernames = {}
-    if sheet:
-        activity_rows = sheet.get_all_values()[1:]
-        for row in activity_rows:
-            if len(row) >= 2:
-                user_id = row[0]
-                username = row[1].strip()
-                activity_usernames[user_id] = username
+    _load_activity_usernames()
+    return leaderboard.top(limit)
 
-    stats = {}
+def check_sheet_structure():
+    """Выводит структуру листа 'Заявки' для отладки"""
+    try:
+        sheet_app = get_worksheet("Заявки")
+        headers = sheet_app.row_values(1)
+        logger.debug("Структура листа 'Заявки':")
+        for i, header in enumerate(headers):
+            logger.debug(f"Колонка {i+1} (буква {chr(65+i)}): '{header}'")
+    except Exception as e:
+        logger.error(f"[ERROR] Ошибка при проверке структуры: {e}")
 
-    for row in rows:
-        if len(row) < 9:
-            continue
+# 🧭 Хранилище состояний пользователей
+class SheetStateStore(StateStore):
+    """Хранит состояния прямо в листе UserState (каждое обращение — запрос к таблице)"""
 
-        user_id = row[0]
-        username = row[1].strip()
-        name = row[2]
-        score_str = row[8]
+    def save(self, user_id, state, data=None, last_message_id=None):
+        state_sheet = get_state_sheet()
+        user_id = str(user_id)
+        data_str = json.dumps(data) if data else ""
 
-        if not username and user_id in activity_usernames:
-            username = activity_usernames[user_id]
+        values = {2: state, 3: data_str}
+        if last_message_id:
+            values[4] = str(last_message_id)
+        new_row = [
+            user_id,
+            state,
+            data_str,
+            str(last_message_id) if last_message_id else ""
+        ]
+        # Обновляем состояние одним запросом или добавляем новую строку
+        upsert_row(state_sheet, state_index, user_id, values, new_row)
 
-        if not username:
-            logger.warning(f"[WARNING] Username для user_id {user_id} пустой после проверки Заявки и Активности")
+    def get(self, user_id):
+        state_sheet = get_state_sheet()
+        user_id = str(user_id)
+        row_idx = state_index.lookup(state_sheet, user_id)
+        if row_idx is None:
+            return DEFAULT_STATE
+        row = state_sheet.row_values(row_idx)
+        if not row or row[0] != user_id:
+            # Строка сместилась — перестраиваем индекс и читаем ещё раз
+            state_index.rebuild(state_sheet)
+            row_idx = state_index.lookup(state_sheet, user_id)
+            if row_idx is None:
+                return DEFAULT_STATE
+            row = state_sheet.row_values(row_idx)
+        return _row_to_state(row)
 
-        logger.info(f"[INFO] Для user_id {user_id}: username из Заявки = {row[1]}, из Активности = {activity_usernames.get(user_id, 'нет')}")
+    def clear(self, user_id):
+        state_sheet = get_state_sheet()
+        upsert_row(state_sheet, state_index, str(user_id), {2: "main_menu", 3: "", 4: ""})
 
-        try:
-            score = int(score_str) if score_str.strip().isdigit() else 0
-        except:
-            score = 0
+    def all(self):
+        state_sheet = get_state_sheet()
+        return [
+            (row[0], *_row_to_state(row))
+            for row in state_sheet.get_all_values()[1:]
+            if row and row[0]
+        ]
 
-        if user_id not in stats:
-            stats[user_id] = {
-                "user_id": user_id,
-                "username": username,
-                "name": name,
-                "count": 0,
-                "total": 0
-            }
+def _row_to_state(row):
+    """Разбирает строку листа UserState в (state, data, last_message_id)"""
+    state = row[1] if len(row) > 1 and row[1] else "main_menu"
+    data = json.loads(row[2]) if len(row) > 2 and row[2] else None
+    last_message_id = int(row[3]) if len(row) > 3 and row[3].isdigit() else None
+    return state, data, last_message_id
 
-        stats[user_id]["count"] += 1
-        stats[user_id]["total"] += score
+if STATE_BACKEND == "sheets":
+    user_state_store = SheetStateStore()
+else:
+    user_state_store = SQLiteStateStore()
+logger.info(f"User state backend: {type(user_state_store).__name__}")
 
-    sorted_users = sorted(stats.values(), key=lambda u: u["total"], reverse=True)
-    return sorted_users[:limit]
+def import_user_states():
+    """Однократно переносит состояния из листа UserState в пустое локальное хранилище.
 
-def check_sheet_structure():
-    """Выводит структуру листа 'Заявки' для отладки"""
+    Нужна при первом запуске с SQLite-бэкендом, чтобы пользователи, застрявшие
+    на середине заявки, не потеряли прогресс. Возвращает число перенесённых записей.
+    """
+    if not isinstance(user_state_store, SQLiteStateStore) or not user_state_store.is_empty():
+        return 0
     try:
-        sheet_app = client.open_by_key(SPREADSHEET_ID).worksheet("Заявки")
-        headers = sheet_app.row_values(1)
-        logger.info("[DEBUG] Структура листа 'Заявки':")
-        for i, header in enumerate(headers):
-            logger.info(f"[DEBUG] Колонка {i+1} (буква {chr(65+i)}): '{header}'")
+        values = get_state_sheet().get_all_values()[1:]
+        rows = [(row + [""] * 4)[:4] for row in values if row and row[0]]
+        if rows:
+            user_state_store.import_rows(rows)
+            # Строки листа уже известны — заодно заполняем индекс для зеркалирования
+            state_index.set_keys([row[0] if row else "" for row in values])
+        logger.info(f"Imported {len(rows)} user states from UserState sheet")
+        return len(rows)
     except Exception as e:
-        logger.error(f"[ERROR] Ошибка при проверке структуры: {e}")
+        logger.error(f"[ERROR] Не удалось импортировать состояния из листа UserState: {e}")
+        return 0
+
+def mirror_user_states():
+    """Переносит изменённые состояния из локального хранилища в лист UserState.
+
+    Существующие строки обновляются одним batch_update, новые добавляются одним append_rows.
+    """
+    if not isinstance(user_state_store, SQLiteStateStore):
+        return 0
+    try:
+        rows, snapshot_at = user_state_store.pending_mirror()
+        if not rows:
+            return 0
+
+        state_sheet = get_state_sheet()
+        updates = []
+        new_rows = []
+        for row in rows:
+            row_idx = state_index.lookup(state_sheet, row[0])
+            if row_idx is None:
+                new_rows.append(row)
+            else:
+                updates.append({"range": f"A{row_idx}:D{row_idx}", "values": [row]})
+
+        if updates:
+            state_sheet.batch_update(updates, value_input_option="USER_ENTERED")
+        if new_rows:
+            first_row = appended_row_number(state_sheet.append_rows(new_rows, value_input_option="USER_ENTERED"))
+            for offset, row in enumerate(new_rows):
+                state_index.add(row[0], first_row + offset if first_row else None)
+
+        user_state_store.mark_mirrored([row[0] for row in rows], snapshot_at)
+        logger.info(f"Mirrored {len(rows)} user states to UserState sheet")
+        return len(rows)
+    except Exception as e:
+        logger.error(f"[ERROR] Не удалось перенести состояния в лист UserState: {e}")
+        return 0
+
+# Подписчики на изменения состояний (например, планировщик напоминаний)
+_state_listeners = []
+
+def add_state_listener(callback):
+    """Регистрирует callback(user_id, state, data), вызываемый после сохранения или очистки состояния"""
+    _state_listeners.append(callback)
+
+def _notify_state_listeners(user_id, state, data):
+    for callback in _state_listeners:
+        try:
+            callback(user_id, state, data)
+        except Exception as e:
+            logger.error(f"[ERROR] Обработчик изменения состояния упал для user_id {user_id}: {e}")
 
 # Функции для работы с состоянием пользователей
 def save_user_state(user_id, state, data=None, last_message_id=None):
-    """Сохраняет состояние пользователя в Google Таблицах."""
-    if state_sheet is None:
-        logger.error("[ERROR] UserState sheet is not available")
-        return
-        
+    """Сохраняет состояние пользователя в хранилище состояний."""
     try:
-        all_rows = state_sheet.get_all_values()
-        user_ids = [row[0] for row in all_rows[1:]]
-        user_id = str(user_id)
-
-        # Если пользователь уже есть, обновляем его состояние
-        if user_id in user_ids:
-            idx = user_ids.index(user_id) + 2
-            state_sheet.update_cell(idx, 2, state)
-            state_sheet.update_cell(idx, 3, json.dumps(data) if data else "")
-            if last_message_id:
-                state_sheet.update_cell(idx, 4, str(last_message_id))
-            logger.info(f"Updated state for user {user_id}: {state}")
-        else:
-            # Если пользователя нет, добавляем новую строку
-            new_row = [
-                user_id,
-                state,
-                json.dumps(data) if data else "",
-                str(last_message_id) if last_message_id else ""
-            ]
-            state_sheet.append_row(new_row)
-            logger.info(f"Added new state for user {user_id}: {state}")
+        user_state_store.save(user_id, state, data, last_message_id)
+        logger.debug(f"Saved state for user {user_id}: {state}")
+        _notify_state_listeners(user_id, state, data)
     except Exception as e:
         logger.error(f"[ERROR] Не удалось сохранить состояние для user_id {user_id}: {e}")
 
 def get_user_state(user_id):
-    """Получает состояние пользователя из Google Таблиц."""
-    if state_sheet is None:
-        logger.error("[ERROR] UserState sheet is not available")
-        return "main_menu", None, None
-        
+    """Получает состояние пользователя из хранилища состояний."""
     try:
-        all_rows = state_sheet.get_all_values()
-        user_id = str(user_id)
-        for row in all_rows[1:]:
-            if row[0] == user_id:
-                state = row[1] if len(row) > 1 else "main_menu"
-                data = json.loads(row[2]) if len(row) > 2 and row[2] else None
-                last_message_id = int(row[3]) if len(row) > 3 and row[3].isdigit() else None
-                return state, data, last_message_id
-        return "main_menu", None, None  # По умолчанию
+        return user_state_store.get(user_id)
     except Exception as e:
         logger.error(f"[ERROR] Не удалось получить состояние для user_id {user_id}: {e}")
-        return "main_menu", None, None
+        return DEFAULT_STATE
 
 def clear_user_state(user_id):
-    """Очищает состояние пользователя в Google Таблицах."""
-    if state_sheet is None:
-        logger.error("[ERROR] UserState sheet is not available")
-        return
-        
+    """Очищает состояние пользователя в хранилище состояний."""
     try:
-        all_rows = state_sheet.get_all_values()
-        user_ids = [row[0] for row in all_rows[1:]]
-        user_id = str(user_id)
-
-        if user_id in user_ids:
-            idx = user_ids.index(user_id) + 2
-            state_sheet.update_cell(idx, 2, "main_menu")
-            state_sheet.update_cell(idx, 3, "")
-            state_sheet.update_cell(idx, 4, "")
-            logger.info(f"Cleared state for user {user_id}")
+        user_state_store.clear(user_id)
+        logger.debug(f"Cleared state for user {user_id}")
+        _notify_state_listeners(user_id, "main_menu", None)
     except Exception as e:
         logger.error(f"[ERROR] Не удалось очистить состояние для user_id {user_id}: {e}")
+
+def get_all_user_states():
+    """Возвращает состояния всех пользователей: [(user_id, state, data, last_message_id), ...]"""
+    try:
+        return user_state_store.all()
+    except Exception as e:
+        logger.error(f"[ERROR] Не удалось получить состояния пользователей: {e}")
+        return []
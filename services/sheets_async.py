@@ -0,0 +1,123 @@
+# sheets_async.py
+
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import SHEETS_MAX_CONCURRENCY, STATE_BACKEND
+from services import sheets
+from services.rate_limit import PrioritySemaphore
+from services.sheets_governor import current_priority, set_pool_slot
+
+logger = logging.getLogger(__name__)
+
+# 🧵 Ограниченный пул потоков для блокирующих вызовов gspread.
+# Одновременно к таблице уходит не больше SHEETS_MAX_CONCURRENCY запросов,
+# остальные ждут в очереди пула, не блокируя event loop бота.
+# Запасные потоки занимают вызовы, которые спят перед повтором запроса и отдали своё место
+# (см. _PoolSlot): с ними у каждого занятого места всегда есть свободный поток
+_SPARE_THREADS = SHEETS_MAX_CONCURRENCY
+_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_CONCURRENCY + _SPARE_THREADS, thread_name_prefix="sheets")
+# Места в пуле раздаются по приоритету запроса (см. services.sheets_governor), а не по очереди
+# пула: иначе фоновая задача, поставившая сотню вызовов, задержала бы ответы пользователям
+_slots = PrioritySemaphore(SHEETS_MAX_CONCURRENCY)
+_sleeping = 0
+_sleeping_lock = threading.Lock()
+
+class _PoolSlot:
+    """Место в пуле, занятое вызовом; поток отдаёт его на время паузы перед повтором запроса"""
+
+    def __init__(self, loop, priority):
+        self.loop = loop
+        self.priority = priority
+
+    def release(self):
+        """Отдаёт место, если есть запасной поток; иначе вызов спит, не отдавая места"""
+        global _sleeping
+        with _sleeping_lock:
+            if _sleeping >= _SPARE_THREADS:
+                return False
+            _sleeping += 1
+        self.loop.call_soon_threadsafe(_slots.release)
+        return True
+
+    def reacquire(self):
+        global _sleeping
+        try:
+            asyncio.run_coroutine_threadsafe(_slots.acquire(self.priority), self.loop).result()
+        finally:
+            with _sleeping_lock:
+                _sleeping -= 1
+
+async def run_in_sheets_pool(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с таблицей в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    priority = current_priority()
+    # Копия контекста переносит в поток приоритет запроса и прочие ContextVar
+    context = contextvars.copy_context()
+    context.run(set_pool_slot, _PoolSlot(loop, priority))
+    await _slots.acquire(priority)
+    try:
+        return await loop.run_in_executor(_executor, context.run, functools.partial(func, *args, **kwargs))
+    finally:
+        _slots.release()
+
+# 💾 Отдельный поток для функций, которые работают только с локальной базой (состояния,
+# журнал заявок): во время сбоя Google Таблиц они не ждут в очереди за повторами запросов
+_local_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-db")
+
+async def run_in_local_pool(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с локальной базой в отдельном потоке"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_local_executor, functools.partial(func, *args, **kwargs))
+
+def _async_wrapper(func):
+    """Делает из синхронной функции services.sheets её асинхронный аналог"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_sheets_pool(func, *args, **kwargs)
+    return wrapper
+
+def _local_wrapper(func):
+    """Асинхронный аналог функции services.sheets, которая не обращается к таблице"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_local_pool(func, *args, **kwargs)
+    return wrapper
+
+# Состояния в листе UserState (STATE_BACKEND=sheets) — это запросы к таблице
+_state_wrapper = _async_wrapper if STATE_BACKEND == "sheets" else _local_wrapper
+
+# Асинхронные версии функций services.sheets — их и должны вызывать хендлеры
+add_or_update_user = _async_wrapper(sheets.add_or_update_user)
+update_user_score_in_activity = _async_wrapper(sheets.update_user_score_in_activity)
+flush_activity_totals = _async_wrapper(sheets.flush_activity_totals)
+reconcile_activity_totals = _async_wrapper(sheets.reconcile_activity_totals)
+export_rating_to_sheet = _async_wrapper(sheets.export_rating_to_sheet)
+submit_application = _local_wrapper(sheets.submit_application)
+flush_submissions = _async_wrapper(sheets.flush_submissions)
+find_submitted_link = _async_wrapper(sheets.find_submitted_link)
+get_user_scores = _async_wrapper(sheets.get_user_scores)
+get_inactive_users = _async_wrapper(sheets.get_inactive_users)
+get_submission_stats = _async_wrapper(sheets.get_submission_stats)
+set_score_and_notify_user = _async_wrapper(sheets.set_score_and_notify_user)
+set_scores_batch = _async_wrapper(sheets.set_scores_batch)
+get_pending_submissions = _async_wrapper(sheets.get_pending_submissions)
+get_all_user_ids = _async_wrapper(sheets.get_all_user_ids)
+get_top_users = _async_wrapper(sheets.get_top_users)
+check_sheet_structure = _async_wrapper(sheets.check_sheet_structure)
+save_user_state = _state_wrapper(sheets.save_user_state)
+get_user_state = _state_wrapper(sheets.get_user_state)
+clear_user_state = _state_wrapper(sheets.clear_user_state)
+get_all_user_states = _state_wrapper(sheets.get_all_user_states)
+mirror_user_states = _async_wrapper(sheets.mirror_user_states)
+import_user_states = _async_wrapper(sheets.import_user_states)
+sync_applications = _async_wrapper(sheets.sync_applications)
+
+def shutdown():
+    """Дожидается завершения запросов к таблице и локальной базе и останавливает пулы"""
+    _executor.shutdown(wait=True)
+    _local_executor.shutdown(wait=True)
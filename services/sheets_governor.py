@@ -0,0 +1,131 @@
+# sheets_governor.py
+
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+import gspread
+
+from config import (
+    SHEETS_QUOTA_PER_MINUTE, SHEETS_QUOTA_BURST, SHEETS_MAX_RETRIES, SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_MAX
+)
+from services.metrics import sheets_quota_wait, sheets_retries
+from services.rate_limit import PriorityTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# 🚦 Приоритеты запросов к таблице: чем меньше число, тем раньше запрос получает квоту
+INTERACTIVE = 0  # пользователь ждёт ответа бота
+ADMIN = 1        # выгрузки и рассылки из админ-панели
+BACKGROUND = 2   # напоминания, зеркалирование состояний, проверки по расписанию
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", ADMIN: "admin", BACKGROUND: "background"}
+
+# Коды ответов, после которых запрос стоит повторить
+RETRYABLE_CODES = (429, 500, 502, 503, 504)
+# Добавление строк не идемпотентно: после 5xx Google мог уже записать строки, и повтор
+# продублировал бы их. Такие запросы повторяются только после 429 (запрос отклонён квотой),
+# а 5xx уходит вызывающему коду (журнал заявок сам проверит, дошла ли запись)
+NON_IDEMPOTENT_RETRYABLE_CODES = (429,)
+NON_IDEMPOTENT_METHODS = frozenset({"append_row", "append_rows", "insert_row", "insert_rows"})
+
+_priority = contextvars.ContextVar("sheets_priority", default=INTERACTIVE)
+# Место в пуле потоков, которое занимает текущий вызов (см. sheets_async.run_in_sheets_pool)
+_pool_slot = contextvars.ContextVar("sheets_pool_slot", default=None)
+
+def current_priority():
+    return _priority.get()
+
+def set_sheets_priority(priority):
+    """Задаёт приоритет всех запросов к таблице из текущей задачи (и запущенных из неё)"""
+    _priority.set(priority)
+
+@contextmanager
+def sheets_priority(priority):
+    """Временно меняет приоритет запросов к таблице"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def set_pool_slot(slot):
+    """Запоминает место в пуле текущего вызова: slot.release() -> bool и slot.reacquire()"""
+    _pool_slot.set(slot)
+
+@contextmanager
+def _pool_slot_released():
+    """Отдаёт место в пуле на время паузы перед повтором: пока поток спит, запросы
+    других пользователей (и приоритетные, и к другим листам) не стоят в очереди за ним"""
+    slot = _pool_slot.get()
+    released = slot is not None and slot.release()
+    try:
+        yield
+    finally:
+        if released:
+            slot.reacquire()
+
+def _error_code(error):
+    """HTTP-код ошибки API. gspread ставит code = -1, если тело ответа не JSON
+    (например, HTML-страница 502 от балансировщика) — тогда берём статус самого ответа"""
+    code = getattr(error, "code", None)
+    if not isinstance(code, int) or not 100 <= code <= 599:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code
+
+class SheetsGovernor:
+    """Единая точка выхода к Sheets API: квота, очередь по приоритетам и повторы при 429.
+
+    Квота — токен-бакет на quota_per_minute запросов в минуту. Когда токенов нет, первым
+    получает квоту запрос с более высоким приоритетом (см. current_priority). Ответ 429
+    или 5xx ставит на паузу весь бакет (остальные тоже упёрлись бы в лимит), затем запрос
+    повторяется с экспоненциальной задержкой и случайным разбросом.
+    """
+
+    def __init__(self, quota_per_minute=SHEETS_QUOTA_PER_MINUTE, burst=SHEETS_QUOTA_BURST,
+                 max_retries=SHEETS_MAX_RETRIES, backoff_base=SHEETS_BACKOFF_BASE,
+                 backoff_max=SHEETS_BACKOFF_MAX):
+        self.bucket = PriorityTokenBucket(rate=quota_per_minute / 60, capacity=burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt):
+        """Пауза перед повтором номер attempt (с нуля): base * 2^attempt ± 50%, не больше backoff_max"""
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def call(self, func, *args, **kwargs):
+        """Вызывает func(*args, **kwargs), соблюдая квоту; при 429 / 5xx повторяет"""
+        return self._call(RETRYABLE_CODES, func, args, kwargs)
+
+    def call_non_idempotent(self, func, *args, **kwargs):
+        """Как call, но для записей, которые нельзя повторять вслепую: повтор только после 429"""
+        return self._call(NON_IDEMPOTENT_RETRYABLE_CODES, func, args, kwargs)
+
+    def _call(self, retryable_codes, func, args, kwargs):
+        priority = current_priority()
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            self.bucket.acquire(priority)
+            sheets_quota_wait.observe(time.perf_counter() - started, priority=PRIORITY_NAMES.get(priority, priority))
+            try:
+                return func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                code = _error_code(e)
+                if code not in retryable_codes or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                sheets_retries.inc(code=code)
+                logger.warning(
+                    f"[WARNING] Sheets API ответил {code}, повтор {attempt}/{self.max_retries} через {delay:.1f} с"
+                )
+                if code == 429:
+                    self.bucket.pause(delay)
+                with _pool_slot_released():
+                    time.sleep(delay)
+
+governor = SheetsGovernor()
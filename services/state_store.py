@@ -0,0 +1,138 @@
+# state_store.py
+
+import json
+import logging
+import time
+
+from services.local_db import db_lock, get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE = ("main_menu", None, None)
+
+class StateStore:
+    """Интерфейс хранилища состояний пользователей (state, data, last_message_id)"""
+
+    def save(self, user_id, state, data=None, last_message_id=None):
+        """Сохраняет состояние; last_message_id обновляется, только если передан"""
+        raise NotImplementedError
+
+    def get(self, user_id):
+        """Возвращает (state, data, last_message_id) или DEFAULT_STATE"""
+        raise NotImplementedError
+
+    def clear(self, user_id):
+        """Возвращает пользователя в главное меню без данных"""
+        raise NotImplementedError
+
+    def all(self):
+        """Возвращает список (user_id, state, data, last_message_id) для всех пользователей"""
+        raise NotImplementedError
+
+class SQLiteStateStore(StateStore):
+    """Основное хранилище состояний в локальной SQLite-базе.
+
+    Изменённые записи помечаются как незеркалированные, чтобы фоновая задача
+    могла перенести их в лист UserState.
+    """
+
+    def __init__(self):
+        with db_lock:
+            get_connection().execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                "user_id TEXT PRIMARY KEY, "
+                "state TEXT NOT NULL, "
+                "data TEXT NOT NULL DEFAULT '', "
+                "last_message_id TEXT NOT NULL DEFAULT '', "
+                "updated_at REAL NOT NULL, "
+                "mirrored INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    def save(self, user_id, state, data=None, last_message_id=None):
+        data_str = json.dumps(data) if data else ""
+        with db_lock:
+            conn = get_connection()
+            if last_message_id:
+                conn.execute(
+                    "INSERT INTO user_state (user_id, state, data, last_message_id, updated_at, mirrored) "
+                    "VALUES (?, ?, ?, ?, ?, 0) "
+                    "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "last_message_id = excluded.last_message_id, updated_at = excluded.updated_at, mirrored = 0",
+                    (str(user_id), state, data_str, str(last_message_id), time.time())
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO user_state (user_id, state, data, updated_at, mirrored) "
+                    "VALUES (?, ?, ?, ?, 0) "
+                    "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at, mirrored = 0",
+                    (str(user_id), state, data_str, time.time())
+                )
+
+    def get(self, user_id):
+        with db_lock:
+            row = get_connection().execute(
+                "SELECT state, data, last_message_id FROM user_state WHERE user_id = ?",
+                (str(user_id),)
+            ).fetchone()
+        if row is None:
+            return DEFAULT_STATE
+        return _parse_state(row[0], row[1], row[2])
+
+    def clear(self, user_id):
+        with db_lock:
+            get_connection().execute(
+                "UPDATE user_state SET state = 'main_menu', data = '', last_message_id = '', "
+                "updated_at = ?, mirrored = 0 WHERE user_id = ?",
+                (time.time(), str(user_id))
+            )
+
+    def all(self):
+        with db_lock:
+            rows = get_connection().execute(
+                "SELECT user_id, state, data, last_message_id FROM user_state"
+            ).fetchall()
+        return [(user_id, *_parse_state(state, data, last_message_id)) for user_id, state, data, last_message_id in rows]
+
+    def is_empty(self):
+        """Проверяет, что в локальной таблице ещё нет ни одного состояния"""
+        with db_lock:
+            return get_connection().execute("SELECT 1 FROM user_state LIMIT 1").fetchone() is None
+
+    def import_rows(self, rows):
+        """Загружает строки листа UserState как уже зеркалированные; существующие записи не трогает"""
+        now = time.time()
+        with transaction() as conn:
+            conn.executemany(
+                "INSERT INTO user_state (user_id, state, data, last_message_id, updated_at, mirrored) "
+                "VALUES (?, ?, ?, ?, ?, 1) ON CONFLICT(user_id) DO NOTHING",
+                [(str(user_id), state or "main_menu", data or "", last_message_id or "", now)
+                 for user_id, state, data, last_message_id in rows]
+            )
+
+    def pending_mirror(self):
+        """Возвращает незеркалированные записи как строки листа UserState и метку времени выборки"""
+        with db_lock:
+            snapshot_at = time.time()
+            rows = get_connection().execute(
+                "SELECT user_id, state, data, last_message_id FROM user_state WHERE mirrored = 0"
+            ).fetchall()
+        return [list(row) for row in rows], snapshot_at
+
+    def mark_mirrored(self, user_ids, snapshot_at):
+        """Помечает записи зеркалированными, если они не менялись после выборки"""
+        with transaction() as conn:
+            conn.executemany(
+                "UPDATE user_state SET mirrored = 1 WHERE user_id = ? AND updated_at <= ?",
+                [(user_id, snapshot_at) for user_id in user_ids]
+            )
+
+def _parse_state(state, data_str, last_message_id):
+    """Приводит сохранённые строки к (state, data, last_message_id)"""
+    try:
+        data = json.loads(data_str) if data_str else None
+    except ValueError:
+        logger.warning(f"[WARNING] Некорректные данные состояния: {data_str!r}")
+        data = None
+    last_message_id = int(last_message_id) if last_message_id and str(last_message_id).isdigit() else None
+    return state or "main_menu", data, last_message_id
@@ -0,0 +1,103 @@
+# submission_journal.py
+
+import json
+import logging
+import time
+
+from services.local_db import db_lock, get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# 📒 Журнал заявок: заявка сначала надёжно сохраняется в локальной базе, пользователь сразу
+# получает подтверждение, а в лист Заявки её переносит фоновая запись (sheets.flush_submissions).
+RETENTION = 7 * 24 * 60 * 60  # сколько хранить уже записанные в таблицу заявки (секунды)
+
+def _init_tables():
+    with db_lock:
+        get_connection().execute(
+            "CREATE TABLE IF NOT EXISTS submission_journal ("
+            "submission_id TEXT PRIMARY KEY, "
+            "row TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT NOT NULL DEFAULT '', "
+            "created_at REAL NOT NULL, "
+            "flushed_at REAL)"
+        )
+
+_init_tables()
+
+def append(submission_id, row):
+    """Сохраняет строку заявки (колонки A..J листа Заявки) до записи в таблицу"""
+    with db_lock:
+        get_connection().execute(
+            "INSERT INTO submission_journal (submission_id, row, created_at) VALUES (?, ?, ?)",
+            (submission_id, json.dumps(row, ensure_ascii=False), time.time())
+        )
+
+def pending(limit=None):
+    """Заявки, ещё не записанные в таблицу, в порядке подачи: [(submission_id, строка, попыток)]"""
+    query = "SELECT submission_id, row, attempts FROM submission_journal WHERE status = 'pending' ORDER BY created_at, rowid"
+    params = ()
+    if limit:
+        query += " LIMIT ?"
+        params = (limit,)
+    with db_lock:
+        rows = get_connection().execute(query, params).fetchall()
+    return [(submission_id, json.loads(row), attempts) for submission_id, row, attempts in rows]
+
+def pending_rows():
+    """Строки незаписанных заявок — их нужно видеть в кэше Заявок, пока они не попали в лист"""
+    return [row for _, row, _ in pending()]
+
+def pending_ids():
+    with db_lock:
+        rows = get_connection().execute(
+            "SELECT submission_id FROM submission_journal WHERE status = 'pending'"
+        ).fetchall()
+    return {row[0] for row in rows}
+
+def is_pending(submission_id):
+    with db_lock:
+        row = get_connection().execute(
+            "SELECT 1 FROM submission_journal WHERE submission_id = ? AND status = 'pending'", (submission_id,)
+        ).fetchone()
+    return row is not None
+
+def pending_count():
+    with db_lock:
+        return get_connection().execute(
+            "SELECT COUNT(*) FROM submission_journal WHERE status = 'pending'"
+        ).fetchone()[0]
+
+def mark_flushed(submission_ids):
+    """Отмечает заявки записанными и удаляет из журнала записанные давно"""
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE submission_journal SET status = 'flushed', flushed_at = ?, error = '' WHERE submission_id = ?",
+            [(now, submission_id) for submission_id in submission_ids]
+        )
+        conn.execute(
+            "DELETE FROM submission_journal WHERE status = 'flushed' AND flushed_at < ?", (now - RETENTION,)
+        )
+
+def mark_in_flight(submission_ids):
+    """Увеличивает счётчик попыток до отправки в таблицу.
+
+    Если бот упадёт после append_rows, но до mark_flushed, следующая запись увидит попытку
+    и сначала проверит, не попала ли заявка в лист.
+    """
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE submission_journal SET attempts = attempts + 1 WHERE submission_id = ?",
+            [(submission_id,) for submission_id in submission_ids]
+        )
+
+def mark_failed(submission_ids, error):
+    """Запоминает ошибку записи; заявки остаются в журнале до следующей попытки"""
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE submission_journal SET error = ? WHERE submission_id = ?",
+            [(str(error)[:500], submission_id) for submission_id in submission_ids]
+        )
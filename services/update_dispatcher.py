@@ -0,0 +1,126 @@
+# update_dispatcher.py
+
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher, types
+
+from config import UPDATE_WORKERS, UPDATE_PARTITION_QUEUE_SIZE, UPDATE_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+# Поля Update, у которых есть отправитель (from_user или user)
+_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request"
+)
+
+def partition_key(update: types.Update):
+    """Id пользователя, от которого пришло обновление (или чата / самого обновления)"""
+    for field in _USER_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is None:
+            continue
+        user = getattr(obj, "from_user", None) or getattr(obj, "user", None)
+        if user is not None:
+            return user.id
+    post = update.channel_post or update.edited_channel_post
+    if post is not None:
+        return post.chat.id
+    return update.update_id
+
+class PartitionedDispatcher(Dispatcher):
+    """Dispatcher, который обрабатывает обновления несколькими параллельными воркерами.
+
+    Обновления делятся на партиции по user_id: у каждой партиции своя очередь и один воркер,
+    поэтому сообщения одного пользователя обрабатываются строго по порядку, а разные
+    пользователи не ждут друг друга. Обновление кладётся в очередь без ожидания (put_nowait),
+    так что пачки не обгоняют друг друга и заполненная партиция не задерживает остальные.
+    Партиция с partition_queue_size обновлениями считается перегруженной: webhook по
+    is_overloaded() отвечает 503, а в режиме polling обновления ждут в очереди сверх лимита.
+    """
+
+    def __init__(self, *args, workers=UPDATE_WORKERS, partition_queue_size=UPDATE_PARTITION_QUEUE_SIZE,
+                 max_pending=UPDATE_MAX_PENDING, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workers = workers
+        self.partition_queue_size = partition_queue_size
+        self.max_pending = max_pending
+        self._partitions = []
+        self._worker_tasks = []
+
+    def _ensure_workers(self):
+        if self._worker_tasks:
+            return
+        # Очереди без предела: лимит партиции проверяет is_overloaded, а не блокирующий put
+        self._partitions = [asyncio.Queue() for _ in range(self.workers)]
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(queue), name=f"updates-{index}")
+            for index, queue in enumerate(self._partitions)
+        ]
+        logger.info(f"Update workers started: {self.workers} partitions")
+
+    async def _worker(self, queue):
+        Bot.set_current(self.bot)
+        Dispatcher.set_current(self)
+        while True:
+            update, future = await queue.get()
+            try:
+                # Отдельная задача — отдельная копия контекста: aiogram кэширует состояние FSM
+                # в ContextVar, и при обработке прямо в воркере оно «протекало» бы в следующее обновление
+                result = await asyncio.create_task(self.updates_handler.notify(update))
+            except Exception as e:
+                logger.exception(f"[ERROR] Ошибка обработки обновления {update.update_id}: {e}")
+                result = []
+            finally:
+                queue.task_done()
+            if not future.done():
+                future.set_result(result)
+
+    async def process_updates(self, updates, fast: bool = True):
+        """Раскладывает обновления по партициям и ждёт их обработки"""
+        self._ensure_workers()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for update in updates:
+            future = loop.create_future()
+            queue = self._partition(update)
+            if queue.qsize() == self.partition_queue_size:
+                logger.warning(f"[WARNING] Очередь обновлений партиции переполнена ({queue.qsize()})")
+            queue.put_nowait((update, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    def _partition(self, update):
+        return self._partitions[partition_key(update) % self.workers]
+
+    def pending(self):
+        """Сколько обновлений ждёт обработки во всех партициях"""
+        return sum(queue.qsize() for queue in self._partitions)
+
+    def is_overloaded(self, update=None):
+        """Перегружен ли диспетчер: всего ожидает max_pending обновлений или заполнена
+        партиция обновления update (без update — любая партиция)"""
+        if self.pending() >= self.max_pending:
+            return True
+        if not self._partitions:
+            return False
+        if update is not None:
+            return self._partition(update).qsize() >= self.partition_queue_size
+        return any(queue.qsize() >= self.partition_queue_size for queue in self._partitions)
+
+    def queue_depths(self):
+        return [queue.qsize() for queue in self._partitions]
+
+    async def wait_idle(self, timeout=None):
+        """Дожидается обработки всех принятых обновлений (при остановке бота)"""
+        if not self._partitions:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._partitions)),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"[WARNING] Не дождались обработки {self.pending()} обновлений")
@@ -0,0 +1,99 @@
+# url_index.py
+
+import logging
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Параметры, которые добавляют соцсети и рекламные метки — на сам пост не влияют
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "yclid", "ysclid", "igshid", "igsh", "si", "ref", "ref_src", "from",
+    "share", "feature", "_rdr", "_smt", "utm", "single"
+}
+# Разные адреса одного и того же сайта
+HOST_ALIASES = {
+    "m.vk.com": "vk.com",
+    "vk.ru": "vk.com",
+    "m.vk.ru": "vk.com",
+    "telegram.me": "t.me",
+    "telegram.dog": "t.me",
+    "m.ok.ru": "ok.ru",
+    "m.youtube.com": "youtube.com",
+    "mobile.twitter.com": "twitter.com",
+    "x.com": "twitter.com",
+}
+
+def normalize_url(url):
+    """Приводит ссылку на пост к каноническому виду для поиска повторов.
+
+    Схема и «www.» отбрасываются, мобильные и альтернативные домены сводятся к основному,
+    убираются метки отслеживания, якорь и завершающий слэш.
+    """
+    url = (url or "").strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    host = HOST_ALIASES.get(host, host)
+
+    path = parts.path.rstrip("/")
+    params = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")
+    ]
+
+    if host == "vk.com":
+        # vk.com/club1?w=wall-1_2 и vk.com/wall-1_2 — один и тот же пост
+        wall = next((value for key, value in params if key == "w" and value.startswith("wall")), None)
+        if wall:
+            path = "/" + wall
+            params = []
+    elif host == "t.me" and path.startswith("/s/"):
+        # Веб-превью канала: t.me/s/channel/123 → t.me/channel/123
+        path = path[2:]
+
+    key = host + path
+    if params:
+        key += "?" + urlencode(sorted(params))
+    return key
+
+class UrlIndex:
+    """Множество нормализованных ссылок из листа Заявки: проверка повтора за O(1)"""
+
+    def __init__(self):
+        self._submissions = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def rebuild(self, rows):
+        """Пересобирает индекс по строкам листа Заявки (без заголовка)"""
+        submissions = {}
+        for row in rows:
+            if len(row) >= 5 and row[4].strip():
+                submissions.setdefault(normalize_url(row[4]), row[3])
+        with self._lock:
+            self._submissions = submissions
+            self._loaded = True
+        logger.info(f"URL index rebuilt: {len(submissions)} links")
+
+    def add(self, url, submission_id):
+        with self._lock:
+            self._submissions.setdefault(normalize_url(url), submission_id)
+
+    def lookup(self, url):
+        """Возвращает заявка_id, с которой ссылка уже подавалась, либо None"""
+        with self._lock:
+            return self._submissions.get(normalize_url(url))
+
+    def __len__(self):
+        return len(self._submissions)
+
+url_index = UrlIndex()
@@ -0,0 +1,122 @@
+# webhook.py
+
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from services.metrics import metrics_handler
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    """Приём обновлений Telegram через webhook на aiohttp.
+
+    Обновление подтверждается сразу (200), а обрабатывается в фоне — Telegram не ждёт
+    ответа обработчиков. При остановке новые обновления отклоняются (503, Telegram
+    повторит их позже), а уже принятые дорабатываются не дольше drain_timeout секунд.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, path, secret_token=None, drain_timeout=30):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self._in_flight = set()
+
+    def _check_secret(self, request):
+        # Без секрета любой, кто знает адрес, мог бы присылать поддельные обновления
+        if not self.secret_token:
+            return False
+        received = request.headers.get(SECRET_HEADER, "")
+        return hmac.compare_digest(received.encode(), self.secret_token.encode())
+
+    async def handle_update(self, request):
+        if not self._check_secret(request):
+            logger.warning(f"[WARNING] Webhook: неверный секрет от {request.remote}")
+            return web.Response(status=401)
+        if self.draining:
+            return web.Response(status=503)
+        try:
+            update = Update(**(await request.json()))
+        except Exception as e:
+            logger.error(f"[ERROR] Webhook: некорректное обновление: {e}")
+            return web.Response(status=400)
+        overloaded = getattr(self.dispatcher, "is_overloaded", None)
+        if overloaded is not None and overloaded(update):
+            # Очередь этого пользователя (или все очереди) заполнена — Telegram повторит обновление позже
+            return web.Response(status=503)
+
+        # Контекст бота нужен обработчикам (message.answer и т.п.), задача его унаследует
+        Dispatcher.set_current(self.dispatcher)
+        Bot.set_current(self.dispatcher.bot)
+        task = asyncio.create_task(self._process(update))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        return web.Response(status=200)
+
+    async def _process(self, update):
+        try:
+            await self.dispatcher.process_updates([update])
+        except Exception as e:
+            logger.error(f"[ERROR] Webhook: ошибка обработки обновления {update.update_id}: {e}")
+
+    async def health(self, request):
+        """Для балансировщика: 503 во время остановки, чтобы на бота перестали слать запросы"""
+        status = 503 if self.draining else 200
+        return web.json_response(
+            {"status": "draining" if self.draining else "ok", "in_flight": len(self._in_flight)},
+            status=status
+        )
+
+    async def drain(self):
+        """Перестаёт принимать обновления и дожидается уже принятых"""
+        self.draining = True
+        if not self._in_flight:
+            return
+        logger.info(f"Webhook: ожидаем завершения {len(self._in_flight)} обработчиков...")
+        _, pending = await asyncio.wait(set(self._in_flight), timeout=self.drain_timeout)
+        if pending:
+            logger.warning(f"[WARNING] Webhook: {len(pending)} обработчиков не успели завершиться, отменяем")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.health)
+        app.router.add_get("/metrics", metrics_handler)
+        return app
+
+def run_webhook(dispatcher: Dispatcher, webhook_url, path, secret_token=None, host="0.0.0.0", port=8080,
+                drain_timeout=30, on_startup=None, on_shutdown=None):
+    """Регистрирует webhook в Telegram и запускает aiohttp-сервер до SIGINT/SIGTERM"""
+    server = WebhookServer(dispatcher, path, secret_token, drain_timeout)
+    app = server.make_app()
+
+    async def startup(_):
+        await dispatcher.bot.set_webhook(webhook_url, secret_token=secret_token or None)
+        logger.info(f"Webhook установлен: {webhook_url}")
+        if on_startup:
+            await on_startup(dispatcher)
+
+    async def shutdown(_):
+        # Сначала дорабатываем принятые обновления, потом останавливаем фоновые задачи бота
+        await server.drain()
+        if on_shutdown:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        session = await dispatcher.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=host, port=port, shutdown_timeout=drain_timeout)
@@ -0,0 +1,25 @@
+# test_gpt_cache.py
+
+from services.gpt_cache import AnswerCache
+
+def make_cache(*questions):
+    cache = AnswerCache(max_size=100, ttl=3600, similarity=0.85)
+    for question in questions:
+        cache.put(question, f"ответ: {question}")
+    return cache
+
+def test_near_duplicate_question_hits():
+    cache = make_cache("Где посмотреть рейтинг?")
+    assert cache.get("Здравствуйте, где посмотреть рейтинга?") == "ответ: Где посмотреть рейтинг?"
+
+def test_negation_is_not_ignored():
+    cache = make_cache("Почему мне начислили баллы?")
+    assert cache.get("Почему мне не начислили баллы?") is None
+
+def test_negation_in_cached_question_is_not_ignored():
+    cache = make_cache("Почему мне не начислили баллы?")
+    assert cache.get("Почему мне начислили баллы?") is None
+
+def test_question_word_is_not_ignored():
+    cache = make_cache("Где посмотреть рейтинг?")
+    assert cache.get("Когда посмотреть рейтинг?") is None
@@ -0,0 +1,114 @@
+# fake_telegram.py
+#
+# Локальная проверка режима webhook без настоящего Telegram:
+#   1) python tools/fake_telegram.py --api-port 8081 --webhook http://localhost:8080/webhook --secret s3cret
+#   2) BOT_MODE=webhook WEBHOOK_HOST=http://localhost:8080 WEBHOOK_SECRET=s3cret \
+#      TELEGRAM_API_SERVER=http://localhost:8081 python main.py
+# Скрипт поднимает фейковый Bot API (отвечает «ok» на любые методы и печатает, что бот отправил)
+# и шлёт на webhook синтетические обновления от нескольких пользователей.
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_message_ids = itertools.count(1000)
+_update_ids = itertools.count(1)
+
+def fake_message(chat_id, text=""):
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id), "type": "private"},
+        "from": {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"},
+        "text": text
+    }
+
+async def bot_api(request):
+    """Отвечает на вызовы Bot API так, как ответил бы Telegram"""
+    method = request.match_info["method"]
+    if request.content_type == "application/json":
+        params = await request.json()
+    else:
+        params = dict(await request.post())
+    print(f"<- {method} {json.dumps(params, ensure_ascii=False)[:200]}")
+
+    if method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+    elif method == "copyMessage":
+        result = {"message_id": next(_message_ids)}
+    elif method.startswith("send") or method.startswith("edit"):
+        result = fake_message(params.get("chat_id", 0), params.get("text", ""))
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+def make_update(user_id, text=None, callback_data=None):
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    update = {"update_id": next(_update_ids)}
+    if callback_data:
+        update["callback_query"] = {
+            "id": str(update["update_id"]),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": callback_data,
+            "message": {**fake_message(user_id, "👇 Главное меню:"), "from": user}
+        }
+    else:
+        update["message"] = {**fake_message(user_id, text), "from": user}
+        if text.startswith("/"):
+            update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return update
+
+async def post(session, url, payload, headers):
+    async with session.post(url, json=payload, headers=headers) as response:
+        return response.status
+
+async def send_updates(webhook, secret, users, rounds):
+    headers = {SECRET_HEADER: secret} if secret else {}
+    script = [("/start", None), (None, "info"), ("/menu", None)]
+    async with aiohttp.ClientSession() as session:
+        for _ in range(rounds):
+            for text, callback_data in script:
+                started = time.monotonic()
+                statuses = await asyncio.gather(*(
+                    post(session, webhook, make_update(user_id, text, callback_data), headers)
+                    for user_id in range(100000, 100000 + users)
+                ))
+                elapsed = (time.monotonic() - started) * 1000
+                print(f"-> {text or callback_data}: {statuses} за {elapsed:.0f} мс")
+                await asyncio.sleep(1)
+        # Запрос с неверным секретом должен быть отклонён
+        status = await post(session, webhook, make_update(1, "/start"), {SECRET_HEADER: "wrong"})
+        print(f"-> неверный секрет: {status}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram для проверки webhook-режима бота")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook", default="http://localhost:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--wait", type=float, default=5, help="сколько секунд ждать запуска бота")
+    args = parser.parse_args()
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", bot_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", args.api_port).start()
+    print(f"Фейковый Bot API слушает http://localhost:{args.api_port}")
+
+    await asyncio.sleep(args.wait)
+    await send_updates(args.webhook, args.secret, args.users, args.rounds)
+    await asyncio.sleep(2)  # даём боту дослать ответы
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())